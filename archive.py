@@ -0,0 +1,375 @@
+"""
+Archivo columnar del historial frío de ubicaciones.
+
+Las ubicaciones con más de ARCHIVE_AFTER_DAYS días salen de la tabla
+`locations` hacia archivos por dispositivo y por mes:
+
+    ARCHIVE_DIR/<id interno del dispositivo>/<AAAA-MM>/{id,ts,lat,lng}.npy
+
+Cada columna es un .npy ordenado por timestamp y se lee con memmap, así
+que las consultas sobre el archivo (búsqueda binaria por fecha, sumas de
+distancia) no pasan por la BD ni cargan el mes entero en memoria.
+
+Los meses de cada dispositivo y los memmaps abiertos se cachean en el
+proceso: una consulta de toda la flota no lista un directorio por
+dispositivo. Cada escritura reemplaza el archivo ARCHIVE_DIR/.version y
+los lectores lo revisan como mucho cada ARCHIVE_CHECK_SECONDS; si cambió
+(también desde archive.py en otro proceso) vacían la caché.
+
+Para archivar: python archive.py --days 90
+"""
+
+import argparse
+import bisect
+import os
+import shutil
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+import numpy as np
+
+import geo
+
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "archive")
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "90"))
+
+# Cada cuánto se revisa si otro proceso escribió el archivo (segundos)
+ARCHIVE_CHECK_SECONDS = float(os.getenv("ARCHIVE_CHECK_SECONDS", "1"))
+
+# Meses abiertos con memmap a la vez (cada columna mantiene un descriptor)
+MAX_OPEN_MONTHS = 64
+
+# Marca que cada escritura reemplaza (sus lectores vacían la caché)
+VERSION_FILE = ".version"
+
+COLUMNS = (("id", "<i8"), ("ts", "datetime64[us]"), ("lat", "<f8"), ("lng", "<f8"))
+
+
+def device_dir(device_pk):
+    return os.path.join(ARCHIVE_DIR, str(device_pk))
+
+
+_months = {}
+_generation = None
+_checked_at = None
+_open_months = OrderedDict()
+_open_lock = threading.Lock()
+
+
+def _refresh():
+    """Versión vigente del archivo; si cambió se vacía la caché de meses"""
+    global _generation, _checked_at
+    now = time.monotonic()
+    with _open_lock:
+        if _checked_at is not None and now - _checked_at < ARCHIVE_CHECK_SECONDS:
+            return _generation
+        _checked_at = now
+    try:
+        info = os.stat(os.path.join(ARCHIVE_DIR, VERSION_FILE))
+        generation = (info.st_ino, info.st_mtime_ns)
+    except FileNotFoundError:
+        generation = None
+    with _open_lock:
+        if generation != _generation:
+            _generation = generation
+            _months.clear()
+        return _generation
+
+
+def _mark_changed():
+    """Reemplazar la marca de versión después de escribir o borrar meses"""
+    global _checked_at
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    tmp_path = os.path.join(ARCHIVE_DIR, f"{VERSION_FILE}.{os.getpid()}.tmp")
+    with open(tmp_path, "w") as marker:
+        marker.write(uuid.uuid4().hex)
+    os.replace(tmp_path, os.path.join(ARCHIVE_DIR, VERSION_FILE))
+    with _open_lock:
+        # Este proceso lo ve en la próxima lectura, sin esperar ARCHIVE_CHECK_SECONDS
+        _checked_at = None
+
+
+def list_months(device_pk):
+    """Meses archivados del dispositivo (AAAA-MM), en orden cronológico"""
+    _refresh()
+    months = _months.get(device_pk)
+    if months is None:
+        try:
+            names = os.listdir(device_dir(device_pk))
+        except FileNotFoundError:
+            names = []
+        months = _months[device_pk] = tuple(sorted(
+            name for name in names if len(name) == 7 and name[4] == "-"
+        ))
+    return months
+
+
+def open_month(device_pk, month):
+    """Columnas del mes como memmaps de solo lectura"""
+    path = os.path.join(device_dir(device_pk), month)
+    # Reescribir un mes cambia la versión del archivo: la clave invalida la caché
+    key = (path, _refresh())
+    with _open_lock:
+        columns = _open_months.get(key)
+        if columns is not None:
+            _open_months.move_to_end(key)
+            return columns
+
+    columns = {
+        name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r")
+        for name, _ in COLUMNS
+    }
+    with _open_lock:
+        _open_months[key] = columns
+        while len(_open_months) > MAX_OPEN_MONTHS:
+            _open_months.popitem(last=False)
+    return columns
+
+
+def write_month(device_pk, month, ids, ts, lat, lng):
+    """Agregar filas al mes (fusiona con lo ya archivado, sin duplicar ids)"""
+    path = os.path.join(device_dir(device_pk), month)
+    new = {"id": ids, "ts": ts, "lat": lat, "lng": lng}
+
+    if os.path.isdir(path):
+        old = open_month(device_pk, month)
+        merged = {name: np.concatenate([np.asarray(old[name]), new[name]]) for name, _ in COLUMNS}
+    else:
+        merged = new
+
+    # Un archivado interrumpido antes de borrar las filas las vuelve a traer
+    _, unique = np.unique(merged["id"], return_index=True)
+    order = unique[np.lexsort((merged["id"][unique], merged["ts"][unique]))]
+    _save_month(path, {name: merged[name][order] for name, _ in COLUMNS})
+    return len(order)
+
+
+def _save_month(path, columns):
+    # Se escribe en un directorio temporal y se intercambia, así un lector
+    # nunca ve columnas de largos distintos
+    tmp_path = path + ".tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    for name, dtype in COLUMNS:
+        np.save(os.path.join(tmp_path, f"{name}.npy"), np.asarray(columns[name]).astype(dtype))
+
+    old_path = path + ".old"
+    if os.path.isdir(path):
+        os.rename(path, old_path)
+    os.rename(tmp_path, path)
+    shutil.rmtree(old_path, ignore_errors=True)
+    _mark_changed()
+
+
+def archive_locations(db, older_than_days=ARCHIVE_AFTER_DAYS, batch_size=50000):
+    """Mover a archivo las ubicaciones más antiguas que el umbral; devuelve filas quitadas de la tabla"""
+    from models import Location
+
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    device_pks = [pk for (pk,) in db.query(Location.device_id).filter(
+        Location.timestamp < cutoff
+    ).distinct()]
+
+    total = 0
+    for device_pk in device_pks:
+        while True:
+            rows = db.query(
+                Location.id, Location.timestamp, Location.latitude, Location.longitude,
+                Location.is_outlier
+            ).filter(
+                Location.device_id == device_pk,
+                Location.timestamp < cutoff
+            ).order_by(Location.id).limit(batch_size).all()
+            if not rows:
+                break
+
+            last_id = rows[-1].id
+            total += len(rows)
+            # Los fixes atípicos del filtro GPS no pasan al archivo
+            rows = [row for row in rows if not row.is_outlier]
+            ids = np.array([row.id for row in rows], dtype="<i8")
+            ts = np.array([row.timestamp for row in rows], dtype="datetime64[us]")
+            lat = np.array([row.latitude for row in rows], dtype="<f8")
+            lng = np.array([row.longitude for row in rows], dtype="<f8")
+
+            months = ts.astype("datetime64[M]")
+            for month in np.unique(months):
+                mask = months == month
+                write_month(device_pk, str(month), ids[mask], ts[mask], lat[mask], lng[mask])
+
+            # Los archivos ya están escritos: borrar exactamente este lote
+            db.query(Location).filter(
+                Location.device_id == device_pk,
+                Location.timestamp < cutoff,
+                Location.id <= last_id
+            ).delete(synchronize_session=False)
+            db.commit()
+
+    return total
+
+
+def last_id(device_pk):
+    """Mayor id de ubicación archivado del dispositivo (0 si no tiene archivo)"""
+    return max((int(open_month(device_pk, month)["id"].max())
+                for month in list_months(device_pk)), default=0)
+
+
+def delete_device(device_pk, max_id=None):
+    """Eliminar el archivo del dispositivo (o solo los ids <= max_id); devuelve filas eliminadas"""
+    if max_id is None:
+        count = sum(len(open_month(device_pk, month)["id"]) for month in list_months(device_pk))
+        shutil.rmtree(device_dir(device_pk), ignore_errors=True)
+        _mark_changed()
+        return count
+
+    count = 0
+    for month in list_months(device_pk):
+        columns = open_month(device_pk, month)
+        keep = np.asarray(columns["id"]) > max_id
+        removed = len(keep) - int(keep.sum())
+        if not removed:
+            continue
+        count += removed
+        path = os.path.join(device_dir(device_pk), month)
+        if keep.any():
+            _save_month(path, {name: np.asarray(columns[name])[keep] for name, _ in COLUMNS})
+        else:
+            shutil.rmtree(path, ignore_errors=True)
+            _mark_changed()
+    return count
+
+
+def _to_datetime64(value):
+    return np.datetime64(value, "us") if value is not None else None
+
+
+def _as_datetime(value):
+    return value.astype(datetime) if isinstance(value, np.datetime64) else value
+
+
+def _month_slice(ts, desde=None, hasta=None):
+    """Índices [inicio, fin) del rango de fechas por búsqueda binaria"""
+    start = int(np.searchsorted(ts, desde, "left")) if desde is not None else 0
+    end = int(np.searchsorted(ts, hasta, "right")) if hasta is not None else len(ts)
+    return start, end
+
+
+def bracket(device_pk, at):
+    """
+    Últimas (ts, lat, lng) archivadas hasta `at` y primeras posteriores, por
+    búsqueda binaria en el mes de `at` y los vecinos; None si no hay.
+    """
+    at64 = _to_datetime64(at)
+    months = list_months(device_pk)
+    # Meses hasta el de `at` inclusive: months[:split]
+    split = bisect.bisect_right(months, at.strftime("%Y-%m"))
+
+    before = None
+    for month in reversed(months[:split]):
+        columns = open_month(device_pk, month)
+        index = int(np.searchsorted(columns["ts"], at64, "right"))
+        if index:
+            before = _point(columns, index - 1)
+            break
+
+    after = None
+    for month in months[max(split - 1, 0):]:
+        columns = open_month(device_pk, month)
+        index = int(np.searchsorted(columns["ts"], at64, "right"))
+        if index < len(columns["ts"]):
+            after = _point(columns, index)
+            break
+    return before, after
+
+
+def _point(columns, index):
+    return (columns["ts"][index].astype(datetime), float(columns["lat"][index]), float(columns["lng"][index]))
+
+
+def latest_rows(device_pk, limit, before=None):
+    """Filas archivadas más recientes (anteriores a `before`), de la más nueva a la más vieja"""
+    before = _to_datetime64(before)
+    rows = []
+    for month in reversed(list_months(device_pk)):
+        if len(rows) >= limit:
+            break
+        columns = open_month(device_pk, month)
+        end = int(np.searchsorted(columns["ts"], before, "left")) if before is not None else len(columns["ts"])
+        start = max(0, end - (limit - len(rows)))
+        for i in range(end - 1, start - 1, -1):
+            rows.append({
+                "id": int(columns["id"][i]),
+                "device_id": device_pk,
+                "latitude": float(columns["lat"][i]),
+                "longitude": float(columns["lng"][i]),
+                "timestamp": columns["ts"][i].astype(datetime),
+            })
+    return rows
+
+
+def count_rows(device_pk, desde=None, hasta=None):
+    desde, hasta = _to_datetime64(desde), _to_datetime64(hasta)
+    total = 0
+    for month in list_months(device_pk):
+        start, end = _month_slice(open_month(device_pk, month)["ts"], desde, hasta)
+        total += max(0, end - start)
+    return total
+
+
+class TrackStats:
+    """Conteo, extremos y distancia recorrida, alimentado por trozos en orden cronológico"""
+
+    def __init__(self):
+        self.count = 0
+        self.first_at = None
+        self.last_at = None
+        self.distance_m = 0.0
+        self._prev = None
+
+    def feed(self, ts, lat, lng):
+        if not len(ts):
+            return
+        if self._prev is not None:
+            # Unir con el último punto del trozo anterior
+            lat = np.concatenate([[self._prev[0]], lat])
+            lng = np.concatenate([[self._prev[1]], lng])
+        else:
+            self.first_at = _as_datetime(ts[0])
+        self.distance_m += float(geo.haversine_m_array(lat[:-1], lng[:-1], lat[1:], lng[1:]).sum())
+        self.count += len(ts)
+        self.last_at = _as_datetime(ts[-1])
+        self._prev = (float(lat[-1]), float(lng[-1]))
+
+    def feed_archive(self, device_pk, desde=None, hasta=None):
+        desde, hasta = _to_datetime64(desde), _to_datetime64(hasta)
+        for month in list_months(device_pk):
+            columns = open_month(device_pk, month)
+            start, end = _month_slice(columns["ts"], desde, hasta)
+            if end > start:
+                self.feed(
+                    columns["ts"][start:end],
+                    columns["lat"][start:end],
+                    columns["lng"][start:end]
+                )
+
+
+if __name__ == "__main__":
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    from database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Archivar el historial frío de ubicaciones")
+    parser.add_argument("--days", type=int, default=ARCHIVE_AFTER_DAYS,
+                        help="Archivar ubicaciones con más de estos días")
+    parser.add_argument("--batch-size", type=int, default=50000)
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        moved = archive_locations(db, args.days, args.batch_size)
+        print(f"✅ {moved} ubicaciones archivadas en {ARCHIVE_DIR}/")
+    finally:
+        db.close()
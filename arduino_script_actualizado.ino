@@ -19,6 +19,7 @@ SoftwareSerial gpsSerial(PIN_RX_GPS, PIN_TX_GPS); // RX, TX
 
 // Estado
 bool modoSeguridad = false; // Se actualiza desde el servidor
+unsigned long intervaloReporte = 10; // Segundos entre ciclos, lo recomienda el servidor
 String deviceID = "ESP32SIM800001"; // ID único del dispositivo
 
 // URLs del servidor API - CAMBIAR POR TU SERVIDOR
@@ -72,7 +73,7 @@ void loop() {
     enviarAlertaMovimiento();
   }
 
-  delay(10000); // Esperar 10 segundos antes del próximo ciclo
+  delay(intervaloReporte * 1000UL); // Esperar lo que recomendó el servidor antes del próximo ciclo
 }
 
 // ---------------------------- FUNCIONES ----------------------------
@@ -162,14 +163,24 @@ void actualizarModoSeguridad() {
   sim800.println("AT+HTTPTERM");
 
   // Parsear respuesta JSON de la API
-  // La API devuelve: {"device_id":"ESP32SIM800001","modo_seguridad":true}
+  // La API devuelve: {"device_id":"ESP32SIM800001","modo_seguridad":true,"intervalo_s":60}
   if (respuesta.indexOf("\"modo_seguridad\":true") != -1) {
     modoSeguridad = true;
   } else if (respuesta.indexOf("\"modo_seguridad\":false") != -1) {
     modoSeguridad = false;
   }
 
+  // Intervalo recomendado (más corto en movimiento o con alertas, más largo estacionado)
+  int posIntervalo = respuesta.indexOf("\"intervalo_s\":");
+  if (posIntervalo != -1) {
+    long intervalo = respuesta.substring(posIntervalo + 14).toInt();
+    if (intervalo >= 5 && intervalo <= 3600) {
+      intervaloReporte = intervalo;
+    }
+  }
+
   Serial.println("Modo Seguridad actualizado: " + String(modoSeguridad ? "ACTIVADO" : "DESACTIVADO"));
+  Serial.println("Próximo reporte en " + String(intervaloReporte) + " s");
   Serial.println("Respuesta servidor: " + respuesta);
 }
 
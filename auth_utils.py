@@ -7,6 +7,9 @@ from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from sqlalchemy.orm import Session
 import os
 
+from database import get_read_db_for
+import versioning
+
 # Configuración
 SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-change-in-production")
 ALGORITHM = "HS256"
@@ -50,6 +53,13 @@ def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
     except JWTError:
         raise credentials_exception
 
+def token_subject(token: str) -> Optional[str]:
+    """Email de un token JWT válido, o None (sin lanzar excepción)"""
+    try:
+        return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM]).get("sub")
+    except JWTError:
+        return None
+
 def get_current_user(db: Session, email: str):
     """Obtener usuario actual desde la base de datos"""
     from models import User
@@ -59,4 +69,13 @@ def get_current_user(db: Session, email: str):
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Usuario no encontrado"
         )
+    # Para el read-your-writes: los commits de esta sesión son escrituras del usuario
+    db.info["user_email"] = email
+    # Para responder 304 sin consultar la BD (versioning.py), solo con la cuenta activa
+    if user.is_active:
+        versioning.remember_user(email, user.id)
     return user
+
+def get_read_db(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    """Sesión para endpoints de solo lectura (réplica si está configurada)"""
+    yield from get_read_db_for(verify_token(credentials))
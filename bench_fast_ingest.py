@@ -0,0 +1,135 @@
+"""
+Benchmark de la ruta rápida del firmware contra los routers de FastAPI.
+
+Llama a la app ASGI en proceso (sin servidor ni red), de a una petición
+por vez, para location, alert y modo por /api y por la ruta rápida.
+Reporta peticiones por segundo de pared y por segundo de CPU (req/s por
+núcleo). Usa una base SQLite temporal y desactiva el rate limit.
+
+Uso:
+    python bench_fast_ingest.py --requests 3000
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+
+def build_request(method, path, body=None):
+    """Scope y cuerpo de una petición HTTP como los arma un servidor ASGI"""
+    headers = [(b"host", b"bench")]
+    if body is not None:
+        headers += [(b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode())]
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+        "method": method, "scheme": "http", "path": path, "raw_path": path.encode(),
+        "root_path": "", "query_string": b"", "headers": headers,
+        "client": ("127.0.0.1", 50000), "server": ("bench", 80),
+    }
+    return scope, body or b""
+
+
+async def call(app, method, path, body=None):
+    scope, body = build_request(method, path, body)
+    status_code = None
+
+    async def receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    async def send(message):
+        nonlocal status_code
+        if message["type"] == "http.response.start":
+            status_code = message["status"]
+
+    await app(scope, receive, send)
+    return status_code
+
+
+async def measure(app, method, path, bodies, expected):
+    """(req/s de pared, req/s de CPU) de una serie de peticiones"""
+    start_wall = time.perf_counter()
+    start_cpu = time.process_time()
+    for body in bodies:
+        status_code = await call(app, method, path, body)
+        if status_code != expected:
+            raise RuntimeError(f"{method} {path} respondió {status_code}")
+    wall = time.perf_counter() - start_wall
+    cpu = time.process_time() - start_cpu
+    return len(bodies) / wall, len(bodies) / max(cpu, 1e-9)
+
+
+def location_bodies(device_id, count):
+    return [json.dumps({"id": device_id, "lat": -25.2637 + i * 1e-5, "lng": -57.5759}).encode()
+            for i in range(count)]
+
+
+def alert_bodies(device_id, count):
+    return [json.dumps({"id": device_id, "evento": "movimiento", "lat": -25.2637, "lng": -57.5759}).encode()
+            for _ in range(count)]
+
+
+async def run(args):
+    from main import app
+    import fast_ingest
+    import migrations
+    from database import SessionLocal, engine
+    from models import User, Device
+
+    migrations.upgrade(engine)
+    db = SessionLocal()
+    user = User(email="bench@bench.local", username="bench", hashed_password="x")
+    db.add(user)
+    db.commit()
+    for device_id in ("BENCH-API", "BENCH-FW"):
+        db.add(Device(device_id=device_id, name=device_id, owner_id=user.id))
+    db.commit()
+    db.close()
+
+    fast = fast_ingest.FAST_INGEST_PREFIX
+    cases = [
+        ("Ubicación", "POST", "/api/ubicaciones/", f"{fast}/ubicaciones", location_bodies, 201),
+        ("Alerta", "POST", "/api/alertas/", f"{fast}/alertas", alert_bodies, 201),
+        ("Modo", "GET", "/api/dispositivos/{}/modo", f"{fast}/dispositivos/{{}}/modo",
+         lambda device_id, count: [None] * count, 200),
+    ]
+
+    # Calentar ambas rutas antes de medir
+    for _, method, api_path, fast_path, make_bodies, expected in cases:
+        await measure(app, method, api_path.format("BENCH-API"), make_bodies("BENCH-API", args.warmup), expected)
+        await measure(app, method, fast_path.format("BENCH-FW"), make_bodies("BENCH-FW", args.warmup), expected)
+
+    header = f"{'Endpoint':<12}{'Ruta':<8}{'req/s':>10}{'req/s/núcleo':>15}"
+    print(header)
+    print("-" * len(header))
+    for label, method, api_path, fast_path, make_bodies, expected in cases:
+        api = await measure(app, method, api_path.format("BENCH-API"),
+                            make_bodies("BENCH-API", args.requests), expected)
+        fw = await measure(app, method, fast_path.format("BENCH-FW"),
+                           make_bodies("BENCH-FW", args.requests), expected)
+        print(f"{label:<12}{'/api':<8}{api[0]:>10.0f}{api[1]:>15.0f}")
+        print(f"{'':<12}{fast:<8}{fw[0]:>10.0f}{fw[1]:>15.0f}   x{fw[1] / api[1]:.2f}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark de la ruta rápida del firmware")
+    parser.add_argument("--requests", type=int, default=2000, help="Peticiones por endpoint y ruta")
+    parser.add_argument("--warmup", type=int, default=200, help="Peticiones de calentamiento")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    workdir = tempfile.mkdtemp(prefix="bench_fast_ingest_")
+    # Configuración antes de importar la app: base temporal y sin límites
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    os.environ["RATE_LIMIT_ENABLED"] = "false"
+    os.environ["ARCHIVE_DIR"] = os.path.join(workdir, "archive")
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    print(f"🚀 Benchmark en proceso con {args.requests} peticiones por ruta ({workdir})")
+    asyncio.run(run(args))
+    print("✅ Benchmark terminado")
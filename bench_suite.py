@@ -0,0 +1,272 @@
+"""
+Micro-benchmarks en proceso de los caminos calientes de la API.
+
+Mide, sin servidor ni red y sobre una base SQLite temporal:
+
+    auth.*           verify_token y get_current_user
+    devices.*        búsqueda de dispositivo (ingesta) y caché de pertenencia
+    ingest.*         POST /api/ubicaciones/ completo con TestClient
+    serialize.*      serialización de 1k/10k filas LocationResponse
+    history.*@N      historial de un dispositivo con N filas en `locations`
+
+Cada benchmark se repite hasta juntar un tiempo mínimo y se reporta la
+mediana por operación. Los resultados se guardan como baseline JSON y una
+corrida posterior falla (exit 1) si algún benchmark empeora más que el
+umbral permitido respecto de ese baseline.
+
+Uso:
+    # Guardar el baseline de esta máquina
+    python bench_suite.py --save-baseline
+
+    # Comparar contra el baseline (falla si algo empeora más de 25%)
+    python bench_suite.py --max-regression 0.25
+
+    # Historial con tablas grandes (10^7 filas tarda varios minutos en generarse)
+    python bench_suite.py --sizes 10000,1000000,10000000 --filter history
+
+El baseline acepta umbrales por benchmark en "thresholds", por ejemplo
+{"thresholds": {"ingest.create_location": 0.5}}.
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+DEFAULT_BASELINE = "bench_baselines.json"
+
+# Dispositivos entre los que se reparten las filas del historial
+HISTORY_DEVICES = 100
+
+
+def measure(func, min_time, repeat):
+    """Mediana de segundos por llamada en `repeat` rondas de al menos `min_time`"""
+    func()  # calentamiento (compilación de queries, cachés)
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time / repeat or loops >= 1_000_000:
+            break
+        loops *= 2
+    samples = [elapsed / loops]
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(loops):
+            func()
+        samples.append((time.perf_counter() - start) / loops)
+    return statistics.median(samples)
+
+
+class Suite:
+    def __init__(self, args):
+        self.args = args
+        self.results = {}
+
+    def run(self, name, func):
+        if self.args.filter and self.args.filter not in name:
+            return
+        seconds = measure(func, self.args.min_time, self.args.repeat)
+        self.results[name] = seconds
+        print(f"{name:<40}{seconds * 1e6:>14.1f} µs{1 / seconds:>14.0f} op/s")
+
+
+def setup_fleet():
+    """Usuario, token y dispositivo de prueba; devuelve (email, headers, device)"""
+    from auth_utils import create_access_token, get_password_hash
+    from database import SessionLocal
+    from models import User, Device
+
+    db = SessionLocal()
+    user = User(email="bench@bench.local", username="bench", hashed_password=get_password_hash("bench"))
+    db.add(user)
+    db.commit()
+    db.add_all([
+        Device(device_id=f"BENCH{i:04d}", name=f"Vehículo {i}", owner_id=user.id)
+        for i in range(HISTORY_DEVICES)
+    ])
+    db.commit()
+    db.close()
+    token = create_access_token({"sub": "bench@bench.local"})
+    return "bench@bench.local", {"Authorization": f"Bearer {token}"}, "BENCH0000"
+
+
+def grow_locations(target_rows, batch_size=50000):
+    """Completar la tabla `locations` hasta `target_rows` filas repartidas entre los dispositivos"""
+    from sqlalchemy import func, select
+    from database import engine
+    from models import Device, Location
+
+    table = Location.__table__
+    with engine.begin() as conn:
+        current = conn.execute(select(func.count()).select_from(table)).scalar()
+        device_pks = [pk for (pk,) in conn.execute(select(Device.id).order_by(Device.id))]
+    start = datetime(2024, 1, 1)
+    while current < target_rows:
+        count = min(batch_size, target_rows - current)
+        rows = [
+            {
+                "device_id": device_pks[i % len(device_pks)],
+                "latitude": -25.2637 + (i % 1000) * 1e-5,
+                "longitude": -57.5759,
+                "timestamp": start + timedelta(seconds=10 * (i // len(device_pks))),
+            }
+            for i in range(current, current + count)
+        ]
+        with engine.begin() as conn:
+            conn.execute(table.insert(), rows)
+        current += count
+
+
+def run_suite(args):
+    from fastapi.security import HTTPAuthorizationCredentials
+    from fastapi.encoders import jsonable_encoder
+    from fastapi.testclient import TestClient
+    from fastapi.utils import create_response_field
+    from typing import List
+
+    import ingest
+    import migrations
+    import ownership_cache
+    from auth_utils import verify_token, get_current_user
+    from database import SessionLocal, engine
+    from main import app
+    from models import Location
+    from schemas import LocationResponse
+
+    migrations.upgrade(engine)
+    suite = Suite(args)
+    email, headers, device_id = setup_fleet()
+    client = TestClient(app)
+    credentials = HTTPAuthorizationCredentials(scheme="Bearer", credentials=headers["Authorization"][7:])
+    db = SessionLocal()
+    user = get_current_user(db, email)
+
+    print(f"{'Benchmark':<40}{'tiempo/op':>17}{'ops':>17}")
+    print("-" * 74)
+
+    suite.run("auth.verify_token", lambda: verify_token(credentials))
+    suite.run("auth.get_current_user", lambda: get_current_user(db, email))
+    suite.run("devices.get_active_device", lambda: ingest.get_active_device(db, device_id))
+    suite.run("devices.ownership_cache", lambda: ownership_cache.device_pk(db, user.id, device_id))
+
+    payload = {"id": device_id, "lat": -25.2637, "lng": -57.5759}
+    suite.run("ingest.create_location", lambda: client.post("/api/ubicaciones/", json=payload))
+
+    # Igual que FastAPI con response_model=List[LocationResponse]: validar y codificar
+    field = create_response_field("Response", List[LocationResponse])
+    now = datetime.utcnow()
+    for size in (1000, 10000):
+        rows = [
+            Location(id=i, device_id=1, latitude=-25.2637, longitude=-57.5759,
+                     accuracy=5.0, speed=30.0, altitude=None, timestamp=now)
+            for i in range(size)
+        ]
+
+        def serialize(rows=rows):
+            value, errors = field.validate(rows, {}, loc=("response",))
+            return jsonable_encoder(value)
+
+        suite.run(f"serialize.locations_{size}", serialize)
+
+    db.close()
+
+    for size in args.sizes:
+        if args.filter and args.filter not in f"history.latest_50@{size}":
+            continue
+        started = time.perf_counter()
+        grow_locations(size)
+        print(f"   (tabla con {size:,} filas lista en {time.perf_counter() - started:.1f}s)")
+        suite.run(f"history.latest_50@{size}",
+                  lambda: client.get(f"/api/ubicaciones/device/{device_id}?limit=50", headers=headers))
+        suite.run(f"history.latest_1000@{size}",
+                  lambda: client.get(f"/api/ubicaciones/device/{device_id}?limit=1000", headers=headers))
+
+    return suite.results
+
+
+def compare(results, baseline, max_regression):
+    """Imprimir la comparación; devuelve los nombres que empeoraron más del umbral"""
+    thresholds = baseline.get("thresholds", {})
+    regressions = []
+    print(f"\n{'Benchmark':<40}{'baseline':>14}{'actual':>14}{'cambio':>10}")
+    print("-" * 78)
+    for name, seconds in results.items():
+        base = baseline.get("results", {}).get(name)
+        if base is None:
+            print(f"{name:<40}{'-':>14}{seconds * 1e6:>11.1f} µs{'nuevo':>10}")
+            continue
+        change = seconds / base - 1
+        limit = thresholds.get(name, max_regression)
+        mark = "❌" if change > limit else "  "
+        print(f"{name:<40}{base * 1e6:>11.1f} µs{seconds * 1e6:>11.1f} µs{change:>+9.0%} {mark}")
+        if change > limit:
+            regressions.append(name)
+    return regressions
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Micro-benchmarks de los caminos calientes")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="Archivo JSON del baseline")
+    parser.add_argument("--save-baseline", action="store_true", help="Guardar los resultados como baseline")
+    parser.add_argument("--max-regression", type=float, default=0.25,
+                        help="Empeoramiento máximo permitido (0.25 = 25%% más lento)")
+    parser.add_argument("--sizes", default="10000,100000",
+                        type=lambda value: sorted(int(size) for size in value.split(",") if size),
+                        help="Tamaños de la tabla locations para los benchmarks de historial")
+    parser.add_argument("--filter", help="Correr solo los benchmarks cuyo nombre contenga este texto")
+    parser.add_argument("--min-time", type=float, default=1.0, help="Segundos mínimos por benchmark")
+    parser.add_argument("--repeat", type=int, default=5, help="Rondas por benchmark (se toma la mediana)")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    baseline_path = os.path.abspath(args.baseline)
+    workdir = tempfile.mkdtemp(prefix="bench_suite_")
+    # Configuración antes de importar la app: base temporal y sin límites ni tareas de fondo
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    os.environ["RATE_LIMIT_ENABLED"] = "false"
+    os.environ["ARCHIVE_DIR"] = os.path.join(workdir, "archive")
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+    print(f"🚀 Benchmarks en proceso ({workdir})\n")
+    results = run_suite(args)
+
+    if args.save_baseline:
+        # Conservar los umbrales por benchmark del baseline anterior
+        thresholds = {}
+        if os.path.exists(baseline_path):
+            with open(baseline_path, encoding="utf-8") as f:
+                thresholds = json.load(f).get("thresholds", {})
+        with open(baseline_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "meta": {
+                    "created_at": datetime.utcnow().isoformat(timespec="seconds"),
+                    "python": platform.python_version(),
+                    "machine": platform.platform(),
+                },
+                "results": results,
+                "thresholds": thresholds,
+            }, f, indent=2, sort_keys=True)
+        print(f"\n✅ Baseline guardado en {baseline_path}")
+        sys.exit(0)
+
+    if not os.path.exists(baseline_path):
+        print(f"\n⚠️  No hay baseline en {baseline_path}; guardarlo con --save-baseline")
+        sys.exit(0)
+
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, args.max_regression)
+    if regressions:
+        print(f"\n❌ {len(regressions)} benchmark(s) empeoraron más del umbral: {', '.join(regressions)}")
+        sys.exit(1)
+    print("\n✅ Sin regresiones respecto del baseline")
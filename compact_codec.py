@@ -0,0 +1,187 @@
+"""
+Formato binario compacto de los registros de los rastreadores.
+
+Cada registro (little-endian) ocupa 20 bytes + el largo del device_id:
+
+    B  versión (1)
+    B  flags: 0x01 trae posición, 0x02 trae seq, 0x04 trae ts
+    B  evento: 0 = ubicación (o consulta de modo si no trae posición),
+       1..n = alerta de EVENT_CODES
+    B  largo del device_id (n)
+    n  device_id en ASCII
+    I  seq
+    I  ts (epoch en segundos, UTC)
+    i  latitud * 1e7
+    i  longitud * 1e7
+
+Los registros se delimitan solos, así que un datagrama o un stream TCP
+pueden llevar varios seguidos. La respuesta a cada registro es un ack de 7
+bytes: versión, estado, modo seguridad (0/1) y el seq recibido.
+
+Variante de texto (text/csv) para los POST HTTP, una línea por registro:
+
+    ubicaciones:  id,seq,ts,lat,lng
+    alertas:      id,seq,ts,evento,lat,lng
+
+seq, ts (epoch en segundos) y, en alertas, lat/lng pueden ir vacíos. La
+respuesta es una línea `estado,modo,seq` por registro.
+"""
+
+import struct
+from collections import namedtuple
+from datetime import datetime
+
+VERSION = 1
+
+FLAG_POSITION = 0x01
+FLAG_SEQ = 0x02
+FLAG_TS = 0x04
+
+# Código de evento -> evento de ingest.EVENT_MESSAGES (0 = sin evento)
+EVENT_CODES = (None, "movimiento", "bateria_baja", "gps_perdido", "tamper")
+EVENT_NUMBERS = {evento: code for code, evento in enumerate(EVENT_CODES) if evento}
+
+# Estados del ack
+STATUS_OK = 0
+STATUS_DUPLICATE = 1
+STATUS_DISCARDED = 2  # filtro GPS
+STATUS_NOT_FOUND = 3
+STATUS_INVALID = 4
+STATUS_RATE_LIMITED = 5
+STATUS_BUSY = 6
+STATUS_ERROR = 7
+
+COORD_SCALE = 1e7
+
+CSV_MEDIA_TYPE = "text/csv"
+BINARY_MEDIA_TYPE = "application/octet-stream"
+
+HEADER = struct.Struct("<BBBB")
+BODY = struct.Struct("<IIii")
+ACK = struct.Struct("<BBBI")
+
+Record = namedtuple("Record", ("device_id", "seq", "ts", "lat", "lng", "event"))
+
+
+class CodecError(ValueError):
+    pass
+
+
+def encode_record(device_id, lat=None, lng=None, seq=None, ts=None, event=None):
+    """Armar un registro; `ts` en epoch (segundos) o datetime UTC"""
+    raw_id = device_id.encode("ascii")
+    if not 0 < len(raw_id) < 256:
+        raise CodecError("device_id vacío o demasiado largo")
+    flags = 0
+    if lat is not None and lng is not None:
+        flags |= FLAG_POSITION
+    if seq is not None:
+        flags |= FLAG_SEQ
+    if ts is not None:
+        flags |= FLAG_TS
+        if isinstance(ts, datetime):
+            ts = (ts - datetime(1970, 1, 1)).total_seconds()
+    return (
+        HEADER.pack(VERSION, flags, EVENT_NUMBERS[event] if event else 0, len(raw_id))
+        + raw_id
+        + BODY.pack(seq or 0, int(ts or 0),
+                    round((lat or 0) * COORD_SCALE), round((lng or 0) * COORD_SCALE))
+    )
+
+
+def decode_records(data):
+    """
+    Decodificar los registros completos de `data`.
+
+    Devuelve (registros, bytes consumidos); un registro incompleto al final
+    queda sin consumir (en TCP llega en el próximo segmento). Lanza
+    CodecError si el contenido no respeta el formato.
+    """
+    view = memoryview(data)
+    size = len(view)
+    records = []
+    offset = 0
+    while offset + HEADER.size <= size:
+        version, flags, event, id_len = HEADER.unpack_from(view, offset)
+        end = offset + HEADER.size + id_len + BODY.size
+        if version != VERSION:
+            raise CodecError(f"Versión desconocida: {version}")
+        if event >= len(EVENT_CODES) or id_len == 0:
+            raise CodecError("Registro inválido")
+        if end > size:
+            break
+        id_start = offset + HEADER.size
+        seq, ts, lat, lng = BODY.unpack_from(view, id_start + id_len)
+        try:
+            device_id = str(view[id_start:id_start + id_len], "ascii")
+        except UnicodeDecodeError:
+            raise CodecError("device_id no es ASCII")
+        has_position = flags & FLAG_POSITION
+        records.append(Record(
+            device_id,
+            seq if flags & FLAG_SEQ else None,
+            datetime.utcfromtimestamp(ts) if flags & FLAG_TS else None,
+            lat / COORD_SCALE if has_position else None,
+            lng / COORD_SCALE if has_position else None,
+            EVENT_CODES[event],
+        ))
+        offset = end
+    return records, offset
+
+
+def encode_ack(status, security_mode=False, seq=None):
+    return ACK.pack(VERSION, status, 1 if security_mode else 0, seq or 0)
+
+
+def decode_ack(data, offset=0):
+    """(estado, modo seguridad, seq) de un ack"""
+    version, status, mode, seq = ACK.unpack_from(data, offset)
+    if version != VERSION:
+        raise CodecError(f"Versión desconocida: {version}")
+    return status, bool(mode), seq
+
+
+def _optional_int(field):
+    return int(field) if field else None
+
+
+def decode_csv(data, alerts=False):
+    """
+    Decodificar un cuerpo text/csv; una entrada por línea no vacía.
+
+    Las líneas mal formadas quedan como None (se responden con
+    STATUS_INVALID) sin invalidar el resto del cuerpo.
+    """
+    records = []
+    for line in bytes(data).split(b"\n"):
+        line = line.strip()
+        if not line:
+            continue
+        fields = line.split(b",")
+        try:
+            if alerts:
+                device_id, seq, ts, evento, lat, lng = fields
+                evento = evento.decode("ascii")
+                if not evento:
+                    raise ValueError(evento)
+            else:
+                device_id, seq, ts, lat, lng = fields
+                evento = None
+            has_position = bool(lat and lng)
+            if not device_id or not (has_position or alerts):
+                raise ValueError(line)
+            records.append(Record(
+                device_id.decode("ascii"),
+                _optional_int(seq),
+                datetime.utcfromtimestamp(int(ts)) if ts else None,
+                float(lat) if has_position else None,
+                float(lng) if has_position else None,
+                evento,
+            ))
+        except (ValueError, OverflowError, OSError):
+            records.append(None)
+    return records
+
+
+def encode_csv_ack(status, security_mode=False, seq=None):
+    return b"%d,%d,%d\n" % (status, 1 if security_mode else 0, seq or 0)
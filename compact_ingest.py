@@ -0,0 +1,213 @@
+"""
+Ingesta de registros compactos (compact_codec.py) por lotes.
+
+La usan la ingesta UDP/TCP y los POST de ubicaciones y alertas cuando el
+cuerpo llega como text/csv o application/octet-stream en lugar de JSON.
+Cada registro pasa por las mismas funciones de ingest.py que el JSON
+(rate limit por dispositivo, seq idempotente, filtro GPS, heartbeat) y un
+cuerpo o lote completo se guarda con un solo commit, ocupando un solo
+lugar del cupo de ingesta hasta después del commit. Si ese commit falla
+los registros se guardan de a uno, sin volver a cobrar el límite del
+dispositivo y con el filtro GPS vuelto al estado previo al lote.
+
+En los routers se activa con `route_class=CompactIngestRoute` y
+`openapi_extra=compact_ingest.openapi_extra("location")` en el endpoint.
+"""
+
+import logging
+import os
+
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse, Response
+from fastapi.routing import APIRoute
+from starlette.concurrency import run_in_threadpool
+
+import compact_codec as codec
+import gps_filter
+import ingest
+import rate_limit
+from database import SessionLocal
+
+COMPACT_MAX_RECORDS = int(os.getenv("COMPACT_MAX_RECORDS", "500"))
+
+MEDIA_TYPES = (codec.CSV_MEDIA_TYPE, codec.BINARY_MEDIA_TYPE)
+
+# Marca en openapi_extra del endpoint: qué registros acepta ("location" o "alert")
+KIND_KEY = "x-compact-ingest"
+
+logger = logging.getLogger("compact_ingest")
+
+
+def admit_record(record, kind=None):
+    """Validar el registro y aplicar el límite del dispositivo; devuelve el estado si se rechaza"""
+    if record is None:
+        return codec.STATUS_INVALID
+    if kind == "location" and (record.event or record.lat is None):
+        return codec.STATUS_INVALID
+    if kind == "alert" and not record.event:
+        return codec.STATUS_INVALID
+    try:
+        rate_limit.admit_device(record.device_id)
+    except HTTPException:
+        return codec.STATUS_RATE_LIMITED
+    return None
+
+
+def _device(db, devices, device_id):
+    if device_id not in devices:
+        devices[device_id] = ingest.get_active_device(db, device_id)
+    return devices[device_id]
+
+
+def store_record(db, record, devices):
+    """
+    Guardar un registro ya admitido; devuelve (estado, modo seguridad).
+    `devices` cachea el lote. Quien llama ocupa el cupo de ingesta.
+    """
+    device = _device(db, devices, record.device_id)
+    if device is None:
+        return codec.STATUS_NOT_FOUND, False
+    # Leído antes del commit (después habría que recargar el dispositivo)
+    security_mode = device.security_mode
+    if record.event:
+        _, duplicate = ingest.store_alert(
+            db, device, record.event, record.lat, record.lng, seq=record.seq, ts=record.ts
+        )
+        status = codec.STATUS_DUPLICATE if duplicate else codec.STATUS_OK
+    elif record.lat is not None:
+        row_id, duplicate = ingest.store_location(
+            db, device, record.lat, record.lng, seq=record.seq, ts=record.ts
+        )
+        if row_id is None:
+            status = codec.STATUS_DISCARDED
+        else:
+            status = codec.STATUS_DUPLICATE if duplicate else codec.STATUS_OK
+    else:
+        # Sin posición ni evento: solo consulta de modo
+        ingest.record_mode_poll(db, device)
+        status = codec.STATUS_OK
+    return status, security_mode
+
+
+def _slot_error(error):
+    return codec.STATUS_RATE_LIMITED if error.status_code == 429 else codec.STATUS_ERROR
+
+
+def store_records(session_factory, records, kind=None):
+    """Guardar un lote con un solo commit; devuelve [(estado, modo seguridad)] en orden"""
+    # Validación y tokens del dispositivo una sola vez por registro: si el lote
+    # se anula y se guarda de a uno, no se cobran de nuevo
+    rejected = [admit_record(record, kind) for record in records]
+    results = [(status, False) if status is not None else None for status in rejected]
+    admitted = [i for i, status in enumerate(rejected) if status is None]
+    if not admitted:
+        return results
+
+    db = session_factory()
+    try:
+        try:
+            # Un solo lugar del cupo para todo el lote, hasta después de su commit
+            with rate_limit.ingest_slot():
+                devices = {}
+                for i in admitted:
+                    _device(db, devices, records[i].device_id)
+                # El filtro GPS avanza con cada fix: guardar su estado para deshacer el lote
+                filter_state = gps_filter.snapshot(device.id for device in devices.values() if device is not None)
+                try:
+                    with ingest.group_commit(db):
+                        for i in admitted:
+                            results[i] = store_record(db, records[i], devices)
+                    return results
+                except Exception:
+                    # Un reintento fuera de la ventana de seq (u otro error) anuló el lote
+                    db.rollback()
+                    gps_filter.restore(filter_state)
+        except HTTPException as error:
+            # Cupo de ingesta lleno: no se guardó ningún registro del lote
+            for i in admitted:
+                results[i] = (_slot_error(error), False)
+            return results
+
+        # De a uno, cada registro con su lugar del cupo
+        devices = {}
+        for i in admitted:
+            try:
+                with rate_limit.ingest_slot():
+                    results[i] = store_record(db, records[i], devices)
+            except HTTPException as error:
+                results[i] = (_slot_error(error), False)
+            except Exception:
+                logger.exception("Error al guardar el registro de %s", records[i].device_id)
+                db.rollback()
+                results[i] = (codec.STATUS_ERROR, False)
+        return results
+    finally:
+        db.close()
+
+
+def _error(status_code, detail):
+    return status_code, "application/json", JSONResponse({"detail": detail}).body
+
+
+def process_body(kind, media_type, body):
+    """Decodificar y guardar un cuerpo compacto; devuelve (status, media type, bytes)"""
+    if media_type == codec.BINARY_MEDIA_TYPE:
+        try:
+            records, consumed = codec.decode_records(body)
+        except codec.CodecError as error:
+            return _error(422, f"Cuerpo binario inválido: {error}")
+        if consumed != len(body):
+            return _error(422, "Cuerpo binario inválido: registro incompleto")
+        encode_ack = codec.encode_ack
+    else:
+        records = codec.decode_csv(body, alerts=kind == "alert")
+        encode_ack = codec.encode_csv_ack
+
+    if not records:
+        return _error(422, "El cuerpo no tiene registros")
+    if len(records) > COMPACT_MAX_RECORDS:
+        return _error(413, f"Máximo {COMPACT_MAX_RECORDS} registros por petición")
+
+    results = store_records(SessionLocal, records, kind)
+    return 200, media_type, b"".join(
+        encode_ack(status, security_mode, record.seq if record else None)
+        for record, (status, security_mode) in zip(records, results)
+    )
+
+
+def media_type_of(content_type):
+    return content_type.split(";", 1)[0].strip().lower() if content_type else ""
+
+
+def openapi_extra(kind):
+    """Documentar los cuerpos compactos del endpoint y marcarlo para CompactIngestRoute"""
+    return {
+        KIND_KEY: kind,
+        "requestBody": {
+            "content": {
+                codec.CSV_MEDIA_TYPE: {"schema": {"type": "string"}},
+                codec.BINARY_MEDIA_TYPE: {"schema": {"type": "string", "format": "binary"}},
+            }
+        },
+    }
+
+
+class CompactIngestRoute(APIRoute):
+    """Ruta que atiende los cuerpos compactos y deja el JSON al handler de FastAPI"""
+
+    def get_route_handler(self):
+        json_handler = super().get_route_handler()
+        kind = (self.openapi_extra or {}).get(KIND_KEY)
+        if kind is None:
+            return json_handler
+
+        async def route_handler(request):
+            media_type = media_type_of(request.headers.get("content-type"))
+            if media_type not in MEDIA_TYPES:
+                return await json_handler(request)
+            status_code, response_type, content = await run_in_threadpool(
+                process_body, kind, media_type, await request.body()
+            )
+            return Response(content, status_code=status_code, media_type=response_type)
+
+        return route_handler
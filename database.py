@@ -1,9 +1,11 @@
-from sqlalchemy import create_engine, MetaData
+from sqlalchemy import create_engine, event, MetaData
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 import os
 from dotenv import load_dotenv
 
+import shared_state
+
 load_dotenv()
 
 # Configuración de la base de datos
@@ -23,12 +25,26 @@ else:
     # Configuración SQLite para desarrollo
     DATABASE_URL = "sqlite:///./alarma_rastreadora.db"
 
-engine = create_engine(
-    DATABASE_URL,
-    connect_args={"check_same_thread": False} if not USE_MYSQL else {}
-)
+# URLs explícitas (tienen prioridad): primaria para escrituras y réplica opcional para lecturas
+DATABASE_URL = os.getenv("DATABASE_URL", DATABASE_URL)
+REPLICA_DATABASE_URL = os.getenv("REPLICA_DATABASE_URL")
+
+# Segundos durante los que un usuario lee de la primaria tras escribir
+READ_YOUR_WRITES_SECONDS = float(os.getenv("READ_YOUR_WRITES_SECONDS", "5"))
+
+def _create_engine(url):
+    return create_engine(
+        url,
+        connect_args={"check_same_thread": False} if url.startswith("sqlite") else {}
+    )
+
+engine = _create_engine(DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Sin réplica configurada las lecturas usan el mismo engine
+read_engine = _create_engine(REPLICA_DATABASE_URL) if REPLICA_DATABASE_URL else engine
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
+
 Base = declarative_base()
 
 def get_db():
@@ -37,3 +53,42 @@ def get_db():
         yield db
     finally:
         db.close()
+
+# Read-your-writes: una clave con TTL por usuario en el estado compartido, así
+# la lectura siguiente va a la primaria aunque la atienda otro worker
+def _recent_write_key(email: str):
+    return f"ryw:{email}"
+
+def mark_user_write(email: str):
+    """Registrar que el usuario acaba de escribir en la primaria"""
+    shared_state.backend.set(_recent_write_key(email), "1", ttl=READ_YOUR_WRITES_SECONDS)
+
+def wrote_recently(email: str) -> bool:
+    return shared_state.backend.get(_recent_write_key(email)) is not None
+
+@event.listens_for(SessionLocal, "after_commit")
+def _track_user_writes(session):
+    # get_current_user anota el email en la sesión; los commits de los
+    # dispositivos (sin usuario) no activan el read-your-writes
+    email = session.info.get("user_email")
+    if email is not None and read_engine is not engine:
+        mark_user_write(email)
+
+def get_read_db_for(email: str):
+    """Sesión para handlers de solo lectura: réplica, o primaria si el usuario escribió hace poco"""
+    if read_engine is engine or wrote_recently(email):
+        db = SessionLocal()
+    else:
+        db = ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+def begin_write(db):
+    """Empezar la transacción de la sesión con el lock de escritura tomado (read-modify-write)"""
+    # MySQL bloquea las filas con SELECT ... FOR UPDATE; SQLite lo ignora y sus
+    # lecturas no bloquean, así que ahí se abre la transacción con BEGIN IMMEDIATE
+    connection = db.connection()
+    if connection.dialect.name == "sqlite" and not connection.connection.in_transaction:
+        connection.connection.cursor().execute("BEGIN IMMEDIATE")
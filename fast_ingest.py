@@ -0,0 +1,315 @@
+"""
+Ruta rápida ASGI para los endpoints del firmware.
+
+Se monta en FAST_INGEST_PREFIX (por defecto /fw) y atiende lo mismo que
+los routers, con el mismo comportamiento y las mismas respuestas:
+
+    POST {prefijo}/ubicaciones               igual que POST /api/ubicaciones/
+    POST {prefijo}/alertas                   igual que POST /api/alertas/
+    GET  {prefijo}/dispositivos/{id}/modo    igual que GET /api/dispositivos/{id}/modo
+
+Se evita la inyección de dependencias, el modelo pydantic y el
+jsonable_encoder: el JSON de forma fija se valida a mano y las respuestas
+salen de bytes pre-codificados. Si el cuerpo no tiene la forma simple
+esperada (tipos a convertir, campos faltantes, JSON inválido) se valida con
+el mismo modelo pydantic que los routers, para que la conversión y los
+errores 422 sean idénticos. Los cuerpos compactos (text/csv o binario) van
+a compact_ingest igual que en los routers. El guardado es el de ingest.py.
+"""
+
+import json
+import os
+from collections import namedtuple
+
+from fastapi import HTTPException
+from fastapi.exceptions import RequestValidationError
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import Response
+from pydantic import ValidationError
+from pydantic.datetime_parse import parse_datetime
+from pydantic.error_wrappers import ErrorWrapper
+from pydantic.errors import DictError, MissingError
+from starlette.concurrency import run_in_threadpool
+
+import compact_ingest
+import ingest
+import rate_limit
+import reporting_policy
+from database import SessionLocal
+from schemas import LocationCreate, AlertCreate
+
+FAST_INGEST_ENABLED = os.getenv("FAST_INGEST_ENABLED", "true").lower() == "true"
+FAST_INGEST_PREFIX = os.getenv("FAST_INGEST_PREFIX", "/fw")
+
+# Etiqueta de ruta para las métricas (el middleware lee scope["route"].path)
+_Route = namedtuple("_Route", ("path",))
+LOCATION_ROUTE = _Route(FAST_INGEST_PREFIX + "/ubicaciones")
+ALERT_ROUTE = _Route(FAST_INGEST_PREFIX + "/alertas")
+MODE_ROUTE = _Route(FAST_INGEST_PREFIX + "/dispositivos/{device_id}/modo")
+
+
+def _json(content):
+    # Mismo formato que JSONResponse de Starlette
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None,
+                      separators=(",", ":")).encode("utf-8")
+
+
+def _id_template(content):
+    """Partes (antes, después) del JSON alrededor del campo "id" (que vale null)"""
+    before, after = _json(content).split(b'"id":null', 1)
+    return before + b'"id":', after
+
+
+LOCATION_CREATED = _id_template({"message": "Ubicación registrada exitosamente", "id": None})
+LOCATION_DUPLICATE = _id_template({"message": "Ubicación ya registrada", "id": None, "duplicado": True})
+LOCATION_DISCARDED = _json({"message": "Ubicación descartada por el filtro GPS", "id": None, "descartada": True})
+ALERT_CREATED = _id_template({"message": "Alerta registrada exitosamente", "id": None})
+ALERT_DUPLICATE = _id_template({"message": "Alerta ya registrada", "id": None, "duplicado": True})
+DEVICE_NOT_FOUND = _json({"detail": "Dispositivo no encontrado"})
+NOT_FOUND = _json({"detail": "Not Found"})
+METHOD_NOT_ALLOWED = _json({"detail": "Method Not Allowed"})
+MODE_TRUE = b',"modo_seguridad":true}'
+MODE_FALSE = b',"modo_seguridad":false}'
+
+NUMBER_TYPES = (float, int)
+
+
+def _with_interval(body, device_pk, security_mode):
+    """Agregar "intervalo_s" al final del objeto JSON, como los routers"""
+    return body[:-1] + b',"intervalo_s":%d}' % reporting_policy.interval(device_pk, security_mode)
+
+
+async def _send(send, status_code, body, headers=()):
+    await send({
+        "type": "http.response.start",
+        "status": status_code,
+        "headers": [
+            (b"content-length", str(len(body)).encode()),
+            (b"content-type", b"application/json"),
+            *headers,
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def _read_body(receive):
+    chunks = []
+    more_body = True
+    while more_body:
+        message = await receive()
+        chunks.append(message.get("body", b""))
+        more_body = message.get("more_body", False)
+    return b"".join(chunks)
+
+
+def _content_type(scope):
+    for name, value in scope["headers"]:
+        if name == b"content-type":
+            return value.decode("latin-1")
+    return None
+
+
+def _is_json(scope):
+    """Misma regla que FastAPI: sin content-type o application/json (o +json)"""
+    content_type = _content_type(scope)
+    if not content_type:
+        return True
+    media_type = compact_ingest.media_type_of(content_type)
+    return media_type == "application/json" or (
+        media_type.startswith("application/") and media_type.endswith("+json")
+    )
+
+
+def _validation_error(errors):
+    return 422, _json({"detail": jsonable_encoder(RequestValidationError(errors).errors())})
+
+
+def _parse_body(scope, body_bytes):
+    """Devolver el dict del cuerpo o (status, bytes) con el error igual al de FastAPI"""
+    if not body_bytes:
+        return _validation_error([ErrorWrapper(MissingError(), ("body",))])
+    if not _is_json(scope):
+        return _validation_error([ErrorWrapper(DictError(), ("body",))])
+    try:
+        body = json.loads(body_bytes)
+    except json.JSONDecodeError as error:
+        return _validation_error([ErrorWrapper(error, ("body", error.pos))])
+    if body is None:
+        return _validation_error([ErrorWrapper(MissingError(), ("body",))])
+    if not isinstance(body, dict):
+        # Como el modelo pydantic: lo que dict() acepta (una lista de pares) se valida como objeto
+        try:
+            body = dict(body)
+        except (TypeError, ValueError):
+            return _validation_error([ErrorWrapper(DictError(), ("body",))])
+    return body
+
+
+def _validate(body, model):
+    """Ruta lenta: el modelo pydantic de los routers (devuelve el modelo o el error)"""
+    try:
+        return model.parse_obj(body)
+    except ValidationError as error:
+        return _validation_error([ErrorWrapper(error, ("body",))])
+
+
+def _location_fields(body):
+    device_id = body.get("id")
+    lat = body.get("lat")
+    lng = body.get("lng")
+    seq = body.get("seq")
+    ts = body.get("ts")
+    if (type(device_id) is str and type(lat) in NUMBER_TYPES and type(lng) in NUMBER_TYPES
+            and (seq is None or type(seq) is int) and (ts is None or type(ts) is str)):
+        try:
+            return device_id, float(lat), float(lng), seq, parse_datetime(ts) if ts is not None else None
+        except (ValueError, TypeError):
+            pass
+    location = _validate(body, LocationCreate)
+    if isinstance(location, tuple):
+        return location
+    return location.id, location.lat, location.lng, location.seq, location.ts
+
+
+def _alert_fields(body):
+    device_id = body.get("id")
+    evento = body.get("evento")
+    lat = body.get("lat")
+    lng = body.get("lng")
+    seq = body.get("seq")
+    ts = body.get("ts")
+    if (type(device_id) is str and type(evento) is str
+            and (lat is None or type(lat) in NUMBER_TYPES) and (lng is None or type(lng) in NUMBER_TYPES)
+            and (seq is None or type(seq) is int) and (ts is None or type(ts) is str)):
+        try:
+            return (device_id, evento,
+                    float(lat) if lat is not None else None,
+                    float(lng) if lng is not None else None,
+                    seq, parse_datetime(ts) if ts is not None else None)
+        except (ValueError, TypeError):
+            pass
+    alert = _validate(body, AlertCreate)
+    if isinstance(alert, tuple):
+        return alert
+    return alert.id, alert.evento, alert.lat, alert.lng, alert.seq, alert.ts
+
+
+def _handle_location(body):
+    fields = _location_fields(body)
+    if len(fields) == 2:
+        return fields
+    device_id, lat, lng, seq, ts = fields
+
+    rate_limit.admit_device(device_id)
+    db = SessionLocal()
+    try:
+        with rate_limit.ingest_slot():
+            device = ingest.get_active_device(db, device_id)
+            if not device:
+                return 404, DEVICE_NOT_FOUND
+            device_pk, security_mode = device.id, device.security_mode
+            location_id, duplicate = ingest.store_location(
+                db, device, lat, lng, seq=seq, ts=ts, recommend_interval=True
+            )
+    finally:
+        db.close()
+
+    if location_id is None:
+        return 200, _with_interval(LOCATION_DISCARDED, device_pk, security_mode)
+    if duplicate:
+        body = LOCATION_DUPLICATE[0] + str(location_id).encode() + LOCATION_DUPLICATE[1]
+        return 200, _with_interval(body, device_pk, security_mode)
+    body = LOCATION_CREATED[0] + str(location_id).encode() + LOCATION_CREATED[1]
+    return 201, _with_interval(body, device_pk, security_mode)
+
+
+def _handle_alert(body):
+    fields = _alert_fields(body)
+    if len(fields) == 2:
+        return fields
+    device_id, evento, lat, lng, seq, ts = fields
+
+    rate_limit.admit_device(device_id)
+    db = SessionLocal()
+    try:
+        with rate_limit.ingest_slot():
+            device = ingest.get_active_device(db, device_id)
+            if not device:
+                return 404, DEVICE_NOT_FOUND
+            alert_id, duplicate = ingest.store_alert(db, device, evento, lat, lng, seq=seq, ts=ts)
+    finally:
+        db.close()
+
+    if duplicate:
+        return 200, ALERT_DUPLICATE[0] + str(alert_id).encode() + ALERT_DUPLICATE[1]
+    return 201, ALERT_CREATED[0] + str(alert_id).encode() + ALERT_CREATED[1]
+
+
+def _handle_mode(device_id):
+    rate_limit.admit_device(device_id)
+    db = SessionLocal()
+    try:
+        with rate_limit.ingest_slot():
+            device = ingest.get_active_device(db, device_id)
+            if not device:
+                return 404, DEVICE_NOT_FOUND
+            # Leídos antes del commit (después habría que recargar el dispositivo)
+            device_pk, arduino_id, security_mode = device.id, device.device_id, device.security_mode
+            ingest.record_mode_poll(db, device, recommend_interval=True)
+    finally:
+        db.close()
+
+    body = b'{"device_id":' + _json(arduino_id) + (MODE_TRUE if security_mode else MODE_FALSE)
+    return 200, _with_interval(body, device_pk, security_mode)
+
+
+async def app(scope, receive, send):
+    """Sub-aplicación ASGI montada en FAST_INGEST_PREFIX"""
+    if scope["type"] != "http":
+        return
+
+    path = scope["path"]
+    method = scope["method"]
+    headers = ()
+
+    if path in ("/ubicaciones", "/ubicaciones/", "/alertas", "/alertas/"):
+        is_location = path.startswith("/ubicaciones")
+        scope["route"] = LOCATION_ROUTE if is_location else ALERT_ROUTE
+        if method != "POST":
+            await _send(send, 405, METHOD_NOT_ALLOWED, [(b"allow", b"POST")])
+            return
+        body_bytes = await _read_body(receive)
+        media_type = compact_ingest.media_type_of(_content_type(scope))
+        if media_type in compact_ingest.MEDIA_TYPES:
+            # Cuerpo compacto (CSV o binario): mismo tratamiento que en los routers
+            status_code, response_type, content = await run_in_threadpool(
+                compact_ingest.process_body, "location" if is_location else "alert", media_type, body_bytes
+            )
+            await Response(content, status_code=status_code, media_type=response_type)(scope, receive, send)
+            return
+        body = _parse_body(scope, body_bytes)
+        handler = _handle_location if is_location else _handle_alert
+    elif path.startswith("/dispositivos/") and path.endswith("/modo") and path.count("/") == 3:
+        scope["route"] = MODE_ROUTE
+        if method != "GET":
+            await _send(send, 405, METHOD_NOT_ALLOWED, [(b"allow", b"GET")])
+            return
+        body = path[len("/dispositivos/"):-len("/modo")]
+        handler = _handle_mode
+    else:
+        await _send(send, 404, NOT_FOUND)
+        return
+
+    if isinstance(body, tuple):
+        status_code, response = body
+    else:
+        try:
+            # En el pool de hilos, como los handlers de los routers: así el cupo
+            # de ingesta cuenta las escrituras que están en curso a la vez
+            status_code, response = await run_in_threadpool(handler, body)
+        except HTTPException as error:
+            # 429 del control de admisión, con Retry-After
+            status_code, response = error.status_code, _json({"detail": error.detail})
+            headers = [(name.lower().encode(), value.encode()) for name, value in (error.headers or {}).items()]
+
+    await _send(send, status_code, response, headers)
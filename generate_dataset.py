@@ -0,0 +1,301 @@
+"""
+Generador de datos sintéticos a gran escala para benchmarks.
+
+Crea miles de usuarios y dispositivos, recorridos GPS plausibles (viajes
+alternados con estacionamientos) y ráfagas de alertas, usando inserts
+masivos de SQLAlchemy Core. Con la misma semilla produce siempre los
+mismos datos, en SQLite o MySQL (según la configuración de database.py).
+
+Las ubicaciones llevan su geohash y los dispositivos su última posición,
+y los tiles del mapa de calor y los resúmenes por hora y por día se
+calculan al generar cada tanda, así que las búsquedas por zona, el mapa de
+calor y /resumen responden sobre el dataset igual que con datos reales.
+
+Uso:
+    python generate_dataset.py --users 1000 --devices-per-user 2 --points-per-device 5000
+    python generate_dataset.py --users 5000 --devices-per-user 2 --points-per-device 2000 --seed 7
+"""
+
+import argparse
+import math
+import random
+import sys
+import os
+import time
+from datetime import datetime, timedelta
+
+# Agregar el directorio del proyecto al path para importar módulos
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy import bindparam, func, select
+from sqlalchemy.orm import Session
+
+from database import engine
+import geo
+import heatmap
+import migrations
+import rollups
+from models import User, Device, Location, Alert
+from auth_utils import get_password_hash
+
+EARTH_RADIUS_M = 6371000.0
+
+VEHICLE_TYPES = ["carro", "moto", "camioneta", "bicicleta"]
+
+# Tipos de evento del Arduino con su severidad (igual que routers/alerts.py)
+ALERT_EVENTS = {
+    "movimiento": ("high", "Movimiento detectado mientras el modo seguridad estaba activado"),
+    "bateria_baja": ("medium", "Batería del dispositivo está baja"),
+    "gps_perdido": ("medium", "Señal GPS perdida"),
+    "tamper": ("critical", "Intento de manipulación del dispositivo detectado"),
+}
+
+# Ciudades base para repartir la flota
+CITIES = [
+    (-25.2637, -57.5759),  # Asunción
+    (-25.5097, -54.6111),  # Ciudad del Este
+    (-27.3306, -55.8667),  # Encarnación
+    (4.7110, -74.0721),    # Bogotá
+    (-34.6037, -58.3816),  # Buenos Aires
+]
+
+
+def next_id(conn, table):
+    """Siguiente PK libre, para poder asignar IDs explícitos y reproducibles"""
+    return (conn.execute(select(func.max(table.c.id))).scalar() or 0) + 1
+
+
+def flush(conn, table, rows):
+    if rows:
+        conn.execute(table.insert(), rows)
+        rows.clear()
+
+
+def flush_aggregates(last_positions):
+    """Última posición de los dispositivos de la tanda y volcado de tiles y resúmenes"""
+    devices_table = Device.__table__
+    with engine.begin() as conn:
+        conn.execute(devices_table.update().where(devices_table.c.id == bindparam("pk")).values(
+            last_latitude=bindparam("lat"),
+            last_longitude=bindparam("lng"),
+            last_geohash=bindparam("geohash"),
+            last_fix_at=bindparam("fix_at"),
+        ), last_positions)
+    last_positions.clear()
+    db = Session(bind=engine)
+    try:
+        heatmap.flush_pending(db)
+        rollups.flush_pending(db)
+    finally:
+        db.close()
+
+
+def move(lat, lng, bearing, distance_m):
+    """Desplazar un punto una distancia en metros con un rumbo dado"""
+    d_lat = distance_m * math.cos(bearing) / EARTH_RADIUS_M
+    d_lng = distance_m * math.sin(bearing) / (EARTH_RADIUS_M * math.cos(math.radians(lat)))
+    return lat + math.degrees(d_lat), lng + math.degrees(d_lng)
+
+
+def generate_route(rng, start_lat, start_lng, start_time, points, interval_s):
+    """
+    Generar un recorrido plausible: viajes a velocidad variable con giros
+    suaves, alternados con estacionamientos con ruido GPS.
+    Produce tuplas (timestamp, lat, lng, speed_kmh).
+    """
+    lat, lng = start_lat, start_lng
+    bearing = rng.uniform(0, 2 * math.pi)
+    timestamp = start_time
+    moving = False
+    remaining = rng.randint(5, 60)
+    speed_kmh = 0.0
+
+    for _ in range(points):
+        if remaining <= 0:
+            moving = not moving
+            remaining = rng.randint(30, 300) if moving else rng.randint(10, 400)
+            if moving:
+                speed_kmh = rng.uniform(20, 60)
+        remaining -= 1
+
+        if moving:
+            speed_kmh = min(120.0, max(5.0, speed_kmh + rng.gauss(0, 4)))
+            bearing += rng.gauss(0, 0.15)
+            lat, lng = move(lat, lng, bearing, speed_kmh / 3.6 * interval_s)
+            yield timestamp, lat, lng, speed_kmh
+        else:
+            # Estacionado: solo el ruido típico del módulo GPS (~5 m)
+            yield (timestamp, lat + rng.gauss(0, 0.00004),
+                   lng + rng.gauss(0, 0.00004), 0.0)
+
+        timestamp += timedelta(seconds=interval_s * rng.uniform(0.95, 1.2))
+
+
+def generate_dataset(args):
+    migrations.upgrade(engine)
+
+    users_table = User.__table__
+    devices_table = Device.__table__
+    locations_table = Location.__table__
+    alerts_table = Alert.__table__
+
+    # bcrypt es lento: un solo hash compartido por todos los usuarios sintéticos
+    hashed_password = get_password_hash(args.password)
+    now = datetime.utcnow().replace(microsecond=0)
+    started = time.perf_counter()
+
+    with engine.begin() as conn:
+        first_user_id = next_id(conn, users_table)
+        first_device_id = next_id(conn, devices_table)
+
+    total_devices = args.users * args.devices_per_user
+    print(f"🚀 Generando {args.users} usuarios, {total_devices} dispositivos y "
+          f"{total_devices * args.points_per_device:,} ubicaciones (semilla {args.seed})")
+
+    with engine.begin() as conn:
+        rows = []
+        for i in range(args.users):
+            rows.append({
+                "id": first_user_id + i,
+                "email": f"{args.prefix}user{first_user_id + i}@example.com",
+                "username": f"{args.prefix}user{first_user_id + i}",
+                "hashed_password": hashed_password,
+                "full_name": f"Usuario sintético {first_user_id + i}",
+                "is_active": True,
+                "created_at": now,
+                "updated_at": now,
+            })
+            if len(rows) >= args.batch_size:
+                flush(conn, users_table, rows)
+        flush(conn, users_table, rows)
+
+        rng = random.Random(args.seed)
+        for i in range(total_devices):
+            pk = first_device_id + i
+            rows.append({
+                "id": pk,
+                "device_id": f"{args.prefix}DEV{pk:08d}",
+                "name": f"Vehículo {pk}",
+                "vehicle_type": rng.choice(VEHICLE_TYPES),
+                "owner_id": first_user_id + i // args.devices_per_user,
+                "security_mode": rng.random() < 0.3,
+                "is_active": True,
+                "last_ping": now,
+                "created_at": now,
+                "updated_at": now,
+            })
+            if len(rows) >= args.batch_size:
+                flush(conn, devices_table, rows)
+        flush(conn, devices_table, rows)
+
+    print(f"✅ Usuarios y dispositivos insertados ({time.perf_counter() - started:.1f}s)")
+
+    # El recorrido termina en --end, de modo que la misma semilla da los mismos timestamps
+    end_time = datetime.fromisoformat(args.end) if args.end else now.replace(hour=0, minute=0, second=0)
+    start_time = end_time - timedelta(seconds=args.points_per_device * args.interval * 1.2 + 3600)
+    location_count = 0
+    alert_count = 0
+    location_rows = []
+    alert_rows = []
+    last_positions = []
+
+    # Una transacción por tanda de dispositivos para no inflar el log de MySQL
+    for chunk_start in range(0, total_devices, args.devices_per_transaction):
+        with engine.begin() as conn:
+            for i in range(chunk_start, min(total_devices, chunk_start + args.devices_per_transaction)):
+                device_pk = first_device_id + i
+                # Semilla por dispositivo: el resultado no depende del tamaño de las tandas
+                rng = random.Random(f"{args.seed}:{i}")
+                city_lat, city_lng = rng.choice(CITIES)
+                route = list(generate_route(
+                    rng,
+                    city_lat + rng.gauss(0, 0.05),
+                    city_lng + rng.gauss(0, 0.05),
+                    start_time + timedelta(seconds=rng.uniform(0, 3600)),
+                    args.points_per_device,
+                    args.interval,
+                ))
+
+                for timestamp, lat, lng, speed in route:
+                    lat, lng, speed = round(lat, 6), round(lng, 6), round(speed, 1)
+                    geohash = geo.encode(lat, lng)
+                    location_rows.append({
+                        "device_id": device_pk,
+                        "latitude": lat,
+                        "longitude": lng,
+                        "speed": speed,
+                        "geohash": geohash,
+                        "is_outlier": False,
+                        "timestamp": timestamp,
+                    })
+                    heatmap.accumulator.add(device_pk, lat, lng)
+                    rollups.accumulator.add_location(device_pk, timestamp, lat, lng, speed)
+                    if len(location_rows) >= args.batch_size:
+                        location_count += len(location_rows)
+                        flush(conn, locations_table, location_rows)
+                last_positions.append({"pk": device_pk, "lat": lat, "lng": lng,
+                                       "geohash": geohash, "fix_at": timestamp})
+                rollups.accumulator.forget(device_pk)
+
+                # Ráfagas de alertas: varios eventos seguidos en el mismo punto
+                for _ in range(rng.randint(0, args.max_alert_bursts)):
+                    timestamp, lat, lng, _speed = rng.choice(route)
+                    event = rng.choice(list(ALERT_EVENTS))
+                    severity, message = ALERT_EVENTS[event]
+                    for n in range(rng.randint(1, args.max_burst_size)):
+                        alert_at = timestamp + timedelta(seconds=n * rng.uniform(5, 30))
+                        rollups.accumulator.add_alert(device_pk, alert_at, event, severity)
+                        alert_rows.append({
+                            "device_id": device_pk,
+                            "alert_type": event,
+                            "message": message,
+                            "latitude": round(lat, 6),
+                            "longitude": round(lng, 6),
+                            "is_read": rng.random() < 0.7,
+                            "severity": severity,
+                            "timestamp": alert_at,
+                        })
+                if len(alert_rows) >= args.batch_size:
+                    alert_count += len(alert_rows)
+                    flush(conn, alerts_table, alert_rows)
+
+            location_count += len(location_rows)
+            alert_count += len(alert_rows)
+            flush(conn, locations_table, location_rows)
+            flush(conn, alerts_table, alert_rows)
+        flush_aggregates(last_positions)
+
+        elapsed = time.perf_counter() - started
+        print(f"   {min(total_devices, chunk_start + args.devices_per_transaction)}/{total_devices} "
+              f"dispositivos, {location_count:,} ubicaciones "
+              f"({location_count / elapsed:,.0f} filas/s)")
+
+    print(f"\n✅ Dataset generado en {time.perf_counter() - started:.1f}s: "
+          f"{location_count:,} ubicaciones y {alert_count:,} alertas")
+    print(f"Credenciales: {args.prefix}user{first_user_id}@example.com / {args.password}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Generador de datos sintéticos para benchmarks")
+    parser.add_argument("--users", type=int, default=100, help="Usuarios a crear")
+    parser.add_argument("--devices-per-user", type=int, default=2, help="Dispositivos por usuario")
+    parser.add_argument("--points-per-device", type=int, default=1000,
+                        help="Ubicaciones por dispositivo")
+    parser.add_argument("--interval", type=float, default=10,
+                        help="Segundos entre ubicaciones (delay del Arduino)")
+    parser.add_argument("--max-alert-bursts", type=int, default=5,
+                        help="Máximo de ráfagas de alertas por dispositivo")
+    parser.add_argument("--max-burst-size", type=int, default=8,
+                        help="Máximo de alertas por ráfaga")
+    parser.add_argument("--batch-size", type=int, default=10000, help="Filas por INSERT masivo")
+    parser.add_argument("--devices-per-transaction", type=int, default=50,
+                        help="Dispositivos cuyos datos se insertan en una misma transacción")
+    parser.add_argument("--prefix", default="bench", help="Prefijo de usuarios y dispositivos")
+    parser.add_argument("--password", default="password123", help="Contraseña de los usuarios")
+    parser.add_argument("--end", help="Fecha ISO en la que terminan los recorridos (por defecto hoy 00:00)")
+    parser.add_argument("--seed", type=int, default=42, help="Semilla para reproducibilidad")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    generate_dataset(parse_args())
@@ -0,0 +1,169 @@
+"""
+Utilidades geoespaciales: geohash, distancia haversine y cobertura de áreas.
+
+Cada ubicación guarda su geohash (GEOHASH_PRECISION caracteres). Una
+búsqueda por área se traduce en un puñado de prefijos de geohash que la
+cubren, consultados como rangos sobre el índice, y los candidatos se
+refinan con la distancia exacta. El costo depende del área, no del
+tamaño de la tabla.
+
+Para calcular el geohash de filas anteriores: python geo.py
+"""
+
+import math
+import os
+import sys
+
+import numpy as np
+from sqlalchemy import or_, and_
+
+BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+GEOHASH_PRECISION = 9  # celdas de ~4.8 m x 4.8 m
+EARTH_RADIUS_M = 6371000.0
+
+# Máximo de celdas con las que se cubre un área de búsqueda
+MAX_COVER_CELLS = 16
+
+
+def encode(lat, lng, precision=GEOHASH_PRECISION):
+    """Geohash de un punto"""
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    bit_count = 0
+    even = True  # los bits pares codifican longitud
+
+    while len(chars) < precision:
+        rng, value = (lng_range, lng) if even else (lat_range, lat)
+        mid = (rng[0] + rng[1]) / 2
+        if value >= mid:
+            bits = (bits << 1) | 1
+            rng[0] = mid
+        else:
+            bits <<= 1
+            rng[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(BASE32[bits])
+            bits = 0
+            bit_count = 0
+
+    return "".join(chars)
+
+
+def cell_size(precision):
+    """(alto, ancho) en grados de una celda de geohash de la precisión dada"""
+    total_bits = 5 * precision
+    lng_bits = (total_bits + 1) // 2
+    lat_bits = total_bits // 2
+    return 180.0 / (1 << lat_bits), 360.0 / (1 << lng_bits)
+
+
+def haversine_m(lat1, lng1, lat2, lng2):
+    """Distancia en metros sobre la esfera terrestre"""
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    d_phi = phi2 - phi1
+    d_lambda = math.radians(lng2 - lng1)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(min(1.0, a)))
+
+
+def haversine_m_array(lat1, lng1, lat2, lng2):
+    """Versión vectorizada de haversine_m para arrays de NumPy"""
+    phi1 = np.radians(lat1)
+    phi2 = np.radians(lat2)
+    d_phi = phi2 - phi1
+    d_lambda = np.radians(np.asarray(lng2) - np.asarray(lng1))
+    a = np.sin(d_phi / 2) ** 2 + np.cos(phi1) * np.cos(phi2) * np.sin(d_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(1.0, a)))
+
+
+def radius_bbox(lat, lng, radius_m):
+    """Caja (min_lat, min_lng, max_lat, max_lng) que contiene el círculo"""
+    d_lat = math.degrees(radius_m / EARTH_RADIUS_M)
+    cos_lat = max(0.01, math.cos(math.radians(lat)))
+    d_lng = min(180.0, d_lat / cos_lat)
+    return (max(-90.0, lat - d_lat), max(-180.0, lng - d_lng),
+            min(90.0, lat + d_lat), min(180.0, lng + d_lng))
+
+
+def cover_bbox(min_lat, min_lng, max_lat, max_lng, max_cells=MAX_COVER_CELLS):
+    """
+    Prefijos de geohash que cubren la caja: se elige la precisión más fina
+    con la que bastan `max_cells` celdas.
+    """
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        height, width = cell_size(precision)
+        rows = math.floor((max_lat + 90) / height) - math.floor((min_lat + 90) / height) + 1
+        cols = math.floor((max_lng + 180) / width) - math.floor((min_lng + 180) / width) + 1
+        if rows * cols <= max_cells or precision == 1:
+            break
+
+    cells = set()
+    lat = min_lat
+    for _ in range(rows):
+        lng = min_lng
+        for _ in range(cols):
+            cells.add(encode(min(lat, 90.0), min(lng, 180.0), precision))
+            lng += width
+        cells.add(encode(min(lat, 90.0), max_lng, precision))
+        lat += height
+    for lng_edge in (min_lng, max_lng):
+        cells.add(encode(max_lat, lng_edge, precision))
+    return sorted(cells)
+
+
+def prefix_filter(column, prefixes):
+    """Condición SQL de rangos sobre el índice para una lista de prefijos"""
+    # '{' es el carácter ASCII siguiente a 'z', el último del alfabeto base32
+    return or_(*[and_(column >= prefix, column < prefix + "{") for prefix in prefixes])
+
+
+def backfill_geohashes(db, batch_size=10000):
+    """Calcular el geohash de las ubicaciones guardadas antes de existir la columna"""
+    from models import Device, Location
+
+    total = 0
+    while True:
+        rows = db.query(Location.id, Location.latitude, Location.longitude).filter(
+            Location.geohash == None
+        ).limit(batch_size).all()
+        if not rows:
+            break
+        db.bulk_update_mappings(Location, [
+            {"id": row.id, "geohash": encode(row.latitude, row.longitude)} for row in rows
+        ])
+        db.commit()
+        total += len(rows)
+
+    # Última posición de los dispositivos que aún no la tienen
+    for device in db.query(Device).filter(Device.last_geohash == None).all():
+        latest = db.query(Location).filter(
+            Location.device_id == device.id
+        ).order_by(Location.timestamp.desc()).first()
+        if latest is not None:
+            update_last_position(device, latest.latitude, latest.longitude, latest.timestamp)
+    db.commit()
+    return total
+
+
+def update_last_position(device, lat, lng, timestamp, geohash=None):
+    """Guardar en el dispositivo su última posición (para búsquedas de flota)"""
+    device.last_latitude = lat
+    device.last_longitude = lng
+    device.last_geohash = geohash or encode(lat, lng)
+    device.last_fix_at = timestamp
+
+
+if __name__ == "__main__":
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    from database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        print(f"✅ Geohash calculado para {backfill_geohashes(db)} ubicaciones")
+    finally:
+        db.close()
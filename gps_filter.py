@@ -0,0 +1,284 @@
+"""
+Filtro de fixes GPS: descarte de saltos imposibles y estimación de
+precisión y velocidad.
+
+En la ingesta cada dispositivo tiene un estado de tamaño fijo (última
+estimación, su varianza y la hora) y un filtro de Kalman simple en metros.
+El estado vive en el estado compartido (shared_state) con TTL, así el
+filtro ve todos los fixes del dispositivo aunque los atiendan varios
+workers; si vence, se retoma desde la última posición guardada.
+Un fix que exige moverse más rápido que GPS_MAX_SPEED_KMH desde la
+estimación se marca como atípico (GPS_FILTER_MODE=flag) o se descarta
+(GPS_FILTER_MODE=drop). Las coordenadas se guardan tal como llegan; la
+estimación completa `accuracy` (desvío en metros) y `speed` (km/h).
+
+Para volver a limpiar un historial ya guardado (versión vectorizada, por
+bloques; reconstruye el mapa de calor y los resúmenes del dispositivo):
+python gps_filter.py --device-pk 1 [--desde ...] [--hasta ...]
+"""
+
+import argparse
+import math
+import os
+import sys
+from collections import namedtuple
+from datetime import datetime
+
+import numpy as np
+from sqlalchemy import tuple_
+
+import geo
+import shared_state
+
+GPS_FILTER_MODE = os.getenv("GPS_FILTER_MODE", "flag").lower()  # flag, drop u off
+GPS_MAX_SPEED_KMH = float(os.getenv("GPS_MAX_SPEED_KMH", "250"))
+GPS_NOISE_M = float(os.getenv("GPS_NOISE_M", "15"))  # error típico de un módulo económico
+GPS_PROCESS_NOISE = float(os.getenv("GPS_PROCESS_NOISE", "3"))  # m/s de incertidumbre añadida
+GPS_MAX_REJECTS = int(os.getenv("GPS_MAX_REJECTS", "3"))
+GPS_STATE_TTL_SECONDS = float(os.getenv("GPS_STATE_TTL_SECONDS", "3600"))
+
+# Tolerancia del umbral de velocidad por el propio ruido del GPS
+GATE_MARGIN_M = 3 * GPS_NOISE_M
+
+# Intervalo mínimo para estimar velocidad: con fixes casi simultáneos el
+# ruido dividido por un dt diminuto daría miles de km/h
+MIN_SPEED_DT = 1.0
+
+GpsFix = namedtuple("GpsFix", ("outlier", "accuracy", "speed"))
+UNFILTERED = GpsFix(False, None, None)
+
+EPOCH = datetime(1970, 1, 1)
+
+
+class _State:
+    __slots__ = ("ts", "lat", "lng", "variance", "speed", "rejects")
+
+    def __init__(self, ts, lat, lng, variance, speed=0.0, rejects=0):
+        self.ts = ts
+        self.lat = lat
+        self.lng = lng
+        self.variance = variance
+        self.speed = speed
+        self.rejects = rejects
+
+    def encode(self):
+        return f"{self.ts!r},{self.lat!r},{self.lng!r},{self.variance!r},{self.speed!r},{self.rejects}"
+
+    @classmethod
+    def decode(cls, value):
+        ts, lat, lng, variance, speed, rejects = value.split(",")
+        return cls(float(ts), float(lat), float(lng), float(variance), float(speed), int(rejects))
+
+
+def _key(device_pk):
+    return f"gps:{device_pk}"
+
+
+class GpsFilter:
+    """Estado del filtro por dispositivo, en el estado compartido con TTL"""
+
+    def __init__(self, ttl=GPS_STATE_TTL_SECONDS):
+        self.ttl = ttl
+
+    def _save(self, device_pk, state):
+        shared_state.backend.set(_key(device_pk), state.encode(), ttl=self.ttl)
+
+    def _state_for(self, device):
+        value = shared_state.backend.get(_key(device.id))
+        if value is not None:
+            return _State.decode(value)
+        # Sin estado (primer fix o vencido) se parte de la última posición aceptada del dispositivo
+        if device.last_fix_at is None or device.last_latitude is None:
+            return None
+        return _State(
+            (device.last_fix_at - EPOCH).total_seconds(),
+            device.last_latitude, device.last_longitude, GPS_NOISE_M ** 2
+        )
+
+    def apply(self, device, lat, lng, timestamp):
+        """Evaluar un fix nuevo del dispositivo y actualizar su estado"""
+        ts = (timestamp - EPOCH).total_seconds()
+        state = self._state_for(device)
+        if state is None:
+            self._save(device.id, _State(ts, lat, lng, GPS_NOISE_M ** 2))
+            return GpsFix(False, GPS_NOISE_M, None)
+
+        dt = ts - state.ts
+        if dt <= 0:
+            # Fix atrasado o repetido: no se usa para el filtro
+            return UNFILTERED
+
+        jump = geo.haversine_m(state.lat, state.lng, lat, lng)
+        if jump > GPS_MAX_SPEED_KMH / 3.6 * dt + GATE_MARGIN_M:
+            state.rejects += 1
+            if state.rejects <= GPS_MAX_REJECTS:
+                self._save(device.id, state)
+                return GpsFix(True, None, None)
+            # Varios rechazos seguidos: el estado era el equivocado, reiniciar
+            self._save(device.id, _State(ts, lat, lng, GPS_NOISE_M ** 2))
+            return GpsFix(False, GPS_NOISE_M, None)
+
+        # Kalman por eje en metros: predecir (crece la varianza) y corregir
+        variance = state.variance + dt * GPS_PROCESS_NOISE ** 2
+        gain = variance / (variance + GPS_NOISE_M ** 2)
+        new_lat = state.lat + gain * (lat - state.lat)
+        new_lng = state.lng + gain * (lng - state.lng)
+        moved = geo.haversine_m(state.lat, state.lng, new_lat, new_lng)
+        state.speed = min(moved / max(dt, MIN_SPEED_DT) * 3.6, GPS_MAX_SPEED_KMH)
+        state.ts, state.lat, state.lng = ts, new_lat, new_lng
+        state.variance = (1 - gain) * variance
+        state.rejects = 0
+        self._save(device.id, state)
+        return GpsFix(False, round(math.sqrt(state.variance), 1), round(state.speed, 1))
+
+    def snapshot(self, device_pks):
+        """Estado de los dispositivos (para deshacer un lote anulado)"""
+        device_pks = list(device_pks)
+        return dict(zip(device_pks, shared_state.backend.get_many([_key(pk) for pk in device_pks])))
+
+    def restore(self, snapshot):
+        for device_pk, value in snapshot.items():
+            if value is None:
+                shared_state.backend.delete(_key(device_pk))
+            else:
+                shared_state.backend.set(_key(device_pk), value, ttl=self.ttl)
+
+
+gps_filter = GpsFilter()
+
+
+def apply(device, lat, lng, timestamp):
+    """Evaluar un fix en la ingesta (sin efecto si GPS_FILTER_MODE=off)"""
+    if GPS_FILTER_MODE == "off":
+        return UNFILTERED
+    return gps_filter.apply(device, lat, lng, timestamp)
+
+
+def snapshot(device_pks):
+    return gps_filter.snapshot(device_pks)
+
+
+def restore(snapshot):
+    gps_filter.restore(snapshot)
+
+
+def detect_outliers(ts, lat, lng, max_speed_kmh=GPS_MAX_SPEED_KMH, max_passes=5):
+    """
+    Versión vectorizada para historiales: devuelve (atípicos, velocidad km/h).
+
+    Un punto es atípico si llegar a él y salir de él exige superar la
+    velocidad máxima (un salto de una muestra). Se repite sin los puntos ya
+    descartados hasta que no aparezcan nuevos.
+    """
+    ts = np.asarray(ts, dtype="datetime64[us]").astype("int64") / 1e6
+    lat = np.asarray(lat, dtype=float)
+    lng = np.asarray(lng, dtype=float)
+    outlier = np.zeros(len(ts), dtype=bool)
+    max_speed = max_speed_kmh / 3.6
+
+    for _ in range(max_passes):
+        idx = np.flatnonzero(~outlier)
+        if len(idx) < 3:
+            break
+        jump = geo.haversine_m_array(lat[idx[:-1]], lng[idx[:-1]], lat[idx[1:]], lng[idx[1:]])
+        dt = np.maximum(np.diff(ts[idx]), MIN_SPEED_DT)
+        too_fast = jump > max_speed * dt + GATE_MARGIN_M
+        spikes = np.concatenate([[False], too_fast[:-1] & too_fast[1:], [False]])
+        # Los extremos tienen un solo segmento: basta con que ese sea imposible
+        spikes[0] = too_fast[0] and not too_fast[1]
+        spikes[-1] = too_fast[-1] and not too_fast[-2]
+        if not spikes.any():
+            break
+        outlier[idx[spikes]] = True
+
+    speed = np.full(len(ts), np.nan)
+    idx = np.flatnonzero(~outlier)
+    if len(idx) > 1:
+        jump = geo.haversine_m_array(lat[idx[:-1]], lng[idx[:-1]], lat[idx[1:]], lng[idx[1:]])
+        speed[idx[1:]] = np.minimum(jump / np.maximum(np.diff(ts[idx]), MIN_SPEED_DT) * 3.6, max_speed_kmh)
+    return outlier, speed
+
+
+def reclean(db, device_pk, desde=None, hasta=None, batch_size=50000):
+    """
+    Volver a marcar atípicos y velocidades en un rango del historial; devuelve atípicos.
+
+    Recorre el rango en orden cronológico por bloques de `batch_size` filas.
+    Cada bloque empieza con la última fila válida del anterior (ya guardada,
+    solo como contexto) y deja su propia última fila para el siguiente: así
+    cada fila se juzga con sus dos vecinas. Al terminar reconstruye el mapa
+    de calor y los resúmenes del dispositivo, como el borrado del historial.
+    """
+    import heatmap
+    import rollups
+    import versioning
+    from models import Location
+
+    query = db.query(Location.id, Location.timestamp, Location.latitude, Location.longitude).filter(
+        Location.device_id == device_pk
+    )
+    if desde:
+        query = query.filter(Location.timestamp >= desde)
+    if hasta:
+        query = query.filter(Location.timestamp <= hasta)
+    query = query.order_by(Location.timestamp, Location.id)
+
+    total = checked = 0
+    context = None  # última fila válida ya guardada
+    pending = None  # última fila del bloque anterior, todavía sin guardar
+    while True:
+        page = query
+        if pending is not None:
+            page = page.filter(tuple_(Location.timestamp, Location.id) > (pending.timestamp, pending.id))
+        batch = page.limit(batch_size).all()
+        done = len(batch) < batch_size
+        rows = [row for row in (context, pending) if row is not None] + batch
+        start = 1 if context is not None else 0
+        end = len(rows) if done else len(rows) - 1
+        if end > start:
+            ids, ts, lat, lng = zip(*rows)
+            outlier, speed = detect_outliers(ts, lat, lng)
+            db.bulk_update_mappings(Location, [
+                {
+                    "id": ids[i],
+                    "is_outlier": bool(outlier[i]),
+                    "speed": None if math.isnan(speed[i]) else round(float(speed[i]), 1)
+                }
+                for i in range(start, end)
+            ])
+            db.commit()
+            total += int(outlier[start:end].sum())
+            checked += end - start
+            valid = np.flatnonzero(~outlier[start:end])
+            if len(valid):
+                context = rows[start + valid[-1]]
+        if done:
+            break
+        pending = rows[-1]
+
+    if not checked:
+        return 0
+    # Lo pendiente de volcar se contó con las marcas viejas: se reconstruye desde la tabla
+    heatmap.accumulator.discard(device_pk)
+    rollups.accumulator.discard(device_pk)
+    heatmap.rebuild(db, device_pk)
+    rollups.rebuild(db, device_pk)
+    versioning.bump(versioning.DEVICE_LOCATIONS, device_pk)
+    return total
+
+
+if __name__ == "__main__":
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    from database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Volver a limpiar el historial GPS de un dispositivo")
+    parser.add_argument("--device-pk", type=int, required=True, help="Id interno del dispositivo")
+    parser.add_argument("--desde", type=datetime.fromisoformat)
+    parser.add_argument("--hasta", type=datetime.fromisoformat)
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        print(f"✅ {reclean(db, args.device_pk, args.desde, args.hasta)} fixes marcados como atípicos")
+    finally:
+        db.close()
@@ -0,0 +1,277 @@
+"""
+Mapa de calor de lugares visitados, pre-agregado por tiles.
+
+Por dispositivo y por cada zoom de HEATMAP_ZOOMS se guarda un tile
+(zoom, tile_x, tile_y) de Web Mercator con una grilla de
+HEATMAP_GRID x HEATMAP_GRID celdas. Los conteos de la grilla van en un
+blob compacto (array de uint32), así leer el mapa de calor de una zona
+cuesta unos pocos tiles en lugar de miles de ubicaciones.
+
+La ingesta solo suma en memoria; un ciclo de fondo vuelca los
+incrementos pendientes cada HEATMAP_FLUSH_SECONDS en una transacción.
+Los tiles se leen con el lock de escritura tomado (SELECT ... FOR UPDATE,
+en orden para no cruzar bloqueos entre workers; BEGIN IMMEDIATE en
+SQLite) y, si el volcado falla por cualquier motivo, los
+incrementos vuelven al acumulador para el próximo ciclo.
+Para reconstruir los tiles desde el historial: python heatmap.py --rebuild
+"""
+
+import argparse
+import asyncio
+import logging
+import math
+import os
+import sys
+import threading
+from array import array
+from collections import defaultdict
+from datetime import datetime
+
+from sqlalchemy import tuple_
+from sqlalchemy.exc import IntegrityError
+
+HEATMAP_ZOOMS = tuple(int(z) for z in os.getenv("HEATMAP_ZOOMS", "10,13,16").split(","))
+HEATMAP_GRID = int(os.getenv("HEATMAP_GRID", "16"))
+HEATMAP_FLUSH_SECONDS = float(os.getenv("HEATMAP_FLUSH_SECONDS", "10"))
+
+logger = logging.getLogger("heatmap")
+
+MAX_MERCATOR_LAT = 85.05112878
+FLUSH_CHUNK = 500
+
+
+def tile_cell(lat, lng, zoom, grid=HEATMAP_GRID):
+    """(tile_x, tile_y, índice de celda) del punto en el zoom dado"""
+    lat = max(-MAX_MERCATOR_LAT, min(MAX_MERCATOR_LAT, lat))
+    n = 1 << zoom
+    x = (lng + 180.0) / 360.0 * n
+    lat_rad = math.radians(lat)
+    y = (1.0 - math.log(math.tan(lat_rad) + 1.0 / math.cos(lat_rad)) / math.pi) / 2.0 * n
+    x = min(max(x, 0.0), n - 1e-9)
+    y = min(max(y, 0.0), n - 1e-9)
+    tile_x, tile_y = int(x), int(y)
+    cell_x = int((x - tile_x) * grid)
+    cell_y = int((y - tile_y) * grid)
+    return tile_x, tile_y, cell_y * grid + cell_x
+
+
+def cell_center(zoom, tile_x, tile_y, index, grid=HEATMAP_GRID):
+    """Latitud y longitud del centro de una celda"""
+    n = 1 << zoom
+    x = tile_x + (index % grid + 0.5) / grid
+    y = tile_y + (index // grid + 0.5) / grid
+    lng = x / n * 360.0 - 180.0
+    lat = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / n))))
+    return lat, lng
+
+
+def tile_range(min_lat, min_lng, max_lat, max_lng, zoom):
+    """Rango de tiles (x0, x1, y0, y1) que cubre la caja"""
+    x0, y1, _ = tile_cell(min_lat, min_lng, zoom, 1)
+    x1, y0, _ = tile_cell(max_lat, max_lng, zoom, 1)
+    return x0, x1, y0, y1
+
+
+def decode_counts(blob, grid=HEATMAP_GRID):
+    counts = array("I")
+    if blob:
+        counts.frombytes(blob)
+        if sys.byteorder == "big":
+            counts.byteswap()
+    else:
+        counts.extend([0] * (grid * grid))
+    return counts
+
+
+def encode_counts(counts):
+    # Siempre little-endian en la BD
+    if sys.byteorder == "big":
+        counts = array("I", counts)
+        counts.byteswap()
+    return counts.tobytes()
+
+
+def snap_zoom(zoom):
+    """Zoom configurado más cercano por debajo (o el menor disponible)"""
+    candidates = [z for z in HEATMAP_ZOOMS if z <= zoom]
+    return max(candidates) if candidates else min(HEATMAP_ZOOMS)
+
+
+class HeatmapAccumulator:
+    """Incrementos pendientes: (device, zoom, tile_x, tile_y) -> {celda: conteo}"""
+
+    def __init__(self):
+        self._pending = defaultdict(lambda: defaultdict(int))
+        self._lock = threading.Lock()
+
+    def add(self, device_pk, lat, lng, count=1):
+        with self._lock:
+            for zoom in HEATMAP_ZOOMS:
+                tile_x, tile_y, index = tile_cell(lat, lng, zoom)
+                self._pending[(device_pk, zoom, tile_x, tile_y)][index] += count
+
+    def drain(self):
+        with self._lock:
+            pending, self._pending = self._pending, defaultdict(lambda: defaultdict(int))
+        return pending
+
+    def discard(self, device_pk):
+        """Descartar lo pendiente del dispositivo (antes de reconstruir sus tiles)"""
+        with self._lock:
+            for key in [key for key in self._pending if key[0] == device_pk]:
+                del self._pending[key]
+
+    def merge_back(self, pending):
+        """Devolver incrementos no volcados (por ejemplo tras un conflicto)"""
+        with self._lock:
+            for key, cells in pending.items():
+                for index, count in cells.items():
+                    self._pending[key][index] += count
+
+
+accumulator = HeatmapAccumulator()
+
+
+def flush_pending(db):
+    """Volcar los incrementos pendientes a la tabla de tiles; devuelve tiles tocados"""
+    from database import begin_write
+    from models import HeatmapTile
+
+    pending = accumulator.drain()
+    if not pending:
+        return 0
+
+    keys = sorted(pending)
+    now = datetime.utcnow()
+    try:
+        begin_write(db)
+        for start in range(0, len(keys), FLUSH_CHUNK):
+            chunk = keys[start:start + FLUSH_CHUNK]
+            # Bloquear los tiles hasta el commit: otro worker que vuelque a la vez espera
+            existing = {
+                (tile.device_id, tile.zoom, tile.tile_x, tile.tile_y): tile
+                for tile in db.query(HeatmapTile).filter(
+                    tuple_(HeatmapTile.device_id, HeatmapTile.zoom,
+                           HeatmapTile.tile_x, HeatmapTile.tile_y).in_(chunk)
+                ).with_for_update().populate_existing()
+            }
+            for key in chunk:
+                tile = existing.get(key)
+                if tile is None:
+                    device_pk, zoom, tile_x, tile_y = key
+                    tile = HeatmapTile(device_id=device_pk, zoom=zoom, tile_x=tile_x,
+                                       tile_y=tile_y, total=0)
+                    db.add(tile)
+                counts = decode_counts(tile.counts)
+                added = 0
+                for index, count in pending[key].items():
+                    counts[index] += count
+                    added += count
+                tile.counts = encode_counts(counts)
+                tile.total += added
+                tile.updated_at = now
+        db.commit()
+    except IntegrityError:
+        # Otro worker creó el mismo tile a la vez: reintentar en el próximo ciclo
+        db.rollback()
+        accumulator.merge_back(pending)
+        return 0
+    except Exception:
+        # Cualquier otro fallo tampoco pierde los incrementos
+        db.rollback()
+        accumulator.merge_back(pending)
+        raise
+    return len(keys)
+
+
+async def flush_loop(session_factory):
+    """Ciclo de fondo que vuelca el acumulador periódicamente"""
+    from starlette.concurrency import run_in_threadpool
+
+    def flush_once():
+        db = session_factory()
+        try:
+            return flush_pending(db)
+        finally:
+            db.close()
+
+    while True:
+        await asyncio.sleep(HEATMAP_FLUSH_SECONDS)
+        try:
+            await run_in_threadpool(flush_once)
+        except Exception:
+            # Un fallo de BD no debe detener el ciclo; lo pendiente se reintenta en el próximo
+            logger.exception("Error al volcar el mapa de calor")
+
+
+def get_heatmap_cells(db, device_pk, zoom, bbox=None):
+    """Celdas con conteo del dispositivo en el zoom dado, opcionalmente dentro de una caja"""
+    from models import HeatmapTile
+
+    query = db.query(HeatmapTile).filter(
+        HeatmapTile.device_id == device_pk,
+        HeatmapTile.zoom == zoom
+    )
+    if bbox is not None:
+        x0, x1, y0, y1 = tile_range(*bbox, zoom)
+        query = query.filter(
+            HeatmapTile.tile_x.between(x0, x1),
+            HeatmapTile.tile_y.between(y0, y1)
+        )
+
+    cells = []
+    for tile in query:
+        for index, count in enumerate(decode_counts(tile.counts)):
+            if count:
+                lat, lng = cell_center(zoom, tile.tile_x, tile.tile_y, index)
+                if bbox is not None and not (bbox[0] <= lat <= bbox[2] and bbox[1] <= lng <= bbox[3]):
+                    continue
+                cells.append({"lat": round(lat, 6), "lng": round(lng, 6), "count": count})
+    return cells
+
+
+def rebuild(db, device_pk=None, batch_size=50000):
+    """Reconstruir los tiles desde las ubicaciones guardadas"""
+    from models import HeatmapTile, Location
+
+    tiles = db.query(HeatmapTile)
+    locations = db.query(Location.id, Location.device_id, Location.latitude, Location.longitude).filter(
+        Location.is_outlier.isnot(True)
+    )
+    if device_pk is not None:
+        tiles = tiles.filter(HeatmapTile.device_id == device_pk)
+        locations = locations.filter(Location.device_id == device_pk)
+    tiles.delete(synchronize_session=False)
+    db.commit()
+
+    total = 0
+    last_id = 0
+    while True:
+        rows = locations.filter(Location.id > last_id).order_by(Location.id).limit(batch_size).all()
+        if not rows:
+            break
+        for row in rows:
+            accumulator.add(row.device_id, row.latitude, row.longitude)
+        last_id = rows[-1].id
+        total += len(rows)
+        flush_pending(db)
+    return total
+
+
+if __name__ == "__main__":
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    from database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Mantenimiento de los tiles del mapa de calor")
+    parser.add_argument("--rebuild", action="store_true", help="Reconstruir desde el historial")
+    parser.add_argument("--device-pk", type=int, help="Solo este dispositivo (id interno)")
+    args = parser.parse_args()
+
+    if args.rebuild:
+        db = SessionLocal()
+        try:
+            print(f"✅ Mapa de calor reconstruido desde {rebuild(db, args.device_pk)} ubicaciones")
+        finally:
+            db.close()
+    else:
+        parser.print_help()
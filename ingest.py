@@ -0,0 +1,340 @@
+"""
+Ruta de almacenamiento de los datos que envían los dispositivos.
+
+Los routers (y cualquier otra vía de ingesta) usan estas funciones para
+guardar ubicaciones y alertas, de modo que todas se comporten igual.
+
+Idempotencia: si el dispositivo envía un número de secuencia (`seq`), un
+reintento del mismo envío no crea filas duplicadas. Se descarta primero
+con una ventana en memoria de secuencias recientes (antes del filtro GPS
+y de los acumuladores, que no deben ver dos veces el mismo fix) y, si no
+está ahí, con el índice único (device_id, seq) de la tabla; en ese caso el
+filtro ya lo evaluó y se le devuelve el estado que tenía antes. En ambos
+casos el reintento cuenta como heartbeat.
+
+Las vías que reciben muchos registros juntos (ingesta UDP) pueden guardar
+un lote con un solo commit dentro de `group_commit(db)`.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy.exc import IntegrityError
+
+import geo
+import gps_filter
+import heatmap
+import offline_detector
+import rate_limit
+import reporting_policy
+import rollups
+import versioning
+from models import Device, Location, Alert
+
+SEQ_WINDOW_SIZE = int(os.getenv("SEQ_WINDOW_SIZE", "32"))
+SEQ_WINDOW_MAX_DEVICES = int(os.getenv("SEQ_WINDOW_MAX_DEVICES", "100000"))
+
+# Tolerancia para relojes de dispositivo adelantados
+MAX_CLOCK_SKEW = timedelta(minutes=5)
+
+# Mapear tipos de eventos
+EVENT_MESSAGES = {
+    "movimiento": "Movimiento detectado mientras el modo seguridad estaba activado",
+    "bateria_baja": "Batería del dispositivo está baja",
+    "gps_perdido": "Señal GPS perdida",
+    "tamper": "Intento de manipulación del dispositivo detectado"
+}
+
+# Determinar severidad según el tipo de evento
+SEVERITY_MAP = {
+    "movimiento": "high",
+    "bateria_baja": "medium",
+    "gps_perdido": "medium",
+    "tamper": "critical"
+}
+
+
+class RecentSeqWindow:
+    """Últimas secuencias vistas por dispositivo (seq -> id de la fila), con LRU de dispositivos"""
+
+    def __init__(self, size=SEQ_WINDOW_SIZE, max_devices=SEQ_WINDOW_MAX_DEVICES):
+        self.size = size
+        self.max_devices = max_devices
+        self._windows = OrderedDict()
+        self._lock = threading.Lock()
+
+    def lookup(self, device_pk, seq):
+        with self._lock:
+            window = self._windows.get(device_pk)
+            return window.get(seq) if window is not None else None
+
+    def remember(self, device_pk, seq, row_id):
+        with self._lock:
+            window = self._windows.get(device_pk)
+            if window is None:
+                window = self._windows[device_pk] = OrderedDict()
+                if len(self._windows) > self.max_devices:
+                    self._windows.popitem(last=False)
+            else:
+                self._windows.move_to_end(device_pk)
+            window[seq] = row_id
+            if len(window) > self.size:
+                window.popitem(last=False)
+
+
+location_seqs = RecentSeqWindow()
+alert_seqs = RecentSeqWindow()
+
+# Clave de db.info con las acciones a ejecutar tras el commit del lote
+GROUP_KEY = "ingest_group"
+
+# Sentencias compiladas una vez (SQLAlchemy las cachea por forma)
+INSERTS = {
+    Location: Location.__table__.insert(),
+    Alert: Alert.__table__.insert(),
+}
+
+
+def get_active_device(db, device_id: str):
+    """Buscar un dispositivo activo por el device_id del Arduino"""
+    device = db.query(Device).filter(
+        Device.device_id == device_id,
+        Device.is_active == True
+    ).first()
+    if device is not None:
+        # Solo un dispositivo real ocupa lugar en la tabla de límites
+        rate_limit.track_device(device_id)
+    return device
+
+
+def record_mode_poll(db, device, recommend_interval=False):
+    """
+    Registrar la consulta de modo del dispositivo (cuenta como heartbeat).
+    `recommend_interval`: la respuesta al dispositivo lleva intervalo_s.
+    """
+    now = datetime.utcnow()
+    ident = _ident(device)
+    back_online = _heartbeat(db, device, now)
+    _commit(db)
+    _changed(db, ident, now, back_online=back_online, recommend_interval=recommend_interval)
+
+
+@contextmanager
+def group_commit(db):
+    """
+    Guardar varios registros con un solo commit al salir del bloque.
+
+    Si un INSERT choca con el índice único (reintento fuera de la ventana)
+    se propaga el IntegrityError: quien llama hace rollback y guarda los
+    registros de a uno. Las ventanas de seq y el mapa de calor se actualizan
+    recién después del commit.
+    """
+    db.info[GROUP_KEY] = pending = []
+    try:
+        yield
+        db.commit()
+    finally:
+        del db.info[GROUP_KEY]
+    for func, args in pending:
+        func(*args)
+
+
+def _commit(db):
+    if GROUP_KEY not in db.info:
+        db.commit()
+
+
+def _after_commit(db, func, *args):
+    pending = db.info.get(GROUP_KEY)
+    if pending is None:
+        func(*args)
+    else:
+        pending.append((func, args))
+
+
+def _heartbeat(db, device, now):
+    """Actualizar last_ping; devuelve True si el dispositivo estaba offline (alerta back_online)"""
+    was_offline = device.offline_since is not None
+    device.last_ping = now
+    offline_detector.heartbeat(db, device, now)
+    return was_offline and device.offline_since is None
+
+
+def _ident(device):
+    """(id, dueño, modo seguridad) del dispositivo: leerlos antes del commit, que lo expira"""
+    return device.id, device.owner_id, device.security_mode
+
+
+def _expect_report(device_pk, security_mode):
+    """El detector offline espera al dispositivo según el intervalo que se le recomienda"""
+    offline_detector.expect(device_pk, reporting_policy.interval(device_pk, security_mode))
+
+
+def _changed(db, ident, now, locations=False, alerts=False, back_online=False, recommend_interval=False):
+    """
+    Incrementar las versiones de los GET de la app; llamar después del commit.
+    Con `recommend_interval` (la respuesta lleva intervalo_s) se reprograma el
+    plazo del detector offline con ese intervalo.
+    """
+    device_pk, owner_id, security_mode = ident
+    _after_commit(db, versioning.bump, versioning.USER_DEVICES, owner_id)
+    if locations:
+        _after_commit(db, versioning.bump, versioning.DEVICE_LOCATIONS, device_pk)
+    if alerts or back_online:
+        _after_commit(db, versioning.bump_alerts, owner_id, device_pk)
+    if back_online:
+        _after_commit(db, rollups.accumulator.add_alert, device_pk, now, "back_online", "low")
+    if recommend_interval:
+        _after_commit(db, _expect_report, device_pk, security_mode)
+
+
+def resolve_timestamp(device_ts, now):
+    """Usar la hora del dispositivo si la envía (en UTC naive), salvo que venga del futuro"""
+    if device_ts is None:
+        return now
+    if device_ts.tzinfo is not None:
+        device_ts = device_ts.astimezone(timezone.utc).replace(tzinfo=None)
+    if device_ts > now + MAX_CLOCK_SKEW:
+        return now
+    return device_ts
+
+
+def _recent_retry(db, seq_window, device, ident, seq, now, recommend_interval=False):
+    """Id ya guardado si el envío es un reintento reciente (con su heartbeat guardado); si no, None"""
+    if seq is None:
+        return None
+    existing_id = seq_window.lookup(ident[0], seq)
+    if existing_id is None:
+        return None
+    back_online = _heartbeat(db, device, now)
+    _commit(db)
+    _changed(db, ident, now, back_online=back_online, recommend_interval=recommend_interval)
+    return existing_id
+
+
+def _store(db, model, seq_window, device, values, seq, now):
+    """Insertar la fila de forma idempotente; devuelve (id, es_duplicado)"""
+    device_pk = values["device_id"]
+    try:
+        # INSERT de Core pre-armado: sin unidad de trabajo ni objeto ORM por fila
+        result = db.execute(INSERTS[model], values)
+        row_id = result.inserted_primary_key[0]
+        _commit(db)
+    except IntegrityError:
+        if GROUP_KEY in db.info:
+            raise
+        db.rollback()
+        if seq is None:
+            raise
+        # Reintento que ya no estaba en la ventana: lo detectó el índice único
+        row_id = db.query(model.id).filter(
+            model.device_id == device_pk,
+            model.seq == seq
+        ).scalar()
+        if row_id is None:
+            raise
+        seq_window.remember(device_pk, seq, row_id)
+        # El rollback deshizo el heartbeat de la petición: volver a guardarlo
+        _heartbeat(db, device, now)
+        _commit(db)
+        return row_id, True
+
+    if seq is not None:
+        _after_commit(db, seq_window.remember, device_pk, seq, row_id)
+    return row_id, False
+
+
+def store_location(db, device, lat, lng, seq=None, ts=None, recommend_interval=False):
+    """
+    Guardar una ubicación del dispositivo; devuelve (id, es_duplicado).
+    El id es None si el filtro GPS descartó el fix (GPS_FILTER_MODE=drop).
+    `recommend_interval`: la respuesta al dispositivo lleva intervalo_s.
+    """
+    now = datetime.utcnow()
+    ident = _ident(device)
+    device_pk = ident[0]
+    existing_id = _recent_retry(db, location_seqs, device, ident, seq, now, recommend_interval)
+    if existing_id is not None:
+        return existing_id, True
+
+    timestamp = resolve_timestamp(ts, now)
+    # Un reintento fuera de la ventana recién lo detecta el índice único, después
+    # del filtro: guardar su estado para deshacer lo que ese fix le haya hecho
+    filter_state = gps_filter.snapshot([device_pk]) if seq is not None else None
+    fix = gps_filter.apply(device, lat, lng, timestamp)
+
+    # Actualizar last_ping del dispositivo aunque el fix no sirva
+    back_online = _heartbeat(db, device, now)
+
+    if fix.outlier and gps_filter.GPS_FILTER_MODE == "drop":
+        _commit(db)
+        _changed(db, ident, now, back_online=back_online, recommend_interval=recommend_interval)
+        return None, False
+
+    geohash = geo.encode(lat, lng)
+    values = {
+        "device_id": device_pk,
+        "latitude": lat,
+        "longitude": lng,
+        "accuracy": fix.accuracy,
+        "speed": fix.speed,
+        "seq": seq,
+        "geohash": geohash,
+        "is_outlier": fix.outlier,
+        "timestamp": timestamp,
+    }
+
+    # Última posición del dispositivo (salvo fixes atrasados o atípicos). El tramo
+    # desde la anterior, para los resúmenes, sale de la BD y no de cada worker
+    segment_m = 0.0
+    if not fix.outlier and (device.last_fix_at is None or timestamp >= device.last_fix_at):
+        if device.last_fix_at is not None:
+            segment_m = geo.haversine_m(device.last_latitude, device.last_longitude, lat, lng)
+        geo.update_last_position(device, lat, lng, timestamp, geohash)
+
+    location_id, duplicate = _store(db, Location, location_seqs, device, values, seq, now)
+    if duplicate:
+        gps_filter.restore(filter_state)
+    elif not fix.outlier:
+        _after_commit(db, heatmap.accumulator.add, device_pk, lat, lng)
+        _after_commit(db, rollups.accumulator.add_location, device_pk, timestamp, lat, lng, fix.speed, segment_m)
+        _after_commit(db, reporting_policy.policy.note_fix, device_pk, lat, lng, fix.speed)
+    _changed(db, ident, now, locations=not duplicate, back_online=back_online,
+             recommend_interval=recommend_interval)
+    return location_id, duplicate
+
+
+def store_alert(db, device, evento, lat=None, lng=None, seq=None, ts=None):
+    """Guardar una alerta del dispositivo; devuelve (id, es_duplicado)"""
+    now = datetime.utcnow()
+    ident = _ident(device)
+    device_pk = ident[0]
+    existing_id = _recent_retry(db, alert_seqs, device, ident, seq, now)
+    if existing_id is not None:
+        return existing_id, True
+
+    values = {
+        "device_id": device_pk,
+        "alert_type": evento,
+        "message": EVENT_MESSAGES.get(evento, f"Evento: {evento}"),
+        "latitude": lat,
+        "longitude": lng,
+        "severity": SEVERITY_MAP.get(evento, "medium"),
+        "is_read": False,
+        "seq": seq,
+        "timestamp": resolve_timestamp(ts, now),
+    }
+
+    # Actualizar last_ping del dispositivo
+    back_online = _heartbeat(db, device, now)
+
+    alert_id, duplicate = _store(db, Alert, alert_seqs, device, values, seq, now)
+    if not duplicate:
+        _after_commit(db, rollups.accumulator.add_alert, device_pk,
+                      values["timestamp"], evento, values["severity"])
+        _after_commit(db, reporting_policy.policy.note_alert, device_pk, values["severity"])
+    _changed(db, ident, now, alerts=not duplicate, back_online=back_online)
+    return alert_id, duplicate
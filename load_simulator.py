@@ -0,0 +1,330 @@
+"""
+Simulador de carga para la API de Alarma Rastreadora.
+
+Simula N dispositivos virtuales que siguen el protocolo de
+arduino_script_actualizado.ino (consulta de modo, envío de ubicación y
+alertas aleatorias) y M usuarios de la app que refrescan su panel.
+Como el firmware, cada dispositivo espera el `intervalo_s` que recomienda
+el servidor (--fixed-interval lo ignora) y numera sus envíos con `seq`.
+Reporta throughput y latencias p50/p95/p99 por endpoint.
+
+Uso:
+    # Contra la app en proceso (ASGI, sin servidor; corre su startup y shutdown)
+    python load_simulator.py --devices 200 --users 20 --duration 60
+
+    # Contra un uvicorn local
+    python load_simulator.py --base-url http://localhost:8000 --devices 500
+
+    # Buscar el punto de quiebre subiendo la carga por etapas
+    python load_simulator.py --devices 2000 --steps 5 --p99-limit 1000
+
+Usa httpx (en requirements.txt, también lo usa el TestClient de FastAPI).
+"""
+
+import argparse
+import asyncio
+import itertools
+import math
+import random
+import time
+from collections import defaultdict
+
+import httpx
+
+API_PREFIX = "/api"
+
+# Intervalos que acepta el firmware; fuera de este rango conserva el anterior
+MIN_INTERVAL_S = 5
+MAX_INTERVAL_S = 3600
+
+
+class EndpointStats:
+    """Latencias y códigos de estado acumulados de un endpoint"""
+
+    def __init__(self):
+        self.latencies = []
+        self.status_codes = defaultdict(int)
+        self.errors = 0
+
+    def record(self, latency_ms, status_code):
+        self.latencies.append(latency_ms)
+        self.status_codes[status_code] += 1
+
+    def record_error(self):
+        self.errors += 1
+
+
+def percentile(sorted_values, pct):
+    """Percentil por rango más cercano sobre una lista ya ordenada"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+class LoadSimulator:
+    def __init__(self, client, args, seed):
+        self.client = client
+        self.args = args
+        self.rng = random.Random(seed)
+        self.stats = defaultdict(EndpointStats)
+        self.stop_at = 0.0
+        # Secuencia creciente entre corridas (como la guardada en la NVS del firmware)
+        self.seq = itertools.count(int(time.time() * 1000))
+
+    async def request(self, label, method, url, **kwargs):
+        """Ejecutar una petición y registrar su latencia bajo la etiqueta dada"""
+        start = time.perf_counter()
+        try:
+            response = await self.client.request(method, url, **kwargs)
+        except httpx.HTTPError:
+            self.stats[label].record_error()
+            return None
+        self.stats[label].record((time.perf_counter() - start) * 1000, response.status_code)
+        return response
+
+    async def pause(self, seconds):
+        """Dormir sin pasarse del final de la etapa (los intervalos pueden ser largos)"""
+        await asyncio.sleep(min(seconds, max(0.0, self.stop_at - time.monotonic())))
+
+    def next_interval(self, response, current):
+        """Intervalo recomendado por el servidor en la respuesta, con los límites del firmware"""
+        if self.args.fixed_interval or response is None or response.status_code >= 300:
+            return current
+        try:
+            interval = response.json().get("intervalo_s")
+        except ValueError:
+            return current
+        if interval is None or not MIN_INTERVAL_S <= interval <= MAX_INTERVAL_S:
+            return current
+        return interval
+
+    # ---------------------------- Preparación ----------------------------
+
+    async def wait_ready(self):
+        """Esperar a que /ready responda 200 (esquema migrado y worker caliente)"""
+        deadline = time.monotonic() + self.args.timeout
+        while True:
+            response = await self.client.get("/ready")
+            if response.status_code == 200 or time.monotonic() > deadline:
+                response.raise_for_status()
+                return
+            await asyncio.sleep(0.2)
+
+    async def setup_user(self, index):
+        """Registrar (si hace falta) e iniciar sesión con un usuario de prueba"""
+        email = f"{self.args.prefix}user{index}@loadtest.example.com"
+        password = "loadtest123"
+        await self.client.post(f"{API_PREFIX}/auth/register", json={
+            "email": email,
+            "username": f"{self.args.prefix}user{index}",
+            "password": password,
+        })
+        response = await self.client.post(f"{API_PREFIX}/auth/login", json={
+            "email": email,
+            "password": password,
+        })
+        response.raise_for_status()
+        return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+    async def setup(self, device_count):
+        """Crear usuarios y repartir entre ellos los dispositivos simulados"""
+        user_count = max(1, self.args.users)
+        headers = []
+        for i in range(user_count):
+            headers.append(await self.setup_user(i))
+
+        fleet = []
+        for i in range(device_count):
+            device_id = f"{self.args.prefix}DEV{i:06d}"
+            owner = i % user_count
+            await self.client.post(f"{API_PREFIX}/dispositivos/", json={
+                "device_id": device_id,
+                "name": f"Vehículo simulado {i}",
+                "vehicle_type": "carro",
+            }, headers=headers[owner])
+            fleet.append((device_id, owner))
+
+        return headers, fleet
+
+    # ---------------------------- Actores ----------------------------
+
+    async def device_loop(self, device_id):
+        """Ciclo del Arduino: consultar modo, enviar ubicación y, a veces, una alerta"""
+        lat = self.args.lat + self.rng.uniform(-0.05, 0.05)
+        lng = self.args.lng + self.rng.uniform(-0.05, 0.05)
+        interval = self.args.location_interval
+
+        # Desfasar el arranque para no sincronizar a toda la flota
+        await self.pause(self.rng.uniform(0, interval))
+
+        while time.monotonic() < self.stop_at:
+            response = await self.request(
+                "GET /dispositivos/{id}/modo", "GET",
+                f"{API_PREFIX}/dispositivos/{device_id}/modo"
+            )
+            security_mode = bool(
+                response is not None and response.status_code == 200
+                and response.json().get("modo_seguridad")
+            )
+            interval = self.next_interval(response, interval)
+
+            lat += self.rng.gauss(0, 0.0005)
+            lng += self.rng.gauss(0, 0.0005)
+            response = await self.request(
+                "POST /ubicaciones/", "POST", f"{API_PREFIX}/ubicaciones/",
+                json={"id": device_id, "seq": next(self.seq), "lat": round(lat, 6), "lng": round(lng, 6)}
+            )
+            interval = self.next_interval(response, interval)
+
+            if self.rng.random() < self.args.alert_probability:
+                evento = "movimiento" if security_mode else self.rng.choice(
+                    ["bateria_baja", "gps_perdido", "tamper"]
+                )
+                await self.request(
+                    "POST /alertas/", "POST", f"{API_PREFIX}/alertas/",
+                    json={"id": device_id, "seq": next(self.seq), "evento": evento,
+                          "lat": round(lat, 6), "lng": round(lng, 6)}
+                )
+
+            await self.pause(interval * self.rng.uniform(0.9, 1.1))
+
+    async def user_loop(self, headers, device_ids):
+        """Refresco periódico del panel de la app Flutter"""
+        await self.pause(self.rng.uniform(0, self.args.dashboard_interval))
+
+        while time.monotonic() < self.stop_at:
+            await self.request("GET /dispositivos/", "GET",
+                               f"{API_PREFIX}/dispositivos/", headers=headers)
+            await self.request("GET /alertas/user", "GET",
+                               f"{API_PREFIX}/alertas/user", headers=headers)
+            await self.request("GET /alertas/user/unread/count", "GET",
+                               f"{API_PREFIX}/alertas/user/unread/count", headers=headers)
+            for device_id in device_ids:
+                await self.request(
+                    "GET /ubicaciones/device/{id}/latest", "GET",
+                    f"{API_PREFIX}/ubicaciones/device/{device_id}/latest", headers=headers
+                )
+
+            await self.pause(self.args.dashboard_interval * self.rng.uniform(0.9, 1.1))
+
+    async def run_phase(self, device_count, headers, fleet):
+        """Ejecutar una etapa de carga durante args.duration segundos"""
+        self.stats = defaultdict(EndpointStats)
+        self.stop_at = time.monotonic() + self.args.duration
+
+        devices_by_user = defaultdict(list)
+        for device_id, owner in fleet[:device_count]:
+            devices_by_user[owner].append(device_id)
+
+        tasks = [asyncio.create_task(self.device_loop(d)) for d, _ in fleet[:device_count]]
+        for owner, owner_headers in enumerate(headers):
+            tasks.append(asyncio.create_task(
+                self.user_loop(owner_headers, devices_by_user[owner])
+            ))
+
+        started = time.monotonic()
+        await asyncio.gather(*tasks)
+        return time.monotonic() - started
+
+    # ---------------------------- Reporte ----------------------------
+
+    def report(self, device_count, elapsed):
+        print(f"\n📊 Etapa con {device_count} dispositivos y {self.args.users} usuarios "
+              f"({elapsed:.1f}s)")
+        header = f"{'endpoint':<38}{'reqs':>8}{'req/s':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}{'err':>6}"
+        print(header)
+        print("-" * len(header))
+
+        worst_p99 = 0.0
+        total_requests = 0
+        total_failures = 0
+        for label in sorted(self.stats):
+            stats = self.stats[label]
+            latencies = sorted(stats.latencies)
+            failures = stats.errors + sum(
+                count for code, count in stats.status_codes.items() if code >= 500 or code == 429
+            )
+            p99 = percentile(latencies, 99)
+            worst_p99 = max(worst_p99, p99)
+            total_requests += len(latencies) + stats.errors
+            total_failures += failures
+            print(f"{label:<38}{len(latencies):>8}{len(latencies) / elapsed:>9.1f}"
+                  f"{percentile(latencies, 50):>9.1f}{percentile(latencies, 95):>9.1f}"
+                  f"{p99:>9.1f}{(latencies[-1] if latencies else 0):>9.1f}{failures:>6}")
+
+        error_rate = total_failures / total_requests if total_requests else 0.0
+        print(f"Total: {total_requests} peticiones, {total_requests / elapsed:.1f} req/s, "
+              f"tasa de error {error_rate:.2%} (latencias en ms)")
+        return worst_p99, error_rate
+
+
+async def main(args):
+    if args.base_url:
+        client = httpx.AsyncClient(base_url=args.base_url, timeout=args.timeout)
+        print(f"🚀 Simulando carga contra {args.base_url}")
+        await simulate(client, args)
+        return
+
+    import migrations
+    from database import engine
+    from main import app
+    migrations.upgrade(engine)
+    client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app),
+                               base_url="http://simulador", timeout=args.timeout)
+    print("🚀 Simulando carga contra la app en proceso (ASGI)")
+    # ASGITransport no envía los eventos de lifespan: correr el startup y el
+    # shutdown de la app (tareas de fondo, listeners, volcados) como uvicorn
+    async with app.router.lifespan_context(app):
+        await simulate(client, args)
+
+
+async def simulate(client, args):
+    async with client:
+        simulator = LoadSimulator(client, args, args.seed)
+        await simulator.wait_ready()
+        headers, fleet = await simulator.setup(args.devices)
+
+        steps = max(1, args.steps)
+        for step in range(1, steps + 1):
+            device_count = max(1, round(args.devices * step / steps))
+            elapsed = await simulator.run_phase(device_count, headers, fleet)
+            worst_p99, error_rate = simulator.report(device_count, elapsed)
+
+            if worst_p99 > args.p99_limit or error_rate > args.max_error_rate:
+                print(f"\n❌ Punto de quiebre alcanzado con {device_count} dispositivos "
+                      f"(p99 {worst_p99:.1f} ms, errores {error_rate:.2%})")
+                break
+        else:
+            print("\n✅ La configuración soportó toda la carga simulada")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Simulador de flota para la API")
+    parser.add_argument("--base-url", help="URL del servidor; sin ella se usa la app en proceso")
+    parser.add_argument("--devices", type=int, default=50, help="Dispositivos virtuales")
+    parser.add_argument("--users", type=int, default=5, help="Usuarios de la app")
+    parser.add_argument("--duration", type=float, default=30, help="Segundos por etapa")
+    parser.add_argument("--steps", type=int, default=1, help="Etapas de carga creciente")
+    parser.add_argument("--location-interval", type=float, default=10,
+                        help="Segundos entre ciclos hasta que el servidor recomiende intervalo_s")
+    parser.add_argument("--fixed-interval", action="store_true",
+                        help="Ignorar intervalo_s y usar siempre --location-interval")
+    parser.add_argument("--dashboard-interval", type=float, default=15,
+                        help="Segundos entre refrescos del panel de cada usuario")
+    parser.add_argument("--alert-probability", type=float, default=0.05,
+                        help="Probabilidad de enviar una alerta en cada ciclo")
+    parser.add_argument("--p99-limit", type=float, default=2000,
+                        help="p99 máximo aceptable en ms antes de declarar quiebre")
+    parser.add_argument("--max-error-rate", type=float, default=0.01,
+                        help="Tasa de errores (5xx, 429, red) máxima aceptable")
+    parser.add_argument("--timeout", type=float, default=30, help="Timeout por petición")
+    parser.add_argument("--lat", type=float, default=-25.2637, help="Latitud base de la flota")
+    parser.add_argument("--lng", type=float, default=-57.5759, help="Longitud base de la flota")
+    parser.add_argument("--prefix", default="SIM", help="Prefijo de usuarios y dispositivos")
+    parser.add_argument("--seed", type=int, default=42, help="Semilla del generador aleatorio")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
@@ -1,16 +1,26 @@
-from fastapi import FastAPI, Depends, HTTPException, status
-from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from fastapi import FastAPI, status
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
+from fastapi.responses import JSONResponse
+import asyncio
 import uvicorn
 
-from database import get_db, engine
-from models import Base
+from database import engine, read_engine, SessionLocal
 from routers import auth, users, devices, locations, alerts
-from auth_utils import verify_token
+import metrics
+import query_profiler
+import rate_limit
+import heatmap
+import rollups
+import offline_detector
+import purge
+import fast_ingest
+import udp_ingest
+import ownership_cache
+import versioning
+import shared_state
+import readiness
 
-# Crear las tablas en la base de datos
-Base.metadata.create_all(bind=engine)
+# Las tablas se crean y actualizan con migrations.py, fuera del arranque de los workers
 
 app = FastAPI(
     title="API Alarma Rastreadora",
@@ -27,6 +37,21 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Presupuesto por usuario para el tráfico de la app, separado del de los dispositivos
+if rate_limit.RATE_LIMIT_ENABLED:
+    app.add_middleware(rate_limit.AppRateLimitMiddleware)
+
+# Engines a instrumentar (la réplica solo si está configurada)
+instrumented_engines = [engine] if read_engine is engine else [engine, read_engine]
+
+# Métricas de Prometheus en /metrics (solo si METRICS_ENABLED=true)
+if metrics.METRICS_ENABLED:
+    metrics.instrument_app(app, *instrumented_engines)
+
+# Log de queries por petición y presupuestos (solo si QUERY_PROFILING=true)
+if query_profiler.QUERY_PROFILING:
+    query_profiler.instrument_app(app, *instrumented_engines)
+
 # Incluir routers
 app.include_router(auth.router, prefix="/api/auth", tags=["Autenticación"])
 app.include_router(users.router, prefix="/api/users", tags=["Usuarios"])
@@ -34,6 +59,53 @@ app.include_router(devices.router, prefix="/api/dispositivos", tags=["Dispositiv
 app.include_router(locations.router, prefix="/api/ubicaciones", tags=["Ubicaciones"])
 app.include_router(alerts.router, prefix="/api/alertas", tags=["Alertas"])
 
+# Ruta rápida del firmware (mismas respuestas que /api, sin la capa de FastAPI)
+if fast_ingest.FAST_INGEST_ENABLED:
+    app.mount(fast_ingest.FAST_INGEST_PREFIX, fast_ingest.app)
+
+@app.on_event("startup")
+async def start_background_tasks():
+    # Esquema al día, pools y cachés calientes antes de reportar /ready;
+    # las tareas que usan la BD arrancan recién con el worker listo
+    app.state.background_tasks = [asyncio.create_task(start_when_ready())]
+    # Invalidaciones de la caché de pertenencia y cuentas desactivadas en otros workers
+    ownership_cache.listen()
+    versioning.listen()
+
+async def start_when_ready():
+    await readiness.warm_up(SessionLocal)
+    app.state.background_tasks += [
+        # Volcado periódico de los incrementos del mapa de calor
+        asyncio.create_task(heatmap.flush_loop(SessionLocal)),
+        # Volcado periódico de los resúmenes por hora y por día
+        asyncio.create_task(rollups.flush_loop(SessionLocal)),
+        # Borrados de historial por bloques (retoma los que quedaron a medias)
+        asyncio.create_task(purge.purge_loop(SessionLocal)),
+    ]
+    # Alertas offline / back_online por plazos vencidos
+    if offline_detector.OFFLINE_DETECTION_ENABLED:
+        app.state.background_tasks.append(
+            asyncio.create_task(offline_detector.watch_loop(SessionLocal))
+        )
+    # Ingesta binaria por UDP/TCP para los rastreadores
+    if udp_ingest.UDP_INGEST_ENABLED:
+        app.state.background_tasks.append(
+            asyncio.create_task(udp_ingest.serve(SessionLocal))
+        )
+
+@app.on_event("shutdown")
+async def stop_background_tasks():
+    for task in app.state.background_tasks:
+        task.cancel()
+    # No perder los incrementos que quedaron en memoria
+    db = SessionLocal()
+    try:
+        heatmap.flush_pending(db)
+        rollups.flush_pending(db)
+    finally:
+        db.close()
+    shared_state.backend.close()
+
 @app.get("/")
 async def root():
     return {"message": "API Alarma Rastreadora v1.0.0"}
@@ -42,5 +114,15 @@ async def root():
 async def health_check():
     return {"status": "healthy"}
 
+@app.get("/ready")
+async def readiness_check():
+    """Listo para recibir tráfico: esquema migrado y worker caliente"""
+    if not readiness.state.ready:
+        return JSONResponse(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            content={"status": "not_ready", "detail": readiness.state.detail}
+        )
+    return {"status": "ready", "schema_version": readiness.state.schema_version}
+
 if __name__ == "__main__":
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
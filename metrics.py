@@ -0,0 +1,249 @@
+"""
+Métricas de la API en formato de texto de Prometheus.
+
+- Middleware ASGI: latencia por ruta, peticiones en curso y códigos de estado.
+- Eventos de SQLAlchemy: número de queries y tiempo de BD por petición,
+  y tiempo de espera al obtener una conexión del pool.
+
+Se activa con METRICS_ENABLED=true. Desactivado no se instala nada (ni
+middleware ni listeners), así que el costo es nulo.
+"""
+
+import os
+import threading
+import time
+from contextvars import ContextVar
+
+from sqlalchemy import event
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "false").lower() == "true"
+
+# Buckets en segundos, al estilo de los clientes oficiales de Prometheus
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 50, 100)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_number(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class Counter:
+    type_name = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for labels, value in items:
+            yield self.name, _format_labels(self.labelnames, labels), value
+
+
+class Gauge(Counter):
+    type_name = "gauge"
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram:
+    type_name = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets) + (float("inf"),)
+        # labels -> [conteos por bucket..., suma, total]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        with self._lock:
+            data = self._values.get(labels)
+            if data is None:
+                data = self._values[labels] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    data[i] += 1
+                    break
+            data[-2] += value
+            data[-1] += 1
+
+    def samples(self):
+        with self._lock:
+            items = [(labels, list(data)) for labels, data in self._values.items()]
+        for labels, data in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, data):
+                cumulative += count
+                le = f'le="{_format_number(float(bound))}"'
+                yield f"{self.name}_bucket", _format_labels(self.labelnames, labels, le), cumulative
+            yield f"{self.name}_sum", _format_labels(self.labelnames, labels), data[-2]
+            yield f"{self.name}_count", _format_labels(self.labelnames, labels), data[-1]
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        """Exportar todas las métricas en formato de texto de Prometheus"""
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type_name}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {_format_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+http_requests_total = registry.register(Counter(
+    "http_requests_total", "Peticiones HTTP atendidas", ("method", "route", "status")))
+http_request_duration = registry.register(Histogram(
+    "http_request_duration_seconds", "Latencia de las peticiones HTTP", ("method", "route")))
+http_requests_in_flight = registry.register(Gauge(
+    "http_requests_in_flight", "Peticiones HTTP en curso"))
+db_queries_per_request = registry.register(Histogram(
+    "db_queries_per_request", "Queries ejecutadas por petición", ("method", "route"),
+    buckets=QUERY_COUNT_BUCKETS))
+db_time_per_request = registry.register(Histogram(
+    "db_time_per_request_seconds", "Tiempo de BD acumulado por petición", ("method", "route")))
+db_queries_total = registry.register(Counter(
+    "db_queries_total", "Queries ejecutadas en total"))
+db_query_duration = registry.register(Histogram(
+    "db_query_duration_seconds", "Duración de cada query"))
+db_pool_checkout_wait = registry.register(Histogram(
+    "db_pool_checkout_wait_seconds", "Espera para obtener una conexión del pool"))
+
+
+class RequestStats:
+    __slots__ = ("queries", "db_time")
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+
+
+# Estadísticas de BD de la petición en curso (las comparte el threadpool de Starlette)
+current_request_stats = ContextVar("current_request_stats", default=None)
+
+
+class MetricsMiddleware:
+    """Middleware ASGI puro (sin BaseHTTPMiddleware) para medir cada petición"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+        stats = RequestStats()
+        token = current_request_stats.set(stats)
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        http_requests_in_flight.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            http_requests_in_flight.dec()
+            current_request_stats.reset(token)
+
+            # Etiquetar por plantilla de ruta para no explotar la cardinalidad
+            route = scope.get("route")
+            route_label = getattr(route, "path", None) or "unmatched"
+            method = scope["method"]
+            http_requests_total.inc(method, route_label, str(status_code))
+            http_request_duration.observe(elapsed, method, route_label)
+            db_queries_per_request.observe(stats.queries, method, route_label)
+            db_time_per_request.observe(stats.db_time, method, route_label)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start_time"].pop()
+    db_queries_total.inc()
+    db_query_duration.observe(elapsed)
+
+    stats = current_request_stats.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.db_time += elapsed
+
+
+def instrument_engine(engine):
+    """Registrar los eventos de cursor y medir la espera del pool"""
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+    # El pool no tiene evento "antes del checkout", así que se envuelve connect()
+    pool = engine.pool
+    pool_connect = pool.connect
+
+    def timed_connect():
+        start = time.perf_counter()
+        try:
+            return pool_connect()
+        finally:
+            db_pool_checkout_wait.observe(time.perf_counter() - start)
+
+    pool.connect = timed_connect
+
+
+def instrument_app(app, *engines):
+    """Instalar middleware, listeners y el endpoint /metrics"""
+    from fastapi.responses import PlainTextResponse
+
+    for engine in engines:
+        instrument_engine(engine)
+    app.add_middleware(MetricsMiddleware)
+
+    @app.get("/metrics", include_in_schema=False)
+    async def metrics_endpoint():
+        return PlainTextResponse(
+            registry.render(),
+            media_type="text/plain; version=0.0.4; charset=utf-8"
+        )
@@ -0,0 +1,169 @@
+"""
+Migraciones versionadas del esquema.
+
+La app ya no migra el esquema al importarse: se actualiza con este
+script, una vez por despliegue y antes de levantar los workers. Cada
+migración tiene un número; las aplicadas quedan en la tabla
+`schema_version` y solo se ejecutan las pendientes, cada una en su
+transacción. Los pasos comprueban lo que ya existe, así que una base
+creada con el antiguo create_all (con o sin las columnas nuevas) se
+completa sin errores.
+
+El worker no arranca como listo (/ready) mientras la base esté en una
+versión anterior a LATEST_VERSION.
+
+python migrations.py            # aplicar las pendientes
+python migrations.py --status   # versión actual y pendientes
+"""
+
+import argparse
+from datetime import datetime
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, func, inspect, select, text
+
+from database import Base
+from models import Alert, Device, HeatmapTile, Location, PurgeJob, Rollup, User
+
+schema_version = Table(
+    "schema_version", MetaData(),
+    Column("version", Integer, primary_key=True, autoincrement=False),
+    Column("description", String(200), nullable=False),
+    Column("applied_at", DateTime, nullable=False),
+)
+
+
+def _create_tables(conn, *models):
+    Base.metadata.create_all(conn, tables=[model.__table__ for model in models])
+
+
+def _add_columns(conn, model, *names):
+    """ALTER TABLE ... ADD COLUMN para las columnas del modelo que falten"""
+    table = model.__table__
+    present = {column["name"] for column in inspect(conn).get_columns(table.name)}
+    for name in names:
+        if name not in present:
+            column_type = table.c[name].type.compile(dialect=conn.dialect)
+            conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {name} {column_type}"))
+
+
+def _add_indexes(conn, model, *names):
+    """Crear los índices (o restricciones únicas, como índice único) del modelo que falten"""
+    table = model.__table__
+    inspector = inspect(conn)
+    present = {index["name"] for index in inspector.get_indexes(table.name)}
+    present.update(constraint["name"] for constraint in inspector.get_unique_constraints(table.name))
+    for name in names:
+        if name in present:
+            continue
+        index = next((index for index in table.indexes if index.name == name), None)
+        if index is not None:
+            index.create(conn)
+            continue
+        constraint = next(constraint for constraint in table.constraints if constraint.name == name)
+        columns = ", ".join(column.name for column in constraint.columns)
+        conn.execute(text(f"CREATE UNIQUE INDEX {name} ON {table.name} ({columns})"))
+
+
+def _base_tables(conn):
+    _create_tables(conn, User, Device, Location, Alert)
+
+
+def _ingest_seq(conn):
+    _add_columns(conn, Location, "seq")
+    _add_columns(conn, Alert, "seq")
+    _add_indexes(conn, Location, "uq_locations_device_seq")
+    _add_indexes(conn, Alert, "uq_alerts_device_seq")
+
+
+def _geohash(conn):
+    _add_columns(conn, Location, "geohash")
+    _add_columns(conn, Device, "last_latitude", "last_longitude", "last_geohash", "last_fix_at")
+    _add_indexes(conn, Location, "ix_locations_device_geohash")
+    _add_indexes(conn, Device, "ix_devices_last_geohash")
+
+
+def _heatmap_tiles(conn):
+    _create_tables(conn, HeatmapTile)
+
+
+def _offline_since(conn):
+    _add_columns(conn, Device, "offline_since")
+
+
+def _outliers(conn):
+    _add_columns(conn, Location, "is_outlier")
+
+
+def _purge_jobs(conn):
+    _create_tables(conn, PurgeJob)
+
+
+def _rollups(conn):
+    _create_tables(conn, Rollup)
+
+
+def _location_timestamp_index(conn):
+    _add_indexes(conn, Location, "ix_locations_device_timestamp")
+
+
+# (versión, descripción, paso): agregar al final, nunca renumerar
+MIGRATIONS = [
+    (1, "Tablas base: usuarios, dispositivos, ubicaciones y alertas", _base_tables),
+    (2, "Número de secuencia de ubicaciones y alertas con índice único", _ingest_seq),
+    (3, "Geohash de ubicaciones y última posición de los dispositivos", _geohash),
+    (4, "Tiles del mapa de calor", _heatmap_tiles),
+    (5, "Marca offline de los dispositivos", _offline_since),
+    (6, "Marca de ubicación descartada por el filtro GPS", _outliers),
+    (7, "Trabajos de purga del historial", _purge_jobs),
+    (8, "Resúmenes por hora y por día", _rollups),
+    (9, "Índice (device_id, timestamp) de ubicaciones", _location_timestamp_index),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def current_version(bind):
+    """Última versión aplicada (0 si la base nunca se migró)"""
+    with bind.connect() as conn:
+        if not inspect(conn).has_table(schema_version.name):
+            return 0
+        return conn.execute(select(func.max(schema_version.c.version))).scalar() or 0
+
+
+def pending(bind):
+    version = current_version(bind)
+    return [migration for migration in MIGRATIONS if migration[0] > version]
+
+
+def upgrade(bind):
+    """Aplicar las migraciones pendientes; devuelve las aplicadas"""
+    with bind.begin() as conn:
+        schema_version.create(conn, checkfirst=True)
+    applied = []
+    for version, description, step in pending(bind):
+        with bind.begin() as conn:
+            step(conn)
+            conn.execute(schema_version.insert().values(
+                version=version, description=description, applied_at=datetime.utcnow()
+            ))
+        applied.append((version, description, step))
+    return applied
+
+
+if __name__ == "__main__":
+    from database import engine
+
+    parser = argparse.ArgumentParser(description="Migraciones del esquema de la base de datos")
+    parser.add_argument("--status", action="store_true", help="Mostrar la versión actual y las pendientes")
+    args = parser.parse_args()
+
+    if args.status:
+        missing = pending(engine)
+        print(f"📋 Esquema en la versión {current_version(engine)} (última: {LATEST_VERSION})")
+        for version, description, _ in missing:
+            print(f"   ⏳ {version}: {description}")
+    else:
+        applied = upgrade(engine)
+        for version, description, _ in applied:
+            print(f"✅ {version}: {description}")
+        print(f"✅ Esquema en la versión {current_version(engine)}")
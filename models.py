@@ -1,9 +1,8 @@
-from sqlalchemy import Column, Integer, String, Float, Boolean, DateTime, ForeignKey, Text
-from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy import Column, Integer, BigInteger, String, Float, Boolean, DateTime, ForeignKey, Text, LargeBinary, UniqueConstraint, Index
 from sqlalchemy.orm import relationship
 from datetime import datetime
 
-Base = declarative_base()
+from database import Base
 
 class User(Base):
     __tablename__ = "users"
@@ -33,6 +32,12 @@ class Device(Base):
     security_mode = Column(Boolean, default=False)  # Modo seguridad activado/desactivado
     is_active = Column(Boolean, default=True)
     last_ping = Column(DateTime, nullable=True)  # Última vez que el dispositivo se comunicó
+    # Última posición conocida, con geohash indexado para búsquedas de flota por zona
+    last_latitude = Column(Float, nullable=True)
+    last_longitude = Column(Float, nullable=True)
+    last_geohash = Column(String(12), nullable=True, index=True)
+    last_fix_at = Column(DateTime, nullable=True)
+    offline_since = Column(DateTime, nullable=True)  # Marcado por el detector al dejar de reportar
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
@@ -51,8 +56,20 @@ class Location(Base):
     accuracy = Column(Float, nullable=True)  # Precisión del GPS
     speed = Column(Float, nullable=True)  # Velocidad si está disponible
     altitude = Column(Float, nullable=True)  # Altitud si está disponible
+    seq = Column(BigInteger, nullable=True)  # Número de secuencia enviado por el dispositivo
+    geohash = Column(String(12), nullable=True)  # Celda geohash para búsquedas espaciales
+    is_outlier = Column(Boolean, default=False)  # Salto imposible según el filtro GPS
     timestamp = Column(DateTime, default=datetime.utcnow)
     
+    __table_args__ = (
+        # Un reintento con la misma secuencia no crea otra fila
+        UniqueConstraint("device_id", "seq", name="uq_locations_device_seq"),
+        # Búsquedas por zona dentro del historial de un dispositivo
+        Index("ix_locations_device_geohash", "device_id", "geohash"),
+        # Historial por fecha y posición en un instante (búsqueda indexada por dispositivo)
+        Index("ix_locations_device_timestamp", "device_id", "timestamp"),
+    )
+    
     # Relación
     device = relationship("Device", back_populates="locations")
 
@@ -67,7 +84,63 @@ class Alert(Base):
     longitude = Column(Float, nullable=True)
     is_read = Column(Boolean, default=False)
     severity = Column(String(20), default="medium")  # low, medium, high, critical
+    seq = Column(BigInteger, nullable=True)  # Número de secuencia enviado por el dispositivo
     timestamp = Column(DateTime, default=datetime.utcnow)
     
+    # Un reintento con la misma secuencia no crea otra fila
+    __table_args__ = (UniqueConstraint("device_id", "seq", name="uq_alerts_device_seq"),)
+    
     # Relación
     device = relationship("Device", back_populates="alerts")
+
+class HeatmapTile(Base):
+    __tablename__ = "heatmap_tiles"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    device_id = Column(Integer, ForeignKey("devices.id"), nullable=False)
+    zoom = Column(Integer, nullable=False)
+    tile_x = Column(Integer, nullable=False)  # Tile Web Mercator (x, y) en ese zoom
+    tile_y = Column(Integer, nullable=False)
+    counts = Column(LargeBinary, nullable=True)  # Grilla de conteos uint32 little-endian
+    total = Column(Integer, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        UniqueConstraint("device_id", "zoom", "tile_x", "tile_y", name="uq_heatmap_tiles_tile"),
+    )
+
+class PurgeJob(Base):
+    __tablename__ = "purge_jobs"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    device_id = Column(Integer, ForeignKey("devices.id"), nullable=False)
+    owner_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    status = Column(String(20), default="pending", index=True)  # pending, running, done
+    max_location_id = Column(Integer, nullable=True)  # Se borra hasta este id (lo que existía al pedirlo)
+    last_location_id = Column(Integer, default=0)  # Avance: ya se borró hasta aquí
+    deleted_count = Column(Integer, default=0)
+    error = Column(Text, nullable=True)
+    lease_until = Column(DateTime, nullable=True)  # Worker que lo procesa, mientras no venza
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    finished_at = Column(DateTime, nullable=True)
+
+class Rollup(Base):
+    __tablename__ = "rollups"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    device_id = Column(Integer, ForeignKey("devices.id"), nullable=False)
+    period = Column(String(10), nullable=False)  # hour, day
+    bucket = Column(DateTime, nullable=False)  # Inicio de la hora o del día (UTC)
+    point_count = Column(Integer, default=0)
+    distance_m = Column(Float, default=0.0)
+    max_speed = Column(Float, nullable=True)  # km/h, como Location.speed
+    first_fix_at = Column(DateTime, nullable=True)
+    last_fix_at = Column(DateTime, nullable=True)
+    alert_count = Column(Integer, default=0)
+    alert_counts = Column(Text, nullable=True)  # JSON {"alert_type": {...}, "severity": {...}}
+    updated_at = Column(DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        UniqueConstraint("device_id", "period", "bucket", name="uq_rollups_bucket"),
+    )
@@ -0,0 +1,238 @@
+"""
+Detector de dispositivos que dejaron de reportar.
+
+Cada heartbeat (ubicación, alerta o consulta de modo) mueve el plazo del
+dispositivo a ahora + OFFLINE_TIMEOUT_SECONDS. Los plazos viven en un
+min-heap con una sola entrada por dispositivo: el heartbeat solo actualiza
+un diccionario y, cuando la entrada llega a la cima del heap, se
+reprograma con el plazo vigente si hubo heartbeats entre medio. Así el
+costo no depende de la cantidad de dispositivos y nunca se recorre la
+tabla `devices` (salvo una vez al arrancar, para cargar los plazos).
+
+Al vencer un plazo se confirma contra `last_ping` en la BD (con varios
+workers el heartbeat pudo llegar a otro) y se marca `offline_since` con
+un UPDATE condicional, de modo que solo un worker emite la alerta
+`offline`. El siguiente heartbeat limpia la marca y emite `back_online`.
+
+A un dispositivo al que se le recomendó reportar cada más tiempo
+(reporting_policy) no se lo puede esperar solo OFFLINE_TIMEOUT_SECONDS:
+su plazo pasa a ser OFFLINE_INTERVAL_FACTOR veces el intervalo
+recomendado. Ese plazo por dispositivo se guarda también en el estado
+compartido, para que el worker que confirma use el mismo.
+"""
+
+import asyncio
+import heapq
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+import rollups
+import shared_state
+import versioning
+from models import Device, Alert
+
+OFFLINE_DETECTION_ENABLED = os.getenv("OFFLINE_DETECTION_ENABLED", "true").lower() == "true"
+OFFLINE_TIMEOUT_SECONDS = float(os.getenv("OFFLINE_TIMEOUT_SECONDS", "120"))
+OFFLINE_CHECK_SECONDS = float(os.getenv("OFFLINE_CHECK_SECONDS", "5"))
+# Intervalos recomendados que puede perder un dispositivo antes de considerarlo offline
+OFFLINE_INTERVAL_FACTOR = float(os.getenv("OFFLINE_INTERVAL_FACTOR", "2"))
+
+logger = logging.getLogger("offline_detector")
+
+EPOCH = datetime(1970, 1, 1)
+CONFIRM_CHUNK = 500
+
+
+def _epoch(value):
+    """Segundos desde epoch de un datetime UTC naive"""
+    return (value - EPOCH).total_seconds()
+
+
+class OfflineDetector:
+    """Plazos por dispositivo en un min-heap con reprogramación perezosa"""
+
+    def __init__(self, timeout=OFFLINE_TIMEOUT_SECONDS):
+        self.timeout = timeout
+        self._deadlines = {}
+        # Plazos distintos del general, por intervalo de reporte recomendado
+        self._timeouts = {}
+        self._heap = []
+        self._lock = threading.Lock()
+
+    def timeout_for(self, device_pk):
+        return self._timeouts.get(device_pk, self.timeout)
+
+    def touch(self, device_pk, at=None, timeout=None):
+        """Registrar un heartbeat (at en segundos epoch; por defecto ahora), opcionalmente con un plazo nuevo"""
+        with self._lock:
+            if timeout is not None:
+                if timeout > self.timeout:
+                    self._timeouts[device_pk] = timeout
+                else:
+                    self._timeouts.pop(device_pk, None)
+            deadline = (time.time() if at is None else at) + self.timeout_for(device_pk)
+            if device_pk not in self._deadlines:
+                heapq.heappush(self._heap, (deadline, device_pk))
+            self._deadlines[device_pk] = deadline
+
+    def forget(self, device_pk):
+        """Dejar de vigilar un dispositivo (su entrada del heap se descarta al salir)"""
+        with self._lock:
+            self._deadlines.pop(device_pk, None)
+            self._timeouts.pop(device_pk, None)
+
+    def pop_expired(self, now=None):
+        """Dispositivos cuyo plazo venció; dejan de vigilarse hasta el próximo heartbeat"""
+        now = time.time() if now is None else now
+        expired = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                _, device_pk = heapq.heappop(self._heap)
+                current = self._deadlines.get(device_pk)
+                if current is None:
+                    continue
+                if current > now:
+                    # Hubo heartbeats desde que se programó: mover al plazo vigente
+                    heapq.heappush(self._heap, (current, device_pk))
+                    continue
+                del self._deadlines[device_pk]
+                expired.append(device_pk)
+        return expired
+
+    def __len__(self):
+        return len(self._deadlines)
+
+
+detector = OfflineDetector()
+
+
+def _status_alert(device, alert_type, message, severity, now):
+    return Alert(
+        device_id=device.id,
+        alert_type=alert_type,
+        message=message,
+        latitude=device.last_latitude,
+        longitude=device.last_longitude,
+        severity=severity,
+        timestamp=now
+    )
+
+
+def heartbeat(db, device, now=None):
+    """Llamar en cada contacto del dispositivo, antes del commit de la petición"""
+    if not OFFLINE_DETECTION_ENABLED:
+        return
+    now = now or datetime.utcnow()
+    detector.touch(device.id, _epoch(now))
+    if device.offline_since is not None:
+        device.offline_since = None
+        db.add(_status_alert(device, "back_online", "El dispositivo volvió a reportar", "low", now))
+
+
+def _timeout_key(device_pk):
+    return f"offline:timeout:{device_pk}"
+
+
+def expect(device_pk, interval_seconds):
+    """Se le recomendó al dispositivo reportar en `interval_seconds`: ajustar su plazo"""
+    if not OFFLINE_DETECTION_ENABLED:
+        return
+    timeout = max(OFFLINE_TIMEOUT_SECONDS, OFFLINE_INTERVAL_FACTOR * interval_seconds)
+    if timeout > detector.timeout:
+        # Vence solo si el dispositivo deja de pedir intervalos
+        shared_state.backend.set(_timeout_key(device_pk), f"{timeout:.0f}", ttl=2 * timeout)
+    elif detector.timeout_for(device_pk) > detector.timeout:
+        shared_state.backend.delete(_timeout_key(device_pk))
+    detector.touch(device_pk, timeout=timeout)
+
+
+def _timeouts(device_pks):
+    """Plazo vigente de cada dispositivo (el del estado compartido, si lo anotó otro worker)"""
+    values = shared_state.backend.get_many([_timeout_key(device_pk) for device_pk in device_pks])
+    return {
+        device_pk: float(value) if value is not None else detector.timeout_for(device_pk)
+        for device_pk, value in zip(device_pks, values)
+    }
+
+
+def seed(db):
+    """Cargar los plazos de los dispositivos activos que no están marcados offline"""
+    rows = db.query(Device.id, Device.last_ping).filter(
+        Device.is_active == True,
+        Device.offline_since == None,
+        Device.last_ping != None
+    ).all()
+    for device_pk, last_ping in rows:
+        detector.touch(device_pk, _epoch(last_ping))
+    return len(rows)
+
+
+def mark_offline(db, device_pks, now=None):
+    """Confirmar en la BD los plazos vencidos y emitir las alertas; devuelve cuántas"""
+    now = now or datetime.utcnow()
+    emitted = 0
+
+    for start in range(0, len(device_pks), CONFIRM_CHUNK):
+        chunk = device_pks[start:start + CONFIRM_CHUNK]
+        timeouts = _timeouts(chunk)
+        devices = db.query(Device).filter(
+            Device.id.in_(chunk),
+            Device.is_active == True,
+            Device.offline_since == None
+        ).all()
+        marked = []
+        for device in devices:
+            timeout = timeouts[device.id]
+            if device.last_ping is not None and device.last_ping > now - timedelta(seconds=timeout):
+                # El heartbeat llegó a otro worker, o el plazo del dispositivo es más largo
+                detector.touch(device.id, _epoch(device.last_ping), timeout)
+                continue
+            # Solo un worker gana la transición
+            updated = db.query(Device).filter(
+                Device.id == device.id,
+                Device.offline_since == None
+            ).update({Device.offline_since: now}, synchronize_session=False)
+            if updated:
+                db.add(_status_alert(device, "offline", "El dispositivo dejó de reportar", "high", now))
+                marked.append(device)
+        db.commit()
+        for device in marked:
+            versioning.bump(versioning.USER_DEVICES, device.owner_id)
+            versioning.bump_alerts(device.owner_id, device.id)
+            rollups.accumulator.add_alert(device.id, now, "offline", "high")
+        emitted += len(marked)
+
+    return emitted
+
+
+async def watch_loop(session_factory):
+    """Ciclo de fondo: cargar los plazos y emitir alertas al vencer"""
+    from starlette.concurrency import run_in_threadpool
+
+    def run(func, *args):
+        db = session_factory()
+        try:
+            return func(db, *args)
+        finally:
+            db.close()
+
+    try:
+        await run_in_threadpool(run, seed)
+    except Exception:
+        logger.exception("No se pudieron cargar los plazos de los dispositivos")
+
+    while True:
+        await asyncio.sleep(OFFLINE_CHECK_SECONDS)
+        expired = detector.pop_expired()
+        if not expired:
+            continue
+        try:
+            await run_in_threadpool(run, mark_offline, expired)
+        except Exception:
+            # Reintentar en el próximo ciclo
+            logger.exception("Error al marcar dispositivos offline")
+            for device_pk in expired:
+                detector.touch(device_pk, time.time() - detector.timeout_for(device_pk))
@@ -0,0 +1,158 @@
+"""
+Caché de pertenencia de dispositivos por usuario.
+
+Para autorizar un endpoint de dispositivo basta saber que el device_id es
+del usuario y cuál es su id interno. En lugar de consultar la tabla en
+cada petición se guarda, por usuario, el mapa device_id -> (id, activo),
+cargado con una sola query la primera vez.
+
+Crear, actualizar o desactivar dispositivos invalida la entrada del
+usuario, también en los demás workers (se publica en el canal
+OWNERSHIP_CHANNEL del estado compartido). Como la invalidación puede
+llegar tarde o perderse, un device_id que no está en la entrada se
+confirma en la BD antes de responder 404 y las entradas caducan a los
+OWNERSHIP_CACHE_TTL segundos.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import shared_state
+from models import Device
+
+OWNERSHIP_CACHE_TTL = float(os.getenv("OWNERSHIP_CACHE_TTL", "60"))
+OWNERSHIP_CACHE_MAX_USERS = int(os.getenv("OWNERSHIP_CACHE_MAX_USERS", "10000"))
+
+OWNERSHIP_CHANNEL = "ownership"
+
+# Con más dispositivos que esto se filtra con subconsulta en vez de IN (...)
+MAX_IN_LIST = 500
+
+
+class _UserDevices:
+    __slots__ = ("loaded_at", "devices", "active_pks")
+
+    def __init__(self, rows):
+        self.loaded_at = time.monotonic()
+        self.devices = {device_id: (pk, is_active) for device_id, pk, is_active in rows}
+        self.active_pks = [pk for pk, is_active in self.devices.values() if is_active]
+
+
+class OwnershipCache:
+    def __init__(self, ttl=OWNERSHIP_CACHE_TTL, max_users=OWNERSHIP_CACHE_MAX_USERS):
+        self.ttl = ttl
+        self.max_users = max_users
+        self._users = OrderedDict()
+        self._version = 0
+        self._lock = threading.Lock()
+
+    def _load(self, db, user_id):
+        version = self._version
+        rows = db.query(Device.device_id, Device.id, Device.is_active).filter(
+            Device.owner_id == user_id
+        ).all()
+        entry = _UserDevices(rows)
+        with self._lock:
+            if version != self._version:
+                # Hubo una invalidación mientras se cargaba: no guardar datos viejos
+                return entry
+            self._users[user_id] = entry
+            self._users.move_to_end(user_id)
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+        return entry
+
+    def _entry(self, db, user_id):
+        """(entrada, recién_cargada)"""
+        with self._lock:
+            entry = self._users.get(user_id)
+            if entry is not None and time.monotonic() - entry.loaded_at < self.ttl:
+                self._users.move_to_end(user_id)
+                return entry, False
+        return self._load(db, user_id), True
+
+    def device_pk(self, db, user_id, device_id):
+        """Id interno del dispositivo si pertenece al usuario (activo o no), si no None"""
+        entry, fresh = self._entry(db, user_id)
+        found = entry.devices.get(device_id)
+        if found is None and not fresh:
+            # Quizá se creó en otro worker: confirmar con la BD antes del 404
+            exists = db.query(Device.id).filter(
+                Device.device_id == device_id,
+                Device.owner_id == user_id
+            ).first()
+            if exists is not None:
+                found = self._load(db, user_id).devices.get(device_id)
+        return found[0] if found is not None else None
+
+    def active_pks(self, db, user_id):
+        """Ids internos de los dispositivos activos del usuario"""
+        return self._entry(db, user_id)[0].active_pks
+
+    def warm(self, db, user_ids):
+        """Cargar de una vez las entradas de varios usuarios (al arrancar el worker)"""
+        version = self._version
+        rows = {user_id: [] for user_id in user_ids}
+        for owner_id, device_id, pk, is_active in db.query(
+            Device.owner_id, Device.device_id, Device.id, Device.is_active
+        ).filter(Device.owner_id.in_(user_ids)):
+            rows[owner_id].append((device_id, pk, is_active))
+        with self._lock:
+            if version != self._version:
+                return 0
+            for user_id, devices in rows.items():
+                self._users[user_id] = _UserDevices(devices)
+                self._users.move_to_end(user_id)
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+        return len(rows)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._version += 1
+            self._users.pop(user_id, None)
+
+
+ownership = OwnershipCache()
+
+
+def device_pk(db, user_id, device_id):
+    return ownership.device_pk(db, user_id, device_id)
+
+
+def active_pks(db, user_id):
+    return ownership.active_pks(db, user_id)
+
+
+def active_device_filter(db, user_id, column):
+    """Condición `column` IN (dispositivos activos del usuario)"""
+    pks = ownership.active_pks(db, user_id)
+    if len(pks) <= MAX_IN_LIST:
+        return column.in_(pks)
+    # Flotas grandes: subconsulta indexada en lugar de una lista enorme de parámetros
+    return column.in_(db.query(Device.id).filter(
+        Device.owner_id == user_id,
+        Device.is_active == True
+    ))
+
+
+def warm(db, user_ids):
+    return ownership.warm(db, user_ids)
+
+
+def invalidate(user_id):
+    ownership.invalidate(user_id)
+    shared_state.backend.publish(OWNERSHIP_CHANNEL, f"{shared_state.PROCESS_ID}:{user_id}")
+
+
+def _on_invalidate(message):
+    process_id, _, user_id = message.partition(":")
+    if process_id != shared_state.PROCESS_ID:
+        ownership.invalidate(int(user_id))
+
+
+def listen():
+    """Recibir las invalidaciones de los demás workers (al arrancar la app)"""
+    shared_state.backend.subscribe(OWNERSHIP_CHANNEL, _on_invalidate)
@@ -0,0 +1,185 @@
+"""
+Borrado en segundo plano del historial de un dispositivo.
+
+Un DELETE de millones de filas en una sola transacción bloquea SQLite (o
+infla el undo log de MySQL) y frena la ingesta. Aquí cada purga es un
+trabajo en la tabla `purge_jobs` que se procesa por bloques de
+PURGE_CHUNK_ROWS ids consecutivos, cada uno en una transacción corta, con
+una pausa entre bloques.
+
+Se borra lo que existía al crear el trabajo (ids hasta `max_location_id`,
+en la tabla y en el archivo frío); lo que llega después se conserva y con
+eso se reconstruyen al final los tiles del mapa de calor y los resúmenes
+del dispositivo. Lo pendiente en los acumuladores de este proceso se
+descarta antes; el de otros workers puede sumar de nuevo fixes que ya
+estaban guardados (unos segundos de ingesta, se corrige con --rebuild).
+
+El avance (último id borrado) se guarda en el mismo commit que el bloque,
+así que tras un reinicio el trabajo sigue donde quedó. Un worker toma un
+trabajo con un UPDATE condicional sobre `lease_until` y lo renueva en cada
+bloque; si muere o falla, el trabajo se retoma cuando vence.
+"""
+
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta
+
+from sqlalchemy import or_
+
+import archive
+import heatmap
+import rollups
+import versioning
+from models import Location, PurgeJob
+
+PURGE_CHUNK_ROWS = int(os.getenv("PURGE_CHUNK_ROWS", "1000"))
+PURGE_PAUSE_SECONDS = float(os.getenv("PURGE_PAUSE_SECONDS", "0.05"))
+PURGE_POLL_SECONDS = float(os.getenv("PURGE_POLL_SECONDS", "5"))
+PURGE_LEASE_SECONDS = 60
+
+ACTIVE_STATUSES = ("pending", "running")
+
+logger = logging.getLogger("purge")
+
+# Despierta al worker de este proceso cuando se crea un trabajo
+_wake = None
+
+
+def create_job(db, device_pk, owner_id):
+    """Crear (o devolver el ya activo) trabajo de purga de ubicaciones del dispositivo"""
+    job = db.query(PurgeJob).filter(
+        PurgeJob.device_id == device_pk,
+        PurgeJob.status.in_(ACTIVE_STATUSES)
+    ).first()
+    if job is None:
+        # Se borra lo que existe ahora; lo que llegue después se conserva
+        max_id = db.query(Location.id).filter(
+            Location.device_id == device_pk
+        ).order_by(Location.id.desc()).limit(1).scalar()
+        # Con todo el historial ya archivado el límite sale del archivo
+        max_id = max(max_id or 0, archive.last_id(device_pk))
+        job = PurgeJob(device_id=device_pk, owner_id=owner_id, max_location_id=max_id)
+        db.add(job)
+        db.commit()
+        db.refresh(job)
+    if _wake is not None:
+        _wake.set()
+    return job
+
+
+def claim_next_job(db):
+    """Tomar un trabajo pendiente o abandonado; devuelve su id o None"""
+    now = datetime.utcnow()
+    candidates = db.query(PurgeJob.id).filter(
+        PurgeJob.status.in_(ACTIVE_STATUSES),
+        or_(PurgeJob.lease_until == None, PurgeJob.lease_until < now)
+    ).order_by(PurgeJob.id).limit(5).all()
+
+    for (job_id,) in candidates:
+        claimed = db.query(PurgeJob).filter(
+            PurgeJob.id == job_id,
+            or_(PurgeJob.lease_until == None, PurgeJob.lease_until < now)
+        ).update({
+            PurgeJob.status: "running",
+            PurgeJob.lease_until: now + timedelta(seconds=PURGE_LEASE_SECONDS)
+        }, synchronize_session=False)
+        db.commit()
+        if claimed:
+            return job_id
+    return None
+
+
+def run_chunk(db, job_id):
+    """Borrar el siguiente bloque del trabajo; devuelve True si quedan más"""
+    job = db.query(PurgeJob).filter(PurgeJob.id == job_id).first()
+    if job is None or job.status != "running":
+        return False
+
+    # Límite superior del bloque: el id número PURGE_CHUNK_ROWS a partir del avance
+    ids = db.query(Location.id).filter(
+        Location.device_id == job.device_id,
+        Location.id > job.last_location_id,
+        Location.id <= job.max_location_id
+    ).order_by(Location.id).limit(PURGE_CHUNK_ROWS).all()
+
+    now = datetime.utcnow()
+    if not ids:
+        # Terminado: el archivo frío hasta el mismo límite y, con lo que quedó,
+        # los tiles del mapa de calor y los resúmenes (se puede repetir sin daño)
+        job.deleted_count += archive.delete_device(job.device_id, job.max_location_id)
+        heatmap.accumulator.discard(job.device_id)
+        rollups.accumulator.discard(job.device_id)
+        heatmap.rebuild(db, job.device_id)
+        rollups.rebuild(db, job.device_id)
+        job.status = "done"
+        job.finished_at = now
+        job.lease_until = None
+        db.commit()
+        versioning.bump(versioning.DEVICE_LOCATIONS, job.device_id)
+        return False
+
+    upper = ids[-1][0]
+    deleted = db.query(Location).filter(
+        Location.device_id == job.device_id,
+        Location.id > job.last_location_id,
+        Location.id <= upper
+    ).delete(synchronize_session=False)
+
+    # Avance y borrado en el mismo commit
+    job.last_location_id = upper
+    job.deleted_count += deleted
+    job.lease_until = now + timedelta(seconds=PURGE_LEASE_SECONDS)
+    db.commit()
+    versioning.bump(versioning.DEVICE_LOCATIONS, job.device_id)
+    return True
+
+
+def record_error(db, job_id, error):
+    """Anotar el error; el trabajo se reintenta cuando vence su lease"""
+    db.query(PurgeJob).filter(PurgeJob.id == job_id).update({
+        PurgeJob.error: str(error)[:1000]
+    }, synchronize_session=False)
+    db.commit()
+
+
+async def purge_loop(session_factory):
+    """Worker de fondo: procesa los trabajos de purga de a un bloque por vez"""
+    global _wake
+    from starlette.concurrency import run_in_threadpool
+
+    _wake = asyncio.Event()
+
+    def run(func, *args):
+        db = session_factory()
+        try:
+            return func(db, *args)
+        finally:
+            db.close()
+
+    while True:
+        try:
+            job_id = await run_in_threadpool(run, claim_next_job)
+        except Exception:
+            logger.exception("Error al buscar trabajos de purga")
+            job_id = None
+
+        if job_id is None:
+            # Esperar un trabajo nuevo de este proceso o el siguiente sondeo
+            _wake.clear()
+            try:
+                await asyncio.wait_for(_wake.wait(), PURGE_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            continue
+
+        try:
+            while await run_in_threadpool(run, run_chunk, job_id):
+                # Pausa entre bloques para dejar pasar la ingesta
+                await asyncio.sleep(PURGE_PAUSE_SECONDS)
+        except Exception as error:
+            logger.exception("Error en el trabajo de purga %s", job_id)
+            try:
+                await run_in_threadpool(run, record_error, job_id, error)
+            except Exception:
+                logger.exception("No se pudo anotar el error del trabajo %s", job_id)
@@ -0,0 +1,174 @@
+"""
+Perfilado de queries por petición y detección de N+1.
+
+Con QUERY_PROFILING=true cada petición registra en el log su número de
+queries, el tiempo total de BD y el SQL normalizado, y se marca como
+fuera de presupuesto si supera QUERY_BUDGET_COUNT queries o
+QUERY_BUDGET_MS milisegundos de BD. Una misma sentencia normalizada
+repetida N_PLUS_ONE_THRESHOLD veces se reporta como posible N+1.
+
+Para pruebas, assert_max_queries() falla si un bloque ejecuta más
+queries de las permitidas:
+
+    with assert_max_queries(2):
+        client.get("/api/alertas/user", headers=headers)
+"""
+
+import logging
+import os
+import re
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from sqlalchemy import event
+
+QUERY_PROFILING = os.getenv("QUERY_PROFILING", "false").lower() == "true"
+QUERY_BUDGET_COUNT = int(os.getenv("QUERY_BUDGET_COUNT", "6"))
+QUERY_BUDGET_MS = float(os.getenv("QUERY_BUDGET_MS", "100"))
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "50"))
+N_PLUS_ONE_THRESHOLD = int(os.getenv("N_PLUS_ONE_THRESHOLD", "5"))
+
+logger = logging.getLogger("query_profiler")
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+_IN_LIST = re.compile(r"\bIN\s*\((?:\s*(?:\?|%s|:\w+|__\[POSTCOMPILE_\w+\])\s*,?)+\)", re.IGNORECASE)
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_sql(statement):
+    """Quitar literales y colapsar listas IN para agrupar sentencias equivalentes"""
+    statement = _STRING_LITERAL.sub("?", statement)
+    statement = _NUMBER_LITERAL.sub("?", statement)
+    statement = _IN_LIST.sub("IN (...)", statement)
+    return _WHITESPACE.sub(" ", statement).strip()
+
+
+class QueryLog:
+    __slots__ = ("statements", "db_time")
+
+    def __init__(self):
+        self.statements = []
+        self.db_time = 0.0
+
+    def record(self, statement, elapsed):
+        self.statements.append((statement, elapsed))
+        self.db_time += elapsed
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+    def repeated(self, threshold):
+        """Sentencias normalizadas que se repiten al menos `threshold` veces"""
+        counts = Counter(normalize_sql(statement) for statement, _ in self.statements)
+        return [(sql, n) for sql, n in counts.most_common() if n >= threshold]
+
+
+current_query_log = ContextVar("current_query_log", default=None)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("profiler_start_time", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["profiler_start_time"].pop()
+    query_log = current_query_log.get()
+    if query_log is not None:
+        query_log.record(statement, elapsed)
+
+    if elapsed * 1000 >= SLOW_QUERY_MS:
+        logger.warning("Query lenta (%.1f ms): %s", elapsed * 1000, normalize_sql(statement))
+
+
+class QueryProfilerMiddleware:
+    """Middleware ASGI que resume las queries de cada petición"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        query_log = QueryLog()
+        token = current_query_log.set(query_log)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            current_query_log.reset(token)
+            self.report(scope, query_log)
+
+    def report(self, scope, query_log):
+        route = getattr(scope.get("route"), "path", scope["path"])
+        db_ms = query_log.db_time * 1000
+        summary = f"{scope['method']} {route}: {query_log.count} queries, {db_ms:.1f} ms de BD"
+
+        over_budget = query_log.count > QUERY_BUDGET_COUNT or db_ms > QUERY_BUDGET_MS
+        repeated = query_log.repeated(N_PLUS_ONE_THRESHOLD)
+        if not over_budget and not repeated:
+            logger.info(summary)
+            return
+
+        lines = [f"{summary} (presupuesto: {QUERY_BUDGET_COUNT} queries, {QUERY_BUDGET_MS:.0f} ms)"]
+        for sql, n in repeated:
+            lines.append(f"  posible N+1 ({n}x): {sql}")
+        for statement, elapsed in query_log.statements:
+            lines.append(f"  {elapsed * 1000:7.2f} ms  {normalize_sql(statement)}")
+        logger.warning("\n".join(lines))
+
+
+def instrument_app(app, *engines):
+    """Activar el perfilado de queries en la app"""
+    if not logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(levelname)s [%(name)s] %(message)s"))
+        logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+
+    for engine in engines:
+        event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    app.add_middleware(QueryProfilerMiddleware)
+
+
+@contextmanager
+def capture_queries(engine=None):
+    """Registrar todas las queries ejecutadas en el engine dentro del bloque"""
+    if engine is None:
+        from database import engine
+
+    query_log = QueryLog()
+    starts = []
+
+    def before(conn, cursor, statement, parameters, context, executemany):
+        starts.append(time.perf_counter())
+
+    def after(conn, cursor, statement, parameters, context, executemany):
+        query_log.record(statement, time.perf_counter() - starts.pop())
+
+    event.listen(engine, "before_cursor_execute", before)
+    event.listen(engine, "after_cursor_execute", after)
+    try:
+        yield query_log
+    finally:
+        event.remove(engine, "before_cursor_execute", before)
+        event.remove(engine, "after_cursor_execute", after)
+
+
+@contextmanager
+def assert_max_queries(max_queries, engine=None):
+    """Helper de pruebas: fallar si el bloque ejecuta más de `max_queries` queries"""
+    with capture_queries(engine) as query_log:
+        yield query_log
+
+    if query_log.count > max_queries:
+        detail = "\n".join(f"  {normalize_sql(statement)}" for statement, _ in query_log.statements)
+        raise AssertionError(
+            f"Se esperaban como máximo {max_queries} queries y se ejecutaron "
+            f"{query_log.count}:\n{detail}"
+        )
@@ -0,0 +1,274 @@
+"""
+Control de admisión para el tráfico de dispositivos y de la app.
+
+- Token bucket por dispositivo (device_id del Arduino) para /api/ubicaciones,
+  /api/alertas y la consulta de modo.
+- Límite global de concurrencia para la ingesta que escribe en la BD.
+- Token bucket separado por usuario (el email de un token Bearer válido)
+  para el tráfico de la app, de modo que una avalancha de dispositivos no
+  deje sin servicio a la app.
+
+Solo las claves verificadas ocupan lugar en las tablas: el bucket de un
+device_id se crea cuando el dispositivo existe y está activo, y una
+petición con un token inválido no tiene bucket (la rechaza la
+autenticación). Así una avalancha de ids o tokens inventados no expulsa
+del LRU a los dispositivos y usuarios reales, lo que les reiniciaría el
+límite.
+
+Al superar un límite se responde 429 con la cabecera Retry-After.
+
+Con un estado compartido entre workers (SHARED_STATE_URL) los límites por
+dispositivo y por usuario son de toda la instalación: en lugar del token
+bucket del proceso se cuenta en ventanas fijas de burst / rate segundos,
+con contadores atómicos del estado compartido. El cupo de concurrencia
+sigue siendo por proceso: protege el pool de conexiones de cada worker.
+"""
+
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from fastapi import HTTPException, status
+from fastapi.responses import JSONResponse
+
+import shared_state
+from auth_utils import token_subject
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+
+# El firmware hace ~3 peticiones cada 10 s (modo, ubicación y a veces una alerta)
+DEVICE_RATE_PER_MIN = float(os.getenv("DEVICE_RATE_PER_MIN", "60"))
+DEVICE_BURST = int(os.getenv("DEVICE_BURST", "10"))
+APP_RATE_PER_MIN = float(os.getenv("APP_RATE_PER_MIN", "300"))
+APP_BURST = int(os.getenv("APP_BURST", "60"))
+INGEST_MAX_CONCURRENCY = int(os.getenv("INGEST_MAX_CONCURRENCY", "32"))
+# Ventana (segundos) de la ocupación promedio del cupo, la carga que usa reporting_policy
+INGEST_LOAD_WINDOW_SECONDS = float(os.getenv("INGEST_LOAD_WINDOW_SECONDS", "10"))
+
+# Entradas inactivas más de este tiempo se descartan (el bucket ya estaría lleno)
+BUCKET_IDLE_TTL = float(os.getenv("BUCKET_IDLE_TTL", "600"))
+BUCKET_MAX_ENTRIES = int(os.getenv("BUCKET_MAX_ENTRIES", "200000"))
+
+
+class _Bucket:
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, tokens, updated):
+        self.tokens = tokens
+        self.updated = updated
+
+
+class TokenBucketTable:
+    """
+    Token buckets por clave en un OrderedDict ordenado por último uso, así
+    las entradas caducadas están siempre al principio y se expulsan en O(1).
+    """
+
+    def __init__(self, rate_per_min, burst, idle_ttl=BUCKET_IDLE_TTL, max_entries=BUCKET_MAX_ENTRIES):
+        self.rate = rate_per_min / 60.0
+        self.burst = burst
+        self.idle_ttl = idle_ttl
+        self.max_entries = max_entries
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def acquire(self, key, now=None, create=True):
+        """
+        Consumir un token; devuelve 0 si se admite o los segundos a esperar.
+        Con create=False una clave sin bucket se admite sin crearlo.
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            self._expire(now)
+
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                if not create:
+                    return 0.0
+                bucket = self._buckets[key] = _Bucket(self.burst, now)
+            else:
+                bucket.tokens = min(self.burst, bucket.tokens + (now - bucket.updated) * self.rate)
+                bucket.updated = now
+                self._buckets.move_to_end(key)
+
+            if bucket.tokens >= 1:
+                bucket.tokens -= 1
+                return 0.0
+            return (1 - bucket.tokens) / self.rate
+
+    def track(self, key, now=None):
+        """Crear el bucket de una clave ya verificada, cobrando la petición en curso"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            if key not in self._buckets:
+                self._expire(now)
+                self._buckets[key] = _Bucket(self.burst - 1, now)
+
+    def _expire(self, now):
+        # Amortizado: solo se revisa el principio de la cola
+        while self._buckets:
+            key, bucket = next(iter(self._buckets.items()))
+            if now - bucket.updated < self.idle_ttl and len(self._buckets) < self.max_entries:
+                break
+            del self._buckets[key]
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class SharedWindowTable:
+    """
+    Límite equivalente al token bucket en el estado compartido: `burst`
+    peticiones por ventana de burst / rate segundos (el tiempo en que el
+    bucket se rellena), contadas con un incr atómico por ventana.
+    """
+
+    def __init__(self, rate_per_min, burst, prefix):
+        self.burst = burst
+        self.window = burst / (rate_per_min / 60.0)
+        self.prefix = prefix
+
+    def acquire(self, key, now=None, create=True):
+        """
+        Contar la petición; devuelve 0 si se admite o los segundos a esperar.
+        Cada contador vence solo y no desplaza a otros: siempre se cuenta.
+        """
+        now = time.time() if now is None else now
+        slot = int(now // self.window)
+        count = shared_state.backend.incr(f"{self.prefix}:{key}:{slot}", ttl=self.window * 2)
+        if count <= self.burst:
+            return 0.0
+        return (slot + 1) * self.window - now
+
+    def track(self, key, now=None):
+        """acquire ya contó la petición"""
+
+
+class ConcurrencyGate:
+    """Cupo global de peticiones de ingesta trabajando contra la BD a la vez"""
+
+    def __init__(self, limit, window=INGEST_LOAD_WINDOW_SECONDS):
+        self.limit = limit
+        self.active = 0
+        self.window = window
+        # Ocupación promedio en el tiempo (media exponencial), actualizada en cada cambio
+        self._load = 0.0
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _advance(self):
+        now = time.monotonic()
+        weight = 1.0 - math.exp(-(now - self._updated) / self.window)
+        self._load += weight * (self.utilization - self._load)
+        self._updated = now
+
+    def try_enter(self):
+        with self._lock:
+            self._advance()
+            if self.active >= self.limit:
+                return False
+            self.active += 1
+            return True
+
+    def leave(self):
+        with self._lock:
+            self._advance()
+            self.active -= 1
+
+    @property
+    def utilization(self):
+        """Ocupación en este instante"""
+        return self.active / self.limit if self.limit else 0.0
+
+    @property
+    def load(self):
+        """Ocupación promedio de los últimos ~window segundos (0 a 1)"""
+        with self._lock:
+            self._advance()
+            return self._load
+
+
+if shared_state.backend.shared:
+    device_buckets = SharedWindowTable(DEVICE_RATE_PER_MIN, DEVICE_BURST, "rl:dev")
+    app_buckets = SharedWindowTable(APP_RATE_PER_MIN, APP_BURST, "rl:app")
+else:
+    device_buckets = TokenBucketTable(DEVICE_RATE_PER_MIN, DEVICE_BURST)
+    app_buckets = TokenBucketTable(APP_RATE_PER_MIN, APP_BURST)
+ingest_gate = ConcurrencyGate(INGEST_MAX_CONCURRENCY)
+
+
+def _too_many_requests(retry_after, detail):
+    return HTTPException(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        detail=detail,
+        headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+    )
+
+
+def admit_device(device_id: str):
+    """
+    Aplicar el token bucket del dispositivo (lanza 429 si lo excede). Un id
+    sin bucket pasa sin crearlo: se crea con track_device cuando se verifica.
+    """
+    if not RATE_LIMIT_ENABLED:
+        return
+    retry_after = device_buckets.acquire(device_id, create=False)
+    if retry_after:
+        raise _too_many_requests(retry_after, "Demasiadas peticiones del dispositivo")
+
+
+def track_device(device_id: str):
+    """El dispositivo existe y está activo: desde ahora tiene su bucket"""
+    if RATE_LIMIT_ENABLED:
+        device_buckets.track(device_id)
+
+
+@contextmanager
+def ingest_slot():
+    """Ocupar un lugar del cupo global de ingesta mientras se escribe en la BD"""
+    if not RATE_LIMIT_ENABLED:
+        yield
+        return
+    if not ingest_gate.try_enter():
+        raise _too_many_requests(1, "Servidor ocupado, reintente más tarde")
+    try:
+        yield
+    finally:
+        ingest_gate.leave()
+
+
+class AppRateLimitMiddleware:
+    """Presupuesto por usuario para las peticiones autenticadas de la app"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            authorization = None
+            for name, value in scope["headers"]:
+                if name == b"authorization":
+                    authorization = value
+                    break
+
+            # Solo un token válido tiene bucket, el de su usuario
+            email = None
+            if authorization is not None:
+                scheme, _, token = authorization.decode("latin-1").partition(" ")
+                if scheme.lower() == "bearer":
+                    email = token_subject(token.strip())
+            if email is not None:
+                retry_after = app_buckets.acquire(email)
+                if retry_after:
+                    response = JSONResponse(
+                        {"detail": "Demasiadas peticiones, reintente más tarde"},
+                        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                        headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+                    )
+                    await response(scope, receive, send)
+                    return
+
+        await self.app(scope, receive, send)
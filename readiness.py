@@ -0,0 +1,112 @@
+"""
+Arranque en caliente de cada worker y disponibilidad (/ready).
+
+/health solo dice que el proceso responde. /ready responde 200 cuando el
+worker puede recibir tráfico sin picos de latencia: el esquema está en la
+última versión de migrations.py y ya se abrieron las conexiones de los
+pools (primaria y réplica), se configuraron los mappers y se cargaron las
+cachés calientes (pertenencia y mapa email -> id de los usuarios con
+dispositivos activos más recientes, conexión al estado compartido). Hasta
+entonces responde 503 con el motivo, y el balanceador no le manda
+peticiones durante un despliegue escalonado.
+
+El calentamiento corre en segundo plano al arrancar y se reintenta cada
+READY_RETRY_SECONDS mientras falten migraciones o falle la BD.
+"""
+
+import asyncio
+import logging
+import os
+
+from sqlalchemy import func, text
+from sqlalchemy.orm import configure_mappers
+
+import ingest
+import migrations
+import ownership_cache
+import versioning
+from database import engine, read_engine
+from models import Device, User
+
+READY_RETRY_SECONDS = float(os.getenv("READY_RETRY_SECONDS", "5"))
+WARMUP_USERS = int(os.getenv("WARMUP_USERS", "200"))
+# Solo para desarrollo con un worker: aplicar las migraciones al arrancar
+MIGRATE_ON_STARTUP = os.getenv("MIGRATE_ON_STARTUP", "false").lower() == "true"
+
+logger = logging.getLogger("readiness")
+
+
+class Readiness:
+    def __init__(self):
+        self.ready = False
+        self.detail = "Calentando el worker"
+        self.schema_version = None
+
+
+state = Readiness()
+
+
+def warm_pool(bind):
+    """Abrir (y devolver al pool) tantas conexiones como el pool conserva"""
+    size = getattr(bind.pool, "size", None)
+    connections = [bind.connect() for _ in range(size() if callable(size) else 1)]
+    try:
+        for connection in connections:
+            connection.execute(text("SELECT 1"))
+    finally:
+        for connection in connections:
+            connection.close()
+    return len(connections)
+
+
+def warm_caches(db):
+    """Mappers, cachés de los usuarios más activos y primeras compilaciones de la ingesta"""
+    configure_mappers()
+    user_ids = [owner_id for (owner_id,) in db.query(Device.owner_id).filter(
+        Device.is_active == True
+    ).group_by(Device.owner_id).order_by(func.max(Device.last_ping).desc()).limit(WARMUP_USERS)]
+    if user_ids:
+        for user_id, email in db.query(User.id, User.email).filter(User.id.in_(user_ids)):
+            versioning.remember_user(email, user_id)
+        ownership_cache.warm(db, user_ids)
+    ingest.get_active_device(db, "")
+    # Conexión al estado compartido (y época de los ETag)
+    versioning.etag(versioning.USER_DEVICES, 0)
+    return len(user_ids)
+
+
+def _warm(session_factory):
+    connections = sum(warm_pool(bind) for bind in {engine, read_engine})
+    db = session_factory()
+    try:
+        users = warm_caches(db)
+    finally:
+        db.close()
+    return connections, users
+
+
+async def warm_up(session_factory):
+    """Tarea de arranque: esperar el esquema, calentar y marcar el worker como listo"""
+    from starlette.concurrency import run_in_threadpool
+
+    while True:
+        try:
+            version = await run_in_threadpool(migrations.current_version, engine)
+            if version < migrations.LATEST_VERSION and MIGRATE_ON_STARTUP:
+                await run_in_threadpool(migrations.upgrade, engine)
+                continue
+            if version < migrations.LATEST_VERSION:
+                state.detail = (f"Esquema en la versión {version}, falta migrar a la "
+                                f"{migrations.LATEST_VERSION} (python migrations.py)")
+                logger.warning(state.detail)
+            else:
+                connections, users = await run_in_threadpool(_warm, session_factory)
+                state.schema_version = version
+                state.detail = None
+                state.ready = True
+                logger.info("Worker listo: %d conexiones abiertas, %d usuarios en caché", connections, users)
+                return
+        except Exception:
+            state.detail = "Error al calentar el worker"
+            logger.exception(state.detail)
+        await asyncio.sleep(READY_RETRY_SECONDS)
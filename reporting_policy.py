@@ -0,0 +1,135 @@
+"""
+Intervalo de reporte recomendado a cada dispositivo.
+
+La consulta de modo y la ingesta de ubicaciones devuelven `intervalo_s`:
+cuántos segundos esperar hasta el próximo ciclo. Sale de una tabla de
+estados configurable (REPORTING_POLICY):
+
+    alerta                 alerta high/critical sin leer en los últimos REPORT_ALERT_SECONDS
+    armado_en_movimiento   modo seguridad activado y el vehículo se mueve
+    en_movimiento          se mueve (o todavía no se sabe: tras un reinicio)
+    armado_detenido        modo seguridad activado, detenido
+    detenido               modo seguridad desactivado, detenido
+
+El movimiento sale de las últimas ubicaciones (velocidad del filtro GPS, o
+entre fixes consecutivos si el filtro está apagado). Los estados que no son
+de emergencia se alargan con la carga: por REPORT_INTERVAL_SCALE (manual,
+para toda la flota) y por REPORT_LOAD_SHED según la ocupación promedio del
+cupo de ingesta en los últimos segundos (rate_limit.ingest_gate.load).
+
+Calcular el intervalo no tiene efectos. La ingesta, al registrar el
+heartbeat de un dispositivo al que le responde con intervalo_s, alarga con
+ese intervalo el plazo del detector offline (offline_detector.expect), así
+un auto detenido que reporta cada 5 minutos no genera alertas
+offline/back_online en cada ciclo.
+
+El último fix, el movimiento y las alertas de cada dispositivo viven en el
+estado compartido con TTL (vencen solos), así que un dispositivo atendido
+por varios workers tiene un único estado. La carga es la de cada worker.
+"""
+
+import os
+import time
+
+import geo
+import rate_limit
+import shared_state
+
+
+def _parse_pairs(value, cast):
+    """'a=1,b=2' -> {'a': 1, 'b': 2}"""
+    pairs = {}
+    for item in value.split(","):
+        if item.strip():
+            key, _, number = item.partition("=")
+            pairs[key.strip()] = cast(number)
+    return pairs
+
+
+REPORTING_POLICY = _parse_pairs(os.getenv(
+    "REPORTING_POLICY",
+    "alerta=5,armado_en_movimiento=5,en_movimiento=10,armado_detenido=60,detenido=300"
+), int)
+# Ocupación del cupo de ingesta -> multiplicador (se aplica el mayor alcanzado)
+REPORT_LOAD_SHED = sorted(
+    (float(threshold), multiplier)
+    for threshold, multiplier in _parse_pairs(os.getenv("REPORT_LOAD_SHED", "0.5=2,0.8=4"), float).items()
+)
+REPORT_INTERVAL_SCALE = float(os.getenv("REPORT_INTERVAL_SCALE", "1"))
+REPORT_MIN_SECONDS = int(os.getenv("REPORT_MIN_SECONDS", "5"))
+REPORT_MAX_SECONDS = int(os.getenv("REPORT_MAX_SECONDS", "900"))
+REPORT_MOVING_KMH = float(os.getenv("REPORT_MOVING_KMH", "8"))
+REPORT_MOVING_SECONDS = float(os.getenv("REPORT_MOVING_SECONDS", "180"))
+REPORT_ALERT_SECONDS = float(os.getenv("REPORT_ALERT_SECONDS", "600"))
+
+# Estados que nunca se alargan por carga
+URGENT_STATES = ("alerta", "armado_en_movimiento")
+URGENT_SEVERITIES = ("high", "critical")
+
+# El último fix se guarda más que el intervalo más largo, para medir la velocidad
+FIX_TTL = max(3600, 2 * REPORT_MAX_SECONDS)
+
+
+def _keys(device_pk):
+    """(último fix, en movimiento, alerta) del dispositivo en el estado compartido"""
+    return f"rp:fix:{device_pk}", f"rp:moving:{device_pk}", f"rp:alert:{device_pk}"
+
+
+class ReportingPolicy:
+    """Movimiento y alertas recientes por dispositivo (con TTL) y multiplicador por carga"""
+
+    def note_fix(self, device_pk, lat, lng, speed=None, now=None):
+        """Registrar una ubicación aceptada; `speed` en km/h si el filtro la estimó"""
+        now = now or time.time()
+        fix_key, moving_key, _ = _keys(device_pk)
+        previous = shared_state.backend.get(fix_key)
+        if speed is None and previous is not None:
+            fix_at, fix_lat, fix_lng = map(float, previous.split(","))
+            if now > fix_at:
+                speed = geo.haversine_m(fix_lat, fix_lng, lat, lng) / (now - fix_at) * 3.6
+        if previous is None or (speed is not None and speed >= REPORT_MOVING_KMH):
+            # Sin fix anterior todavía no se sabe si se mueve: se lo trata como en movimiento
+            shared_state.backend.set(moving_key, "1", ttl=REPORT_MOVING_SECONDS)
+        shared_state.backend.set(fix_key, f"{now:.3f},{lat},{lng}", ttl=FIX_TTL)
+
+    def note_alert(self, device_pk, severity):
+        if severity in URGENT_SEVERITIES:
+            shared_state.backend.set(_keys(device_pk)[2], "1", ttl=REPORT_ALERT_SECONDS)
+
+    def clear_alerts(self, device_pk):
+        """El usuario leyó las alertas del dispositivo"""
+        shared_state.backend.delete(_keys(device_pk)[2])
+
+    def state(self, device_pk, security_mode):
+        fix, moving, alert = shared_state.backend.get_many(_keys(device_pk))
+        if alert is not None:
+            return "alerta"
+        # Sin ningún fix reciente (o tras perder el estado) se asume movimiento
+        moving = moving is not None or fix is None
+        if security_mode:
+            return "armado_en_movimiento" if moving else "armado_detenido"
+        return "en_movimiento" if moving else "detenido"
+
+    def load_factor(self):
+        """Multiplicador por carga, según la ocupación promedio del cupo de ingesta"""
+        load = rate_limit.ingest_gate.load
+        factor = 1.0
+        for threshold, multiplier in REPORT_LOAD_SHED:
+            if load >= threshold:
+                factor = multiplier
+        return factor
+
+    def interval(self, device_pk, security_mode):
+        """Segundos recomendados hasta el próximo reporte del dispositivo"""
+        state = self.state(device_pk, security_mode)
+        seconds = REPORTING_POLICY.get(state, REPORTING_POLICY.get("en_movimiento", 10))
+        if state not in URGENT_STATES:
+            seconds *= REPORT_INTERVAL_SCALE * self.load_factor()
+        return int(min(REPORT_MAX_SECONDS, max(REPORT_MIN_SECONDS, seconds)))
+
+
+policy = ReportingPolicy()
+
+
+def interval(device_pk, security_mode):
+    return policy.interval(device_pk, security_mode)
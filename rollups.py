@@ -0,0 +1,310 @@
+"""
+Resúmenes por hora y por día de cada dispositivo.
+
+La tabla `rollups` guarda por (dispositivo, hour|day, inicio del período)
+la cantidad de ubicaciones, la distancia recorrida, la velocidad máxima,
+la primera y última ubicación y las alertas por alert_type y severity. Los
+tableros ("cuánto se movió esta semana", "alertas por día") leen una fila
+por período en lugar de recorrer `locations` y `alerts`.
+
+Igual que el mapa de calor, la ingesta solo suma en memoria después de su
+commit y un ciclo de fondo vuelca los incrementos cada
+ROLLUP_FLUSH_SECONDS, con las filas bloqueadas hasta el commit (ver
+database.begin_write) y devolviendo los incrementos al acumulador si
+falla. El tramo entre dos ubicaciones consecutivas cuenta en el período de
+la más nueva; una ubicación atrasada suma al conteo pero no a la
+distancia. Los períodos son horas y días UTC.
+
+En la ingesta el tramo lo mide ingest.py desde la última posición del
+dispositivo en la BD (la misma para todos los workers); la última
+ubicación en memoria del acumulador solo la usan las reconstrucciones,
+que recorren el historial en orden en un único proceso.
+
+Para reconstruir desde el historial (tabla y archivo frío):
+python rollups.py --rebuild
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import threading
+from collections import Counter
+from datetime import datetime, timedelta
+
+from sqlalchemy import tuple_
+from sqlalchemy.exc import IntegrityError
+
+import archive
+import geo
+
+ROLLUP_FLUSH_SECONDS = float(os.getenv("ROLLUP_FLUSH_SECONDS", "10"))
+
+logger = logging.getLogger("rollups")
+
+PERIODS = ("hour", "day")
+PERIOD_LENGTH = {"hour": timedelta(hours=1), "day": timedelta(days=1)}
+FLUSH_CHUNK = 500
+
+
+def bucket_start(period, ts):
+    """Inicio de la hora o del día que contiene `ts`"""
+    if period == "hour":
+        return ts.replace(minute=0, second=0, microsecond=0)
+    return ts.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+class BucketDelta:
+    """Incrementos pendientes de un período"""
+
+    __slots__ = ("point_count", "distance_m", "max_speed", "first_fix_at", "last_fix_at",
+                 "alert_types", "severities")
+
+    def __init__(self):
+        self.point_count = 0
+        self.distance_m = 0.0
+        self.max_speed = None
+        self.first_fix_at = None
+        self.last_fix_at = None
+        self.alert_types = Counter()
+        self.severities = Counter()
+
+    def add_fix(self, ts, segment_m, speed):
+        self.point_count += 1
+        self.distance_m += segment_m
+        if speed is not None and (self.max_speed is None or speed > self.max_speed):
+            self.max_speed = speed
+        if self.first_fix_at is None or ts < self.first_fix_at:
+            self.first_fix_at = ts
+        if self.last_fix_at is None or ts > self.last_fix_at:
+            self.last_fix_at = ts
+
+    def merge(self, other):
+        self.point_count += other.point_count
+        self.distance_m += other.distance_m
+        _merge_extremes(self, other)
+        self.alert_types.update(other.alert_types)
+        self.severities.update(other.severities)
+
+
+def _merge_extremes(target, delta):
+    """Velocidad máxima y primera/última ubicación combinadas en `target`"""
+    if delta.max_speed is not None and (target.max_speed is None or delta.max_speed > target.max_speed):
+        target.max_speed = delta.max_speed
+    if delta.first_fix_at is not None and (target.first_fix_at is None or delta.first_fix_at < target.first_fix_at):
+        target.first_fix_at = delta.first_fix_at
+    if delta.last_fix_at is not None and (target.last_fix_at is None or delta.last_fix_at > target.last_fix_at):
+        target.last_fix_at = delta.last_fix_at
+
+
+def apply_delta(row, delta):
+    """Sumar los incrementos a una fila de Rollup"""
+    row.point_count = (row.point_count or 0) + delta.point_count
+    row.distance_m = (row.distance_m or 0.0) + delta.distance_m
+    _merge_extremes(row, delta)
+    if delta.alert_types:
+        counts = decode_alert_counts(row.alert_counts)
+        counts["alert_type"].update(delta.alert_types)
+        counts["severity"].update(delta.severities)
+        row.alert_counts = json.dumps({key: dict(value) for key, value in counts.items()}, sort_keys=True)
+        row.alert_count = (row.alert_count or 0) + sum(delta.alert_types.values())
+
+
+def decode_alert_counts(blob):
+    counts = json.loads(blob) if blob else {}
+    return {key: Counter(counts.get(key, {})) for key in ("alert_type", "severity")}
+
+
+class RollupAccumulator:
+    """Incrementos pendientes: (device, period, bucket) -> BucketDelta"""
+
+    def __init__(self):
+        self._pending = {}
+        # Última ubicación vista por dispositivo, para la distancia del tramo
+        # cuando quien llama no la mide (reconstrucciones)
+        self._last = {}
+        self._lock = threading.Lock()
+
+    def _delta(self, key):
+        delta = self._pending.get(key)
+        if delta is None:
+            delta = self._pending[key] = BucketDelta()
+        return delta
+
+    def add_location(self, device_pk, ts, lat, lng, speed=None, segment_m=None):
+        """Sumar una ubicación; `segment_m` es el tramo desde la anterior si quien llama lo midió"""
+        with self._lock:
+            if segment_m is None:
+                previous = self._last.get(device_pk)
+                segment_m = 0.0
+                if previous is None or previous[0] <= ts:
+                    if previous is not None:
+                        segment_m = geo.haversine_m(previous[1], previous[2], lat, lng)
+                    self._last[device_pk] = (ts, lat, lng)
+            for period in PERIODS:
+                self._delta((device_pk, period, bucket_start(period, ts))).add_fix(ts, segment_m, speed)
+
+    def add_alert(self, device_pk, ts, alert_type, severity):
+        with self._lock:
+            for period in PERIODS:
+                delta = self._delta((device_pk, period, bucket_start(period, ts)))
+                delta.alert_types[alert_type] += 1
+                delta.severities[severity] += 1
+
+    def forget(self, device_pk):
+        with self._lock:
+            self._last.pop(device_pk, None)
+
+    def discard(self, device_pk):
+        """Descartar lo pendiente del dispositivo (antes de reconstruir sus resúmenes)"""
+        with self._lock:
+            for key in [key for key in self._pending if key[0] == device_pk]:
+                del self._pending[key]
+            self._last.pop(device_pk, None)
+
+    def drain(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        return pending
+
+    def merge_back(self, pending):
+        """Devolver incrementos no volcados (por ejemplo tras un conflicto)"""
+        with self._lock:
+            for key, delta in pending.items():
+                self._delta(key).merge(delta)
+
+
+accumulator = RollupAccumulator()
+
+
+def flush_pending(db):
+    """Volcar los incrementos pendientes a la tabla `rollups`; devuelve filas tocadas"""
+    from database import begin_write
+    from models import Rollup
+
+    pending = accumulator.drain()
+    if not pending:
+        return 0
+
+    keys = sorted(pending)
+    now = datetime.utcnow()
+    try:
+        begin_write(db)
+        for start in range(0, len(keys), FLUSH_CHUNK):
+            chunk = keys[start:start + FLUSH_CHUNK]
+            # Bloquear las filas hasta el commit: otro worker que vuelque a la vez espera
+            existing = {
+                (row.device_id, row.period, row.bucket): row
+                for row in db.query(Rollup).filter(
+                    tuple_(Rollup.device_id, Rollup.period, Rollup.bucket).in_(chunk)
+                ).with_for_update().populate_existing()
+            }
+            for key in chunk:
+                row = existing.get(key)
+                if row is None:
+                    device_pk, period, bucket = key
+                    row = Rollup(device_id=device_pk, period=period, bucket=bucket,
+                                 point_count=0, distance_m=0.0, alert_count=0)
+                    db.add(row)
+                apply_delta(row, pending[key])
+                row.updated_at = now
+        db.commit()
+    except IntegrityError:
+        # Otro worker creó la misma fila a la vez: reintentar en el próximo ciclo
+        db.rollback()
+        accumulator.merge_back(pending)
+        return 0
+    except Exception:
+        # Cualquier otro fallo tampoco pierde los incrementos
+        db.rollback()
+        accumulator.merge_back(pending)
+        raise
+    return len(keys)
+
+
+async def flush_loop(session_factory):
+    """Ciclo de fondo que vuelca el acumulador periódicamente"""
+    from starlette.concurrency import run_in_threadpool
+
+    def flush_once():
+        db = session_factory()
+        try:
+            return flush_pending(db)
+        finally:
+            db.close()
+
+    while True:
+        await asyncio.sleep(ROLLUP_FLUSH_SECONDS)
+        try:
+            await run_in_threadpool(flush_once)
+        except Exception:
+            logger.exception("Error al volcar los resúmenes")
+
+
+def get_rollups(db, device_pk, period, desde, hasta):
+    """Filas del dispositivo cuyo período empieza entre `desde` y `hasta`, en orden"""
+    from models import Rollup
+
+    return db.query(Rollup).filter(
+        Rollup.device_id == device_pk,
+        Rollup.period == period,
+        Rollup.bucket >= bucket_start(period, desde),
+        Rollup.bucket <= hasta
+    ).order_by(Rollup.bucket).all()
+
+
+def rebuild(db, device_pk=None, batch_size=50000):
+    """Reconstruir los resúmenes desde el archivo frío, `locations` y `alerts`"""
+    from models import Alert, Device, Location, Rollup
+
+    rows = db.query(Rollup)
+    devices = db.query(Device.id).order_by(Device.id)
+    if device_pk is not None:
+        rows = rows.filter(Rollup.device_id == device_pk)
+        devices = devices.filter(Device.id == device_pk)
+    rows.delete(synchronize_session=False)
+    db.commit()
+
+    total = 0
+    for (pk,) in devices.all():
+        accumulator.forget(pk)
+        # En orden cronológico: primero el archivo (sin velocidad), luego la tabla
+        for month in archive.list_months(pk):
+            columns = archive.open_month(pk, month)
+            for ts, lat, lng in zip(columns["ts"].tolist(), columns["lat"].tolist(), columns["lng"].tolist()):
+                accumulator.add_location(pk, ts, lat, lng)
+            total += len(columns["ts"])
+        locations = db.query(Location.timestamp, Location.latitude, Location.longitude, Location.speed).filter(
+            Location.device_id == pk,
+            Location.is_outlier.isnot(True)
+        ).order_by(Location.timestamp, Location.id)
+        for row in locations.yield_per(batch_size):
+            accumulator.add_location(pk, *row)
+            total += 1
+        alerts = db.query(Alert.timestamp, Alert.alert_type, Alert.severity).filter(Alert.device_id == pk)
+        for row in alerts.yield_per(batch_size):
+            accumulator.add_alert(pk, *row)
+        accumulator.forget(pk)
+        flush_pending(db)
+    return total
+
+
+if __name__ == "__main__":
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    from database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Mantenimiento de los resúmenes por hora y por día")
+    parser.add_argument("--rebuild", action="store_true", help="Reconstruir desde el historial")
+    parser.add_argument("--device-pk", type=int, help="Solo este dispositivo (id interno)")
+    args = parser.parse_args()
+
+    if args.rebuild:
+        db = SessionLocal()
+        try:
+            print(f"✅ Resúmenes reconstruidos desde {rebuild(db, args.device_pk)} ubicaciones")
+        finally:
+            db.close()
+    else:
+        parser.print_help()
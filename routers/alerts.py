@@ -1,95 +1,102 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, Header, HTTPException, Response, status
 from fastapi.security import HTTPBearer
 from sqlalchemy.orm import Session
-from sqlalchemy import desc
+from sqlalchemy import desc, exists
 from typing import List, Optional
-from datetime import datetime
+from datetime import datetime, timedelta
 
 from database import get_db
 from models import Alert, Device
 from schemas import AlertCreate, AlertUpdate, AlertResponse
-from auth_utils import verify_token, get_current_user
+import compact_ingest
+import ingest
+import ownership_cache
+import rate_limit
+import reporting_policy
+import versioning
+from auth_utils import verify_token, get_current_user, get_read_db
 
-router = APIRouter()
+router = APIRouter(route_class=compact_ingest.CompactIngestRoute)
 security = HTTPBearer()
 
-@router.post("/", status_code=status.HTTP_201_CREATED)
-async def create_alert(alert: AlertCreate, db: Session = Depends(get_db)):
+def _clear_attended_alerts(db, device_pk):
+    """Devolver el dispositivo a su intervalo normal si no le quedan alertas urgentes sin leer"""
+    since = datetime.utcnow() - timedelta(seconds=reporting_policy.REPORT_ALERT_SECONDS)
+    pending = db.query(exists().where(
+        Alert.device_id == device_pk,
+        Alert.is_read == False,
+        Alert.severity.in_(reporting_policy.URGENT_SEVERITIES),
+        Alert.timestamp >= since
+    )).scalar()
+    if not pending:
+        reporting_policy.policy.clear_alerts(device_pk)
+
+@router.post(
+    "/", status_code=status.HTTP_201_CREATED,
+    openapi_extra=compact_ingest.openapi_extra("alert")
+)
+def create_alert(alert: AlertCreate, response: Response, db: Session = Depends(get_db)):
     """Endpoint para que el Arduino envíe alertas"""
-    # Buscar el dispositivo por device_id
-    device = db.query(Device).filter(
-        Device.device_id == alert.id,
-        Device.is_active == True
-    ).first()
-    
-    if not device:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Dispositivo no encontrado"
+    # Control de admisión: límite del dispositivo y cupo global de ingesta.
+    # Handler síncrono (corre en el pool de hilos) para que el cupo cuente
+    # las escrituras que de verdad están en curso a la vez
+    rate_limit.admit_device(alert.id)
+    with rate_limit.ingest_slot():
+        # Buscar el dispositivo por device_id
+        device = ingest.get_active_device(db, alert.id)
+        
+        if not device:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Dispositivo no encontrado"
+            )
+        
+        alert_id, duplicate = ingest.store_alert(
+            db, device, alert.evento, alert.lat, alert.lng, seq=alert.seq, ts=alert.ts
         )
     
-    # Mapear tipos de eventos
-    event_messages = {
-        "movimiento": "Movimiento detectado mientras el modo seguridad estaba activado",
-        "bateria_baja": "Batería del dispositivo está baja",
-        "gps_perdido": "Señal GPS perdida",
-        "tamper": "Intento de manipulación del dispositivo detectado"
-    }
-    
-    # Determinar severidad según el tipo de evento
-    severity_map = {
-        "movimiento": "high",
-        "bateria_baja": "medium",
-        "gps_perdido": "medium",
-        "tamper": "critical"
-    }
-    
-    # Crear nueva alerta
-    db_alert = Alert(
-        device_id=device.id,
-        alert_type=alert.evento,
-        message=event_messages.get(alert.evento, f"Evento: {alert.evento}"),
-        latitude=alert.lat,
-        longitude=alert.lng,
-        severity=severity_map.get(alert.evento, "medium"),
-        timestamp=datetime.utcnow()
-    )
-    
-    # Actualizar last_ping del dispositivo
-    device.last_ping = datetime.utcnow()
+    if duplicate:
+        # Reintento de un envío ya guardado: responder OK para que el dispositivo no insista
+        response.status_code = status.HTTP_200_OK
+        return {"message": "Alerta ya registrada", "id": alert_id, "duplicado": True}
     
-    db.add(db_alert)
-    db.commit()
-    db.refresh(db_alert)
-    
-    return {"message": "Alerta registrada exitosamente", "id": db_alert.id}
+    return {"message": "Alerta registrada exitosamente", "id": alert_id}
 
 @router.get("/device/{device_id}", response_model=List[AlertResponse])
 async def get_device_alerts(
     device_id: str,
+    response: Response,
     limit: Optional[int] = 50,
     unread_only: Optional[bool] = False,
-    db: Session = Depends(get_db),
+    if_none_match: Optional[str] = Header(None),
+    db: Session = Depends(get_read_db),
     token: str = Depends(security)
 ):
     """Obtener alertas de un dispositivo específico"""
     email = verify_token(token)
+    
+    # Sin cambios desde la versión que tiene la app: 304 sin consultar la BD
+    etag = versioning.device_etag(db, email, device_id, versioning.DEVICE_ALERTS)
+    if versioning.matches(if_none_match, etag):
+        return versioning.not_modified(etag)
+    
     current_user = get_current_user(db, email)
     
-    # Verificar que el dispositivo pertenece al usuario
-    device = db.query(Device).filter(
-        Device.device_id == device_id,
-        Device.owner_id == current_user.id
-    ).first()
+    # Verificar que el dispositivo pertenece al usuario (caché de pertenencia)
+    device_pk = ownership_cache.device_pk(db, current_user.id, device_id)
     
-    if not device:
+    if not device_pk:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Dispositivo no encontrado"
         )
     
+    etag = etag or versioning.etag(versioning.DEVICE_ALERTS, device_pk)
+    if etag:
+        response.headers["ETag"] = etag
+    
     # Construir query
-    query = db.query(Alert).filter(Alert.device_id == device.id)
+    query = db.query(Alert).filter(Alert.device_id == device_pk)
     
     if unread_only:
         query = query.filter(Alert.is_read == False)
@@ -101,26 +108,31 @@ async def get_device_alerts(
 
 @router.get("/user", response_model=List[AlertResponse])
 async def get_user_alerts(
+    response: Response,
     limit: Optional[int] = 100,
     unread_only: Optional[bool] = False,
     severity: Optional[str] = None,
-    db: Session = Depends(get_db),
+    if_none_match: Optional[str] = Header(None),
+    db: Session = Depends(get_read_db),
     token: str = Depends(security)
 ):
     """Obtener todas las alertas de los dispositivos del usuario"""
     email = verify_token(token)
-    current_user = get_current_user(db, email)
     
-    # Obtener todos los dispositivos del usuario
-    user_devices = db.query(Device).filter(
-        Device.owner_id == current_user.id,
-        Device.is_active == True
-    ).all()
+    # Sin cambios desde la versión que tiene la app: 304 sin consultar la BD
+    etag = versioning.user_etag(email, versioning.USER_ALERTS)
+    if versioning.matches(if_none_match, etag):
+        return versioning.not_modified(etag)
     
-    device_ids = [device.id for device in user_devices]
+    current_user = get_current_user(db, email)
+    etag = etag or versioning.etag(versioning.USER_ALERTS, current_user.id)
+    if etag:
+        response.headers["ETag"] = etag
     
-    # Construir query
-    query = db.query(Alert).filter(Alert.device_id.in_(device_ids))
+    # Construir query (ids de sus dispositivos desde la caché de pertenencia)
+    query = db.query(Alert).filter(
+        ownership_cache.active_device_filter(db, current_user.id, Alert.device_id)
+    )
     
     if unread_only:
         query = query.filter(Alert.is_read == False)
@@ -135,24 +147,16 @@ async def get_user_alerts(
 
 @router.get("/user/unread/count")
 async def get_unread_alerts_count(
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
     token: str = Depends(security)
 ):
     """Obtener el número de alertas no leídas del usuario"""
     email = verify_token(token)
     current_user = get_current_user(db, email)
     
-    # Obtener todos los dispositivos del usuario
-    user_devices = db.query(Device).filter(
-        Device.owner_id == current_user.id,
-        Device.is_active == True
-    ).all()
-    
-    device_ids = [device.id for device in user_devices]
-    
-    # Contar alertas no leídas
+    # Contar alertas no leídas (ids de sus dispositivos desde la caché de pertenencia)
     unread_count = db.query(Alert).filter(
-        Alert.device_id.in_(device_ids),
+        ownership_cache.active_device_filter(db, current_user.id, Alert.device_id),
         Alert.is_read == False
     ).count()
     
@@ -189,6 +193,10 @@ async def update_alert(
     
     db.commit()
     db.refresh(alert)
+    versioning.bump_alerts(current_user.id, alert.device_id)
+    if alert.is_read:
+        # Alerta atendida: el dispositivo vuelve a su intervalo normal si era la última urgente
+        _clear_attended_alerts(db, alert.device_id)
     
     return alert
 
@@ -202,19 +210,16 @@ async def mark_all_alerts_read(
     email = verify_token(token)
     current_user = get_current_user(db, email)
     
-    # Obtener dispositivos del usuario
-    user_devices_query = db.query(Device).filter(
-        Device.owner_id == current_user.id,
-        Device.is_active == True
-    )
-    
+    # Dispositivos del usuario (caché de pertenencia)
     if device_id:
-        user_devices_query = user_devices_query.filter(Device.device_id == device_id)
-    
-    user_devices = user_devices_query.all()
-    device_ids = [device.id for device in user_devices]
-    
-    if not device_ids:
+        device_pk = ownership_cache.device_pk(db, current_user.id, device_id)
+        device_filter = Alert.device_id == device_pk
+        has_devices = device_pk is not None
+    else:
+        device_filter = ownership_cache.active_device_filter(db, current_user.id, Alert.device_id)
+        has_devices = bool(ownership_cache.active_pks(db, current_user.id))
+    
+    if not has_devices:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="No se encontraron dispositivos"
@@ -222,11 +227,19 @@ async def mark_all_alerts_read(
     
     # Actualizar todas las alertas no leídas
     updated_count = db.query(Alert).filter(
-        Alert.device_id.in_(device_ids),
+        device_filter,
         Alert.is_read == False
-    ).update({"is_read": True})
+    ).update({"is_read": True}, synchronize_session=False)
     
     db.commit()
+    if device_id:
+        versioning.bump_alerts(current_user.id, device_pk)
+        # Una alerta urgente llegada después del UPDATE sigue pendiente
+        _clear_attended_alerts(db, device_pk)
+    else:
+        for pk in ownership_cache.active_pks(db, current_user.id):
+            versioning.bump_alerts(current_user.id, pk)
+            reporting_policy.policy.clear_alerts(pk)
     
     return {"message": f"Se marcaron {updated_count} alertas como leídas"}
 
@@ -252,7 +265,9 @@ async def delete_alert(
             detail="Alerta no encontrada"
         )
     
+    device_pk = alert.device_id
     db.delete(alert)
     db.commit()
+    versioning.bump_alerts(current_user.id, device_pk)
     
     return {"message": "Alerta eliminada exitosamente"}
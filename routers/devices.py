@@ -1,17 +1,40 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, File, Header, HTTPException, Response, UploadFile, status
 from fastapi.security import HTTPBearer
+from pydantic import ValidationError
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
-from typing import List
+from sqlalchemy import bindparam
+from typing import List, Optional
 from datetime import datetime
+import csv
+import io
+import os
 
 from database import get_db
 from models import Device, User
-from schemas import DeviceCreate, DeviceUpdate, DeviceResponse, DeviceModeResponse
-from auth_utils import verify_token, get_current_user
+from schemas import (
+    DeviceCreate, DeviceUpdate, DeviceResponse, DeviceModeResponse,
+    DeviceBulkCreate, DeviceBulkMode, DeviceBulkIds, DeviceBulkRename,
+    BulkDeviceResult, BulkDeviceResponse
+)
+import ingest
+import offline_detector
+import ownership_cache
+import rate_limit
+import reporting_policy
+import versioning
+from auth_utils import verify_token, get_current_user, get_read_db
 
 router = APIRouter()
 security = HTTPBearer()
 
+# Máximo de filas por operación masiva
+BULK_MAX_ROWS = int(os.getenv("BULK_MAX_ROWS", "10000"))
+# Tamaño máximo del CSV de importación (se corta antes de decodificarlo)
+MAX_CSV_BYTES = int(os.getenv("MAX_CSV_BYTES", str(2 * 1024 * 1024)))
+# Tamaño de los IN (...) para no superar el límite de parámetros de SQLite
+BULK_CHUNK = 500
+
 @router.post("/", response_model=DeviceResponse)
 async def create_device(
     device: DeviceCreate,
@@ -41,17 +64,243 @@ async def create_device(
     db.add(db_device)
     db.commit()
     db.refresh(db_device)
+    ownership_cache.invalidate(current_user.id)
+    versioning.bump_user(current_user.id)
     
     return db_device
 
+def _check_bulk_size(count):
+    if count > BULK_MAX_ROWS:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"Máximo {BULK_MAX_ROWS} dispositivos por operación"
+        )
+
+def _chunks(items):
+    for start in range(0, len(items), BULK_CHUNK):
+        yield items[start:start + BULK_CHUNK]
+
+def _bulk_response(results):
+    succeeded = sum(1 for result in results if result.ok)
+    return BulkDeviceResponse(
+        processed=len(results),
+        succeeded=succeeded,
+        failed=len(results) - succeeded,
+        results=results
+    )
+
+def _owned_devices(db, owner_id, device_ids):
+    """device_id -> id interno de los dispositivos del usuario en la lista"""
+    owned = {}
+    for chunk in _chunks(list(set(device_ids))):
+        owned.update(db.query(Device.device_id, Device.id).filter(
+            Device.owner_id == owner_id,
+            Device.device_id.in_(chunk)
+        ).all())
+    return owned
+
+def _import_devices(db, owner_id, rows):
+    """Validar e insertar en una sola transacción; rows son (device_id, DeviceCreate o error)"""
+    _check_bulk_size(len(rows))
+    
+    # Un solo SELECT por bloque para saber qué IDs ya existen
+    candidate_ids = [device.device_id for _, device in rows if isinstance(device, DeviceCreate)]
+    existing = set()
+    for chunk in _chunks(list(set(candidate_ids))):
+        existing.update(device_id for (device_id,) in db.query(Device.device_id).filter(
+            Device.device_id.in_(chunk)
+        ))
+    
+    results = []
+    new_rows = []
+    seen = set()
+    for device_id, device in rows:
+        if not isinstance(device, DeviceCreate):
+            results.append(BulkDeviceResult(device_id=device_id, ok=False, detail=device))
+        elif device.device_id in existing:
+            results.append(BulkDeviceResult(device_id=device_id, ok=False, detail="ID del dispositivo ya existe"))
+        elif device.device_id in seen:
+            results.append(BulkDeviceResult(device_id=device_id, ok=False, detail="ID repetido en la importación"))
+        else:
+            seen.add(device.device_id)
+            new_rows.append({
+                "device_id": device.device_id,
+                "name": device.name,
+                "description": device.description,
+                "vehicle_type": device.vehicle_type,
+                "owner_id": owner_id
+            })
+            results.append(BulkDeviceResult(device_id=device_id, ok=True))
+    
+    if new_rows:
+        try:
+            # Inserción multi-fila (executemany) en una transacción
+            db.execute(Device.__table__.insert(), new_rows)
+            db.commit()
+            ownership_cache.invalidate(owner_id)
+            versioning.bump_user(owner_id)
+        except IntegrityError:
+            db.rollback()
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail="Otro proceso registró alguno de estos IDs; reintente la importación"
+            )
+    
+    return _bulk_response(results)
+
+@router.post("/bulk", response_model=BulkDeviceResponse)
+async def bulk_create_devices(
+    payload: DeviceBulkCreate,
+    db: Session = Depends(get_db),
+    token: str = Depends(security)
+):
+    """Registrar muchos dispositivos a la vez (JSON)"""
+    email = verify_token(token)
+    current_user = get_current_user(db, email)
+    
+    rows = [(device.device_id, device) for device in payload.devices]
+    return _import_devices(db, current_user.id, rows)
+
+@router.post("/bulk/csv", response_model=BulkDeviceResponse)
+async def bulk_create_devices_csv(
+    file: UploadFile = File(...),
+    db: Session = Depends(get_db),
+    token: str = Depends(security)
+):
+    """Registrar dispositivos desde un CSV con columnas device_id,name,description,vehicle_type"""
+    email = verify_token(token)
+    current_user = get_current_user(db, email)
+    
+    # Leer como mucho un byte más del máximo: alcanza para saber si se pasa
+    raw = await file.read(MAX_CSV_BYTES + 1)
+    if len(raw) > MAX_CSV_BYTES:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"Máximo {MAX_CSV_BYTES} bytes por archivo"
+        )
+    
+    try:
+        content = raw.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="El archivo debe estar en UTF-8"
+        )
+    
+    rows = []
+    for line_number, record in enumerate(csv.DictReader(io.StringIO(content)), start=2):
+        # Columnas opcionales vacías como None
+        values = {key.strip(): (value.strip() or None) for key, value in record.items() if key and value is not None}
+        try:
+            rows.append((values.get("device_id"), DeviceCreate(**values)))
+        except ValidationError as error:
+            fields = ", ".join(str(item["loc"][0]) for item in error.errors())
+            rows.append((values.get("device_id"), f"Línea {line_number}: campos inválidos ({fields})"))
+    
+    return _import_devices(db, current_user.id, rows)
+
+def _bulk_update(db, owner_id, device_ids, values):
+    """Aplicar el mismo cambio a los dispositivos del usuario con un UPDATE por bloque"""
+    _check_bulk_size(len(device_ids))
+    owned = _owned_devices(db, owner_id, device_ids)
+    
+    values["updated_at"] = datetime.utcnow()
+    for chunk in _chunks(list(owned.values())):
+        db.query(Device).filter(Device.id.in_(chunk)).update(values, synchronize_session=False)
+    db.commit()
+    ownership_cache.invalidate(owner_id)
+    versioning.bump_user(owner_id)
+    
+    results = [
+        BulkDeviceResult(device_id=device_id, ok=True) if device_id in owned
+        else BulkDeviceResult(device_id=device_id, ok=False, detail="Dispositivo no encontrado")
+        for device_id in device_ids
+    ]
+    return owned, _bulk_response(results)
+
+@router.post("/bulk/modo", response_model=BulkDeviceResponse)
+async def bulk_set_security_mode(
+    payload: DeviceBulkMode,
+    db: Session = Depends(get_db),
+    token: str = Depends(security)
+):
+    """Activar/desactivar el modo seguridad de varios dispositivos"""
+    email = verify_token(token)
+    current_user = get_current_user(db, email)
+    
+    _, response = _bulk_update(db, current_user.id, payload.device_ids, {"security_mode": payload.security_mode})
+    return response
+
+@router.post("/bulk/desactivar", response_model=BulkDeviceResponse)
+async def bulk_deactivate_devices(
+    payload: DeviceBulkIds,
+    db: Session = Depends(get_db),
+    token: str = Depends(security)
+):
+    """Desactivar (eliminar lógicamente) varios dispositivos"""
+    email = verify_token(token)
+    current_user = get_current_user(db, email)
+    
+    owned, response = _bulk_update(db, current_user.id, payload.device_ids, {"is_active": False})
+    for device_pk in owned.values():
+        offline_detector.detector.forget(device_pk)
+    return response
+
+@router.post("/bulk/renombrar", response_model=BulkDeviceResponse)
+async def bulk_rename_devices(
+    payload: DeviceBulkRename,
+    db: Session = Depends(get_db),
+    token: str = Depends(security)
+):
+    """Renombrar varios dispositivos (un nombre distinto por dispositivo)"""
+    email = verify_token(token)
+    current_user = get_current_user(db, email)
+    
+    _check_bulk_size(len(payload.devices))
+    owned = _owned_devices(db, current_user.id, [item.device_id for item in payload.devices])
+    
+    # Un UPDATE parametrizado ejecutado con executemany
+    now = datetime.utcnow()
+    params = [
+        {"b_id": owned[item.device_id], "b_name": item.name, "b_updated_at": now}
+        for item in payload.devices if item.device_id in owned
+    ]
+    if params:
+        table = Device.__table__
+        db.execute(
+            table.update().where(table.c.id == bindparam("b_id")).values(
+                name=bindparam("b_name"), updated_at=bindparam("b_updated_at")
+            ),
+            params
+        )
+    db.commit()
+    versioning.bump(versioning.USER_DEVICES, current_user.id)
+    
+    return _bulk_response([
+        BulkDeviceResult(device_id=item.device_id, ok=True) if item.device_id in owned
+        else BulkDeviceResult(device_id=item.device_id, ok=False, detail="Dispositivo no encontrado")
+        for item in payload.devices
+    ])
+
 @router.get("/", response_model=List[DeviceResponse])
 async def get_user_devices(
-    db: Session = Depends(get_db),
+    response: Response,
+    if_none_match: Optional[str] = Header(None),
+    db: Session = Depends(get_read_db),
     token: str = Depends(security)
 ):
     """Obtener todos los dispositivos del usuario"""
     email = verify_token(token)
+    
+    # Sin cambios desde la versión que tiene la app: 304 sin consultar la BD
+    etag = versioning.user_etag(email, versioning.USER_DEVICES)
+    if versioning.matches(if_none_match, etag):
+        return versioning.not_modified(etag)
+    
     current_user = get_current_user(db, email)
+    etag = etag or versioning.etag(versioning.USER_DEVICES, current_user.id)
+    if etag:
+        response.headers["ETag"] = etag
     
     devices = db.query(Device).filter(
         Device.owner_id == current_user.id,
@@ -63,7 +312,7 @@ async def get_user_devices(
 @router.get("/{device_id}", response_model=DeviceResponse)
 async def get_device(
     device_id: str,
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
     token: str = Depends(security)
 ):
     """Obtener un dispositivo específico"""
@@ -121,6 +370,8 @@ async def update_device(
     
     db.commit()
     db.refresh(device)
+    ownership_cache.invalidate(current_user.id)
+    versioning.bump_user(current_user.id)
     
     return device
 
@@ -150,31 +401,37 @@ async def delete_device(
     device.updated_at = datetime.utcnow()
     
     db.commit()
+    ownership_cache.invalidate(current_user.id)
+    versioning.bump_user(current_user.id)
+    offline_detector.detector.forget(device.id)
     
     return {"message": "Dispositivo eliminado exitosamente"}
 
 # Endpoint especial para el Arduino - consultar modo seguridad
 @router.get("/{device_id}/modo", response_model=DeviceModeResponse)
-async def get_security_mode(device_id: str, db: Session = Depends(get_db)):
+def get_security_mode(device_id: str, db: Session = Depends(get_db)):
     """Endpoint para que el Arduino consulte el modo de seguridad"""
-    device = db.query(Device).filter(
-        Device.device_id == device_id,
-        Device.is_active == True
-    ).first()
-    
-    if not device:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Dispositivo no encontrado"
-        )
-    
-    # Actualizar last_ping
-    device.last_ping = datetime.utcnow()
-    db.commit()
+    # Síncrono, como la ingesta: el sondeo también escribe y ocupa el cupo
+    rate_limit.admit_device(device_id)
+    with rate_limit.ingest_slot():
+        device = ingest.get_active_device(db, device_id)
+        
+        if not device:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Dispositivo no encontrado"
+            )
+        
+        # Leídos antes del commit (después habría que recargar el dispositivo)
+        device_pk, arduino_id, security_mode = device.id, device.device_id, device.security_mode
+        
+        # Actualizar last_ping
+        ingest.record_mode_poll(db, device, recommend_interval=True)
     
     return DeviceModeResponse(
-        device_id=device.device_id,
-        modo_seguridad=device.security_mode
+        device_id=arduino_id,
+        modo_seguridad=security_mode,
+        intervalo_s=reporting_policy.interval(device_pk, security_mode)
     )
 
 # Endpoint para activar/desactivar modo seguridad desde la app
@@ -204,6 +461,7 @@ async def toggle_security_mode(
     device.updated_at = datetime.utcnow()
     
     db.commit()
+    versioning.bump(versioning.USER_DEVICES, current_user.id)
     
     return {
         "message": f"Modo de seguridad {'activado' if security_mode else 'desactivado'}",
@@ -1,68 +1,92 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, Header, HTTPException, Response, status
 from fastapi.security import HTTPBearer
 from sqlalchemy.orm import Session
 from sqlalchemy import desc
 from typing import List, Optional
-from datetime import datetime
+from datetime import datetime, timedelta
 
 from database import get_db
-from models import Location, Device
-from schemas import LocationCreate, LocationResponse
-from auth_utils import verify_token, get_current_user
+from models import Location, Device, PurgeJob
+from schemas import (
+    LocationCreate, LocationResponse, LocationStatsResponse, NearbyDeviceResponse, PurgeJobResponse,
+    RollupBucketResponse, DeviceSummaryResponse, PositionAtResponse
+)
+import archive
+import compact_ingest
+import geo
+import heatmap
+import ingest
+import ownership_cache
+import purge
+import rate_limit
+import reporting_policy
+import rollups
+import timeline
+import versioning
+from auth_utils import verify_token, get_current_user, get_read_db
 
-router = APIRouter()
+router = APIRouter(route_class=compact_ingest.CompactIngestRoute)
 security = HTTPBearer()
 
-@router.post("/", status_code=status.HTTP_201_CREATED)
-async def create_location(location: LocationCreate, db: Session = Depends(get_db)):
+@router.post(
+    "/", status_code=status.HTTP_201_CREATED,
+    openapi_extra=compact_ingest.openapi_extra("location")
+)
+def create_location(location: LocationCreate, response: Response, db: Session = Depends(get_db)):
     """Endpoint para que el Arduino envíe ubicaciones"""
-    # Buscar el dispositivo por device_id
-    device = db.query(Device).filter(
-        Device.device_id == location.id,
-        Device.is_active == True
-    ).first()
-    
-    if not device:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Dispositivo no encontrado"
+    # Control de admisión: límite del dispositivo y cupo global de ingesta.
+    # Handler síncrono (corre en el pool de hilos) para que el cupo cuente
+    # las escrituras que de verdad están en curso a la vez
+    rate_limit.admit_device(location.id)
+    with rate_limit.ingest_slot():
+        # Buscar el dispositivo por device_id
+        device = ingest.get_active_device(db, location.id)
+        
+        if not device:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Dispositivo no encontrado"
+            )
+        
+        # Leídos antes del commit (después habría que recargar el dispositivo)
+        device_pk, security_mode = device.id, device.security_mode
+        location_id, duplicate = ingest.store_location(
+            db, device, location.lat, location.lng, seq=location.seq, ts=location.ts,
+            recommend_interval=True
         )
     
-    # Crear nueva ubicación
-    db_location = Location(
-        device_id=device.id,
-        latitude=location.lat,
-        longitude=location.lng,
-        timestamp=datetime.utcnow()
-    )
+    # Próximo reporte recomendado según modo, movimiento, alertas y carga
+    interval = reporting_policy.interval(device_pk, security_mode)
     
-    # Actualizar last_ping del dispositivo
-    device.last_ping = datetime.utcnow()
+    if location_id is None:
+        # Salto imposible descartado por el filtro GPS: no tiene sentido reintentarlo
+        response.status_code = status.HTTP_200_OK
+        return {"message": "Ubicación descartada por el filtro GPS", "id": None, "descartada": True,
+                "intervalo_s": interval}
     
-    db.add(db_location)
-    db.commit()
-    db.refresh(db_location)
+    if duplicate:
+        # Reintento de un envío ya guardado: responder OK para que el dispositivo no insista
+        response.status_code = status.HTTP_200_OK
+        return {"message": "Ubicación ya registrada", "id": location_id, "duplicado": True,
+                "intervalo_s": interval}
     
-    return {"message": "Ubicación registrada exitosamente", "id": db_location.id}
+    return {"message": "Ubicación registrada exitosamente", "id": location_id, "intervalo_s": interval}
 
 @router.get("/device/{device_id}", response_model=List[LocationResponse])
 async def get_device_locations(
     device_id: str,
     limit: Optional[int] = 50,
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
     token: str = Depends(security)
 ):
     """Obtener ubicaciones de un dispositivo específico"""
     email = verify_token(token)
     current_user = get_current_user(db, email)
     
-    # Verificar que el dispositivo pertenece al usuario
-    device = db.query(Device).filter(
-        Device.device_id == device_id,
-        Device.owner_id == current_user.id
-    ).first()
+    # Verificar que el dispositivo pertenece al usuario (caché de pertenencia)
+    device_pk = ownership_cache.device_pk(db, current_user.id, device_id)
     
-    if not device:
+    if not device_pk:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Dispositivo no encontrado"
@@ -70,39 +94,60 @@ async def get_device_locations(
     
     # Obtener ubicaciones ordenadas por fecha (más recientes primero)
     locations = db.query(Location).filter(
-        Location.device_id == device.id
+        Location.device_id == device_pk,
+        Location.is_outlier.isnot(True)
     ).order_by(desc(Location.timestamp)).limit(limit).all()
     
+    # Completar con el historial archivado si la tabla no alcanza
+    if len(locations) < limit:
+        before = locations[-1].timestamp if locations else None
+        locations += archive.latest_rows(device_pk, limit - len(locations), before)
+    
     return locations
 
 @router.get("/device/{device_id}/latest", response_model=LocationResponse)
 async def get_latest_location(
     device_id: str,
-    db: Session = Depends(get_db),
+    response: Response,
+    if_none_match: Optional[str] = Header(None),
+    db: Session = Depends(get_read_db),
     token: str = Depends(security)
 ):
     """Obtener la última ubicación conocida de un dispositivo"""
     email = verify_token(token)
+    
+    # Sin cambios desde la versión que tiene la app: 304 sin consultar la BD
+    etag = versioning.device_etag(db, email, device_id, versioning.DEVICE_LOCATIONS)
+    if versioning.matches(if_none_match, etag):
+        return versioning.not_modified(etag)
+    
     current_user = get_current_user(db, email)
     
-    # Verificar que el dispositivo pertenece al usuario
-    device = db.query(Device).filter(
-        Device.device_id == device_id,
-        Device.owner_id == current_user.id
-    ).first()
+    # Verificar que el dispositivo pertenece al usuario (caché de pertenencia)
+    device_pk = ownership_cache.device_pk(db, current_user.id, device_id)
     
-    if not device:
+    if not device_pk:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Dispositivo no encontrado"
         )
     
+    # Versión tomada antes de leer: un cambio concurrente no queda oculto tras el ETag
+    etag = etag or versioning.etag(versioning.DEVICE_LOCATIONS, device_pk)
+    if etag:
+        response.headers["ETag"] = etag
+    
     # Obtener la última ubicación
     latest_location = db.query(Location).filter(
-        Location.device_id == device.id
+        Location.device_id == device_pk,
+        Location.is_outlier.isnot(True)
     ).order_by(desc(Location.timestamp)).first()
     
     if not latest_location:
+        # Sin filas recientes: la última puede estar en el archivo
+        archived = archive.latest_rows(device_pk, 1)
+        if archived:
+            return archived[0]
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="No hay ubicaciones registradas para este dispositivo"
@@ -110,60 +155,461 @@ async def get_latest_location(
     
     return latest_location
 
+@router.get("/device/{device_id}/stats", response_model=LocationStatsResponse)
+async def get_device_location_stats(
+    device_id: str,
+    desde: Optional[datetime] = None,
+    hasta: Optional[datetime] = None,
+    db: Session = Depends(get_read_db),
+    token: str = Depends(security)
+):
+    """Conteo, primera y última ubicación y distancia recorrida (tabla y archivo)"""
+    email = verify_token(token)
+    current_user = get_current_user(db, email)
+    
+    # Verificar que el dispositivo pertenece al usuario (caché de pertenencia)
+    device_pk = ownership_cache.device_pk(db, current_user.id, device_id)
+    
+    if not device_pk:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Dispositivo no encontrado"
+        )
+    
+    # Primero el archivo (lo más antiguo), luego la tabla en trozos
+    stats = archive.TrackStats()
+    stats.feed_archive(device_pk, desde, hasta)
+    archived_count = stats.count
+    
+    query = db.query(Location.timestamp, Location.latitude, Location.longitude).filter(
+        Location.device_id == device_pk,
+        Location.is_outlier.isnot(True)
+    )
+    if desde:
+        query = query.filter(Location.timestamp >= desde)
+    if hasta:
+        query = query.filter(Location.timestamp <= hasta)
+    
+    chunk = []
+    for row in query.order_by(Location.timestamp).yield_per(5000):
+        chunk.append(row)
+        if len(chunk) == 5000:
+            stats.feed(*zip(*chunk))
+            chunk = []
+    if chunk:
+        stats.feed(*zip(*chunk))
+    
+    return LocationStatsResponse(
+        device_id=device_id,
+        count=stats.count,
+        archived_count=archived_count,
+        first_at=stats.first_at,
+        last_at=stats.last_at,
+        distance_km=round(stats.distance_m / 1000, 3)
+    )
+
+# Rango por defecto y máximo de períodos por consulta del resumen
+SUMMARY_DEFAULT_RANGE = {"hour": timedelta(hours=24), "day": timedelta(days=7)}
+SUMMARY_MAX_BUCKETS = 2000
+
+@router.get("/device/{device_id}/resumen", response_model=DeviceSummaryResponse)
+async def get_device_summary(
+    device_id: str,
+    periodo: str = "day",
+    desde: Optional[datetime] = None,
+    hasta: Optional[datetime] = None,
+    db: Session = Depends(get_read_db),
+    token: str = Depends(security)
+):
+    """Recorrido, velocidad y alertas por hora o por día (desde los resúmenes pre-agregados)"""
+    email = verify_token(token)
+    current_user = get_current_user(db, email)
+    
+    if periodo not in rollups.PERIODS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="El período debe ser 'hour' o 'day'"
+        )
+    
+    # Verificar que el dispositivo pertenece al usuario (caché de pertenencia)
+    device_pk = ownership_cache.device_pk(db, current_user.id, device_id)
+    
+    if not device_pk:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Dispositivo no encontrado"
+        )
+    
+    hasta = hasta or datetime.utcnow()
+    desde = desde or hasta - SUMMARY_DEFAULT_RANGE[periodo]
+    if desde > hasta or (hasta - desde) / rollups.PERIOD_LENGTH[periodo] > SUMMARY_MAX_BUCKETS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Rango inválido: máximo {SUMMARY_MAX_BUCKETS} períodos por consulta"
+        )
+    
+    # Una fila por período, sin recorrer ubicaciones ni alertas
+    buckets = []
+    distance_m = 0.0
+    by_type = {}
+    by_severity = {}
+    for row in rollups.get_rollups(db, device_pk, periodo, desde, hasta):
+        counts = rollups.decode_alert_counts(row.alert_counts)
+        distance_m += row.distance_m or 0.0
+        for alert_type, count in counts["alert_type"].items():
+            by_type[alert_type] = by_type.get(alert_type, 0) + count
+        for severity, count in counts["severity"].items():
+            by_severity[severity] = by_severity.get(severity, 0) + count
+        buckets.append(RollupBucketResponse(
+            bucket=row.bucket,
+            point_count=row.point_count or 0,
+            distance_km=round((row.distance_m or 0.0) / 1000, 3),
+            max_speed=row.max_speed,
+            first_fix_at=row.first_fix_at,
+            last_fix_at=row.last_fix_at,
+            alert_count=row.alert_count or 0,
+            alerts_by_type=dict(counts["alert_type"]),
+            alerts_by_severity=dict(counts["severity"])
+        ))
+    
+    speeds = [bucket.max_speed for bucket in buckets if bucket.max_speed is not None]
+    return DeviceSummaryResponse(
+        device_id=device_id,
+        period=periodo,
+        desde=desde,
+        hasta=hasta,
+        point_count=sum(bucket.point_count for bucket in buckets),
+        distance_km=round(distance_m / 1000, 3),
+        max_speed=max(speeds) if speeds else None,
+        alert_count=sum(bucket.alert_count for bucket in buckets),
+        alerts_by_type=by_type,
+        alerts_by_severity=by_severity,
+        buckets=buckets
+    )
+
 @router.get("/user", response_model=List[LocationResponse])
 async def get_user_locations(
     limit: Optional[int] = 100,
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
     token: str = Depends(security)
 ):
     """Obtener todas las ubicaciones de los dispositivos del usuario"""
     email = verify_token(token)
     current_user = get_current_user(db, email)
     
-    # Obtener todos los dispositivos del usuario
-    user_devices = db.query(Device).filter(
+    # Obtener ubicaciones de todos sus dispositivos (ids desde la caché de pertenencia)
+    locations = db.query(Location).filter(
+        ownership_cache.active_device_filter(db, current_user.id, Location.device_id),
+        Location.is_outlier.isnot(True)
+    ).order_by(desc(Location.timestamp)).limit(limit).all()
+    
+    # Completar con el historial archivado de cada dispositivo
+    return _merge_archive(locations, ownership_cache.active_pks(db, current_user.id), limit)
+
+def _row_timestamp(row):
+    return row["timestamp"] if isinstance(row, dict) else row.timestamp
+
+def _merge_archive(locations, device_pks, limit):
+    """Mezclar las filas archivadas de cada dispositivo con las de la tabla (más recientes primero)"""
+    # Lo archivado de un dispositivo es anterior a todas sus filas en la tabla
+    oldest = {}
+    for location in locations:
+        oldest[location.device_id] = location.timestamp
+    # Con la página llena, solo entra lo archivado posterior a su última fila
+    cutoff = locations[-1].timestamp if len(locations) >= limit else None
+    
+    merged = list(locations)
+    for device_pk in device_pks:
+        months = archive.list_months(device_pk)
+        if not months or (cutoff is not None and months[-1] < cutoff.strftime("%Y-%m")):
+            continue
+        merged += archive.latest_rows(device_pk, limit, oldest.get(device_pk))
+    if len(merged) == len(locations):
+        return locations
+    
+    merged.sort(key=_row_timestamp, reverse=True)
+    return merged[:limit]
+
+def _positions_at(db, device_pks, device_filter, t):
+    """Posiciones interpoladas en `t` de los dispositivos con ubicaciones hasta ese instante"""
+    at = timeline.as_utc(t)
+    positions = []
+    for device_id, name, before, after in timeline.brackets(db, device_pks, device_filter, at).values():
+        position = timeline.interpolate(before, after, at)
+        if position is None:
+            continue
+        positions.append(PositionAtResponse(
+            device_id=device_id,
+            name=name,
+            latitude=round(position.latitude, 7),
+            longitude=round(position.longitude, 7),
+            at=at,
+            interpolated=position.interpolated,
+            before_at=position.before_at,
+            after_at=position.after_at
+        ))
+    return positions
+
+@router.get("/at", response_model=List[PositionAtResponse])
+async def get_fleet_positions_at(
+    t: datetime,
+    db: Session = Depends(get_read_db),
+    token: str = Depends(security)
+):
+    """Dónde estaba cada dispositivo del usuario en el instante `t` (interpolado)"""
+    email = verify_token(token)
+    current_user = get_current_user(db, email)
+    
+    # Toda la flota en una sola query (ids desde la caché de pertenencia)
+    device_pks = ownership_cache.active_pks(db, current_user.id)
+    device_filter = ownership_cache.active_device_filter(db, current_user.id, Device.id)
+    
+    return _positions_at(db, device_pks, device_filter, t)
+
+@router.get("/device/{device_id}/at", response_model=PositionAtResponse)
+async def get_device_position_at(
+    device_id: str,
+    t: datetime,
+    db: Session = Depends(get_read_db),
+    token: str = Depends(security)
+):
+    """Dónde estaba el dispositivo en el instante `t` (interpolado)"""
+    email = verify_token(token)
+    current_user = get_current_user(db, email)
+    
+    # Verificar que el dispositivo pertenece al usuario (caché de pertenencia)
+    device_pk = ownership_cache.device_pk(db, current_user.id, device_id)
+    
+    if not device_pk:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Dispositivo no encontrado"
+        )
+    
+    positions = _positions_at(db, [device_pk], Device.id == device_pk, t)
+    if not positions:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="No hay ubicaciones registradas hasta ese instante"
+        )
+    
+    return positions[0]
+
+def _search_area(lat, lng, radio_m, min_lat, min_lng, max_lat, max_lng):
+    """Caja de búsqueda y, si se pidió un radio, el círculo para refinar"""
+    if lat is not None and lng is not None and radio_m is not None:
+        if radio_m <= 0:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="El radio debe ser mayor que cero"
+            )
+        return geo.radius_bbox(lat, lng, radio_m), (lat, lng, radio_m)
+    
+    if None not in (min_lat, min_lng, max_lat, max_lng):
+        if min_lat > max_lat or min_lng > max_lng:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Caja inválida: el mínimo debe ser menor que el máximo"
+            )
+        return (min_lat, min_lng, max_lat, max_lng), None
+    
+    raise HTTPException(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        detail="Indique un radio (lat, lng, radio_m) o una caja (min_lat, min_lng, max_lat, max_lng)"
+    )
+
+def _in_area(lat, lng, bbox, circle):
+    """Refinar un candidato con la caja exacta y, si aplica, la distancia haversine"""
+    min_lat, min_lng, max_lat, max_lng = bbox
+    if not (min_lat <= lat <= max_lat and min_lng <= lng <= max_lng):
+        return False, None
+    if circle is None:
+        return True, None
+    distance = geo.haversine_m(circle[0], circle[1], lat, lng)
+    return distance <= circle[2], distance
+
+@router.get("/cerca", response_model=List[NearbyDeviceResponse])
+async def get_nearby_devices(
+    lat: Optional[float] = None,
+    lng: Optional[float] = None,
+    radio_m: Optional[float] = None,
+    min_lat: Optional[float] = None,
+    min_lng: Optional[float] = None,
+    max_lat: Optional[float] = None,
+    max_lng: Optional[float] = None,
+    db: Session = Depends(get_read_db),
+    token: str = Depends(security)
+):
+    """Dispositivos del usuario cuya última posición está dentro de un radio o una caja"""
+    email = verify_token(token)
+    current_user = get_current_user(db, email)
+    
+    bbox, circle = _search_area(lat, lng, radio_m, min_lat, min_lng, max_lat, max_lng)
+    
+    # Candidatos por rangos de geohash sobre el índice, luego refinado exacto
+    candidates = db.query(Device).filter(
         Device.owner_id == current_user.id,
-        Device.is_active == True
+        Device.is_active == True,
+        geo.prefix_filter(Device.last_geohash, geo.cover_bbox(*bbox))
     ).all()
     
-    device_ids = [device.id for device in user_devices]
+    nearby = []
+    for device in candidates:
+        inside, distance = _in_area(device.last_latitude, device.last_longitude, bbox, circle)
+        if inside:
+            nearby.append(NearbyDeviceResponse(
+                device_id=device.device_id,
+                name=device.name,
+                latitude=device.last_latitude,
+                longitude=device.last_longitude,
+                distance_m=round(distance, 1) if distance is not None else None,
+                last_fix_at=device.last_fix_at
+            ))
     
-    # Obtener ubicaciones de todos sus dispositivos
-    locations = db.query(Location).filter(
-        Location.device_id.in_(device_ids)
-    ).order_by(desc(Location.timestamp)).limit(limit).all()
+    if circle is not None:
+        nearby.sort(key=lambda item: item.distance_m)
+    return nearby
+
+@router.get("/device/{device_id}/area", response_model=List[LocationResponse])
+async def get_device_locations_in_area(
+    device_id: str,
+    lat: Optional[float] = None,
+    lng: Optional[float] = None,
+    radio_m: Optional[float] = None,
+    min_lat: Optional[float] = None,
+    min_lng: Optional[float] = None,
+    max_lat: Optional[float] = None,
+    max_lng: Optional[float] = None,
+    desde: Optional[datetime] = None,
+    hasta: Optional[datetime] = None,
+    limit: Optional[int] = 500,
+    db: Session = Depends(get_read_db),
+    token: str = Depends(security)
+):
+    """Ubicaciones de un dispositivo dentro de un radio o una caja (¿cuándo estuvo aquí?)"""
+    email = verify_token(token)
+    current_user = get_current_user(db, email)
+    
+    bbox, circle = _search_area(lat, lng, radio_m, min_lat, min_lng, max_lat, max_lng)
+    
+    # Verificar que el dispositivo pertenece al usuario (caché de pertenencia)
+    device_pk = ownership_cache.device_pk(db, current_user.id, device_id)
+    
+    if not device_pk:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Dispositivo no encontrado"
+        )
+    
+    query = db.query(Location).filter(
+        Location.device_id == device_pk,
+        Location.is_outlier.isnot(True),
+        geo.prefix_filter(Location.geohash, geo.cover_bbox(*bbox))
+    )
+    if desde:
+        query = query.filter(Location.timestamp >= desde)
+    if hasta:
+        query = query.filter(Location.timestamp <= hasta)
+    
+    # Refinar en streaming hasta completar el límite (más recientes primero)
+    locations = []
+    for location in query.order_by(desc(Location.timestamp)).yield_per(1000):
+        if _in_area(location.latitude, location.longitude, bbox, circle)[0]:
+            locations.append(location)
+            if len(locations) >= limit:
+                break
     
     return locations
 
-@router.delete("/device/{device_id}")
+@router.get("/device/{device_id}/heatmap")
+async def get_device_heatmap(
+    device_id: str,
+    zoom: int = 13,
+    min_lat: Optional[float] = None,
+    min_lng: Optional[float] = None,
+    max_lat: Optional[float] = None,
+    max_lng: Optional[float] = None,
+    db: Session = Depends(get_read_db),
+    token: str = Depends(security)
+):
+    """Mapa de calor de los lugares donde estuvo el dispositivo (tiles pre-agregados)"""
+    email = verify_token(token)
+    current_user = get_current_user(db, email)
+    
+    # Verificar que el dispositivo pertenece al usuario (caché de pertenencia)
+    device_pk = ownership_cache.device_pk(db, current_user.id, device_id)
+    
+    if not device_pk:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Dispositivo no encontrado"
+        )
+    
+    bbox = None
+    if None not in (min_lat, min_lng, max_lat, max_lng):
+        bbox = (min_lat, min_lng, max_lat, max_lng)
+    
+    served_zoom = heatmap.snap_zoom(zoom)
+    cells = heatmap.get_heatmap_cells(db, device_pk, served_zoom, bbox)
+    
+    return {"device_id": device_id, "zoom": served_zoom, "cells": cells}
+
+@router.delete("/device/{device_id}", status_code=status.HTTP_202_ACCEPTED)
 async def delete_device_locations(
     device_id: str,
     db: Session = Depends(get_db),
     token: str = Depends(security)
 ):
-    """Eliminar todas las ubicaciones de un dispositivo"""
+    """Eliminar todas las ubicaciones de un dispositivo (en segundo plano)"""
     email = verify_token(token)
     current_user = get_current_user(db, email)
     
-    # Verificar que el dispositivo pertenece al usuario
-    device = db.query(Device).filter(
-        Device.device_id == device_id,
-        Device.owner_id == current_user.id
-    ).first()
+    # Verificar que el dispositivo pertenece al usuario (caché de pertenencia)
+    device_pk = ownership_cache.device_pk(db, current_user.id, device_id)
     
-    if not device:
+    if not device_pk:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Dispositivo no encontrado"
         )
     
-    # Eliminar todas las ubicaciones del dispositivo
-    deleted_count = db.query(Location).filter(
-        Location.device_id == device.id
-    ).delete()
-    
-    db.commit()
+    # El borrado corre en segundo plano por bloques; se responde de inmediato
+    job = purge.create_job(db, device_pk, current_user.id)
     
     return {
-        "message": f"Se eliminaron {deleted_count} ubicaciones del dispositivo {device_id}"
+        "message": f"Eliminación de las ubicaciones del dispositivo {device_id} en curso",
+        "job_id": job.id,
+        "status_url": f"/api/ubicaciones/purgas/{job.id}"
     }
+
+@router.get("/purgas/{job_id}", response_model=PurgeJobResponse)
+async def get_purge_job(
+    job_id: int,
+    db: Session = Depends(get_db),
+    token: str = Depends(security)
+):
+    """Estado de un borrado de historial"""
+    email = verify_token(token)
+    current_user = get_current_user(db, email)
+    
+    result = db.query(PurgeJob, Device.device_id).join(Device, PurgeJob.device_id == Device.id).filter(
+        PurgeJob.id == job_id,
+        PurgeJob.owner_id == current_user.id
+    ).first()
+    
+    if not result:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Trabajo no encontrado"
+        )
+    
+    job, device_id = result
+    return PurgeJobResponse(
+        job_id=job.id,
+        device_id=device_id,
+        status=job.status,
+        deleted_count=job.deleted_count,
+        error=job.error,
+        created_at=job.created_at,
+        finished_at=job.finished_at
+    )
@@ -7,6 +7,7 @@ from database import get_db
 from models import User
 from schemas import UserResponse, UserUpdate
 from auth_utils import verify_token, get_current_user
+import versioning
 
 router = APIRouter()
 security = HTTPBearer()
@@ -38,6 +39,8 @@ async def update_profile(
     
     db.commit()
     db.refresh(current_user)
+    if not current_user.is_active:
+        versioning.forget_user(email)
     
     return current_user
 
@@ -50,5 +53,7 @@ async def delete_account(db: Session = Depends(get_db), token: str = Depends(sec
     # Marcar como inactivo en lugar de eliminar por completo
     current_user.is_active = False
     db.commit()
+    # Sin 304 desde la caché para una cuenta desactivada
+    versioning.forget_user(email)
     
     return {"message": "Cuenta desactivada exitosamente"}
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, EmailStr
-from typing import Optional, List
+from typing import Optional, List, Dict
 from datetime import datetime
 
 # Esquemas para Usuarios
@@ -60,14 +60,45 @@ class DeviceResponse(DeviceBase):
     security_mode: bool
     is_active: bool
     last_ping: Optional[datetime] = None
+    offline_since: Optional[datetime] = None
     created_at: datetime
     
     class Config:
         orm_mode = True
 
+# Operaciones masivas sobre dispositivos
+class DeviceBulkCreate(BaseModel):
+    devices: List[DeviceCreate]
+
+class DeviceBulkMode(BaseModel):
+    device_ids: List[str]
+    security_mode: bool
+
+class DeviceBulkIds(BaseModel):
+    device_ids: List[str]
+
+class DeviceRename(BaseModel):
+    device_id: str
+    name: str
+
+class DeviceBulkRename(BaseModel):
+    devices: List[DeviceRename]
+
+class BulkDeviceResult(BaseModel):
+    device_id: Optional[str] = None
+    ok: bool
+    detail: Optional[str] = None
+
+class BulkDeviceResponse(BaseModel):
+    processed: int
+    succeeded: int
+    failed: int
+    results: List[BulkDeviceResult]
+
 class DeviceModeResponse(BaseModel):
     device_id: str
     modo_seguridad: bool
+    intervalo_s: int  # Segundos recomendados hasta el próximo reporte
 
 # Esquemas para Ubicaciones
 class LocationBase(BaseModel):
@@ -81,6 +112,8 @@ class LocationCreate(BaseModel):
     id: str  # device_id del Arduino
     lat: float
     lng: float
+    seq: Optional[int] = None  # secuencia creciente del dispositivo (reintentos idempotentes)
+    ts: Optional[datetime] = None  # hora del fix según el dispositivo (ISO o epoch)
 
 class LocationResponse(LocationBase):
     id: int
@@ -90,6 +123,65 @@ class LocationResponse(LocationBase):
     class Config:
         orm_mode = True
 
+class LocationStatsResponse(BaseModel):
+    device_id: str
+    count: int
+    archived_count: int  # de ellas, cuántas vienen del archivo frío
+    first_at: Optional[datetime] = None
+    last_at: Optional[datetime] = None
+    distance_km: float
+
+class NearbyDeviceResponse(BaseModel):
+    device_id: str
+    name: str
+    latitude: float
+    longitude: float
+    distance_m: Optional[float] = None  # solo en búsquedas por radio
+    last_fix_at: Optional[datetime] = None
+
+class PositionAtResponse(BaseModel):
+    device_id: str
+    name: str
+    latitude: float
+    longitude: float
+    at: datetime
+    interpolated: bool  # False: última ubicación anterior (sin posterior cercana)
+    before_at: datetime  # ubicaciones usadas
+    after_at: Optional[datetime] = None
+
+class PurgeJobResponse(BaseModel):
+    job_id: int
+    device_id: str
+    status: str
+    deleted_count: int
+    error: Optional[str] = None
+    created_at: datetime
+    finished_at: Optional[datetime] = None
+
+class RollupBucketResponse(BaseModel):
+    bucket: datetime  # Inicio de la hora o del día (UTC)
+    point_count: int
+    distance_km: float
+    max_speed: Optional[float] = None
+    first_fix_at: Optional[datetime] = None
+    last_fix_at: Optional[datetime] = None
+    alert_count: int
+    alerts_by_type: Dict[str, int]
+    alerts_by_severity: Dict[str, int]
+
+class DeviceSummaryResponse(BaseModel):
+    device_id: str
+    period: str
+    desde: datetime
+    hasta: datetime
+    point_count: int
+    distance_km: float
+    max_speed: Optional[float] = None
+    alert_count: int
+    alerts_by_type: Dict[str, int]
+    alerts_by_severity: Dict[str, int]
+    buckets: List[RollupBucketResponse]
+
 # Esquemas para Alertas
 class AlertBase(BaseModel):
     alert_type: str
@@ -103,6 +195,8 @@ class AlertCreate(BaseModel):
     evento: str  # tipo de evento
     lat: Optional[float] = None
     lng: Optional[float] = None
+    seq: Optional[int] = None  # secuencia creciente del dispositivo (reintentos idempotentes)
+    ts: Optional[datetime] = None  # hora del evento según el dispositivo (ISO o epoch)
 
 class AlertUpdate(BaseModel):
     is_read: Optional[bool] = None
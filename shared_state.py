@@ -0,0 +1,566 @@
+"""
+Estado compartido entre los workers de uvicorn.
+
+Lo que antes vivía en memoria de cada proceso (versiones de los ETag,
+invalidaciones de la caché de pertenencia, límites de peticiones, estado de
+movimiento del intervalo de reporte, plazos offline por dispositivo,
+estado del filtro GPS, marcas de read-your-writes) pasa por un backend con
+la misma interfaz en tres variantes, elegida con SHARED_STATE_URL:
+
+    memory://                 en el proceso (por defecto; un solo worker)
+    sqlite:///ruta/estado.db  entre procesos del mismo host, en un archivo SQLite
+    redis://host:6379/0       servidor Redis (o cualquiera que hable RESP)
+
+Operaciones: clave/valor con TTL (get, get_many, set con nx, delete),
+contadores atómicos (incr, con TTL al crearse) y pub/sub (publish,
+subscribe). Los valores son cadenas. En SQLite los mensajes se leen por
+sondeo cada SHARED_STATE_POLL_SECONDS; en Redis llegan por una conexión
+dedicada. Los callbacks de subscribe corren en un hilo de fondo.
+
+El cliente RESP no necesita dependencias. Para probarlo sin Redis hay un
+servidor mínimo compatible:
+python shared_state.py --serve 127.0.0.1:6390
+python shared_state.py --check redis://127.0.0.1:6390/0
+"""
+
+import argparse
+import asyncio
+import heapq
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from urllib.parse import unquote, urlparse
+
+SHARED_STATE_URL = os.getenv("SHARED_STATE_URL", "memory://")
+SHARED_STATE_POLL_SECONDS = float(os.getenv("SHARED_STATE_POLL_SECONDS", "0.2"))
+SHARED_STATE_TIMEOUT = float(os.getenv("SHARED_STATE_TIMEOUT", "2"))
+
+logger = logging.getLogger("shared_state")
+
+# Identifica los mensajes propios en pub/sub
+PROCESS_ID = uuid.uuid4().hex[:12]
+
+# Mensajes de pub/sub que se conservan en SQLite para los workers atrasados
+MESSAGE_RETENTION_SECONDS = 60
+SWEEP_INTERVAL = 30
+
+
+class SharedStateError(Exception):
+    """Error del backend de estado compartido"""
+
+
+class MemoryBackend:
+    """Estado en el proceso: mismo comportamiento que los dicts de antes"""
+
+    shared = False
+
+    def __init__(self):
+        self._data = {}
+        self._expiry = []
+        self._subscribers = {}
+        self._lock = threading.Lock()
+
+    def _live(self, key, now):
+        item = self._data.get(key)
+        if item is not None and item[1] is not None and item[1] <= now:
+            del self._data[key]
+            return None
+        return item
+
+    def _sweep(self, now):
+        # Amortizado: solo las claves cuyo vencimiento ya pasó
+        while self._expiry and self._expiry[0][0] <= now:
+            expires_at, key = heapq.heappop(self._expiry)
+            item = self._data.get(key)
+            if item is not None and item[1] == expires_at:
+                del self._data[key]
+
+    def _store(self, key, value, ttl, now):
+        expires_at = now + ttl if ttl else None
+        self._data[key] = (value, expires_at)
+        if expires_at is not None:
+            heapq.heappush(self._expiry, (expires_at, key))
+
+    def get(self, key):
+        with self._lock:
+            item = self._live(key, time.time())
+        return item[0] if item is not None else None
+
+    def get_many(self, keys):
+        now = time.time()
+        with self._lock:
+            items = [self._live(key, now) for key in keys]
+        return [item[0] if item is not None else None for item in items]
+
+    def set(self, key, value, ttl=None, nx=False):
+        now = time.time()
+        with self._lock:
+            self._sweep(now)
+            if nx and self._live(key, now) is not None:
+                return False
+            self._store(key, str(value), ttl, now)
+        return True
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def incr(self, key, amount=1, ttl=None):
+        now = time.time()
+        with self._lock:
+            self._sweep(now)
+            item = self._live(key, now)
+            if item is None:
+                value = amount
+                self._store(key, str(value), ttl, now)
+            else:
+                value = int(item[0]) + amount
+                self._data[key] = (str(value), item[1])
+        return value
+
+    def publish(self, channel, message):
+        for callback in list(self._subscribers.get(channel, ())):
+            callback(message)
+
+    def subscribe(self, channel, callback):
+        self._subscribers.setdefault(channel, []).append(callback)
+
+    def close(self):
+        pass
+
+
+class SQLiteBackend:
+    """Estado en un archivo SQLite compartido por los procesos del host"""
+
+    shared = True
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._subscribers = {}
+        self._lock = threading.Lock()
+        self._listener = None
+        self._closed = threading.Event()
+        db = self._db()
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("CREATE TABLE IF NOT EXISTS shared_kv (key TEXT PRIMARY KEY, value, expires_at REAL)")
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS shared_messages "
+            "(id INTEGER PRIMARY KEY AUTOINCREMENT, channel TEXT, payload TEXT, created_at REAL)"
+        )
+
+    def _db(self):
+        # Una conexión por hilo, en autocommit
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = self._local.db = sqlite3.connect(self.path, timeout=SHARED_STATE_TIMEOUT, isolation_level=None)
+            db.execute("PRAGMA synchronous=NORMAL")
+        return db
+
+    def get(self, key):
+        row = self._db().execute(
+            "SELECT value FROM shared_kv WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)",
+            (key, time.time())
+        ).fetchone()
+        return str(row[0]) if row is not None else None
+
+    def get_many(self, keys):
+        if not keys:
+            return []
+        rows = dict(self._db().execute(
+            "SELECT key, value FROM shared_kv WHERE key IN (%s) AND (expires_at IS NULL OR expires_at > ?)"
+            % ",".join("?" * len(keys)),
+            (*keys, time.time())
+        ).fetchall())
+        return [str(rows[key]) if key in rows else None for key in keys]
+
+    def set(self, key, value, ttl=None, nx=False):
+        now = time.time()
+        expires_at = now + ttl if ttl else None
+        if not nx:
+            self._db().execute(
+                "INSERT OR REPLACE INTO shared_kv (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, str(value), expires_at)
+            )
+            return True
+        # Solo si no existe o ya venció, en una sola sentencia
+        cursor = self._db().execute(
+            "INSERT INTO shared_kv (key, value, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = excluded.value, expires_at = excluded.expires_at "
+            "WHERE shared_kv.expires_at IS NOT NULL AND shared_kv.expires_at <= ?",
+            (key, str(value), expires_at, now)
+        )
+        return cursor.rowcount > 0
+
+    def delete(self, key):
+        self._db().execute("DELETE FROM shared_kv WHERE key = ?", (key,))
+
+    def incr(self, key, amount=1, ttl=None):
+        now = time.time()
+        expires_at = now + ttl if ttl else None
+        # Atómico: un solo UPSERT; si la clave venció vuelve a empezar con su TTL
+        row = self._db().execute(
+            "INSERT INTO shared_kv (key, value, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET "
+            "value = CASE WHEN expires_at IS NOT NULL AND expires_at <= ? "
+            "THEN excluded.value ELSE CAST(value AS INTEGER) + excluded.value END, "
+            "expires_at = CASE WHEN expires_at IS NOT NULL AND expires_at <= ? "
+            "THEN excluded.expires_at ELSE expires_at END "
+            "RETURNING value",
+            (key, amount, expires_at, now, now)
+        ).fetchone()
+        return int(row[0])
+
+    def publish(self, channel, message):
+        self._db().execute(
+            "INSERT INTO shared_messages (channel, payload, created_at) VALUES (?, ?, ?)",
+            (channel, message, time.time())
+        )
+
+    def subscribe(self, channel, callback):
+        with self._lock:
+            self._subscribers.setdefault(channel, []).append(callback)
+            if self._listener is None:
+                last_id = self._db().execute("SELECT COALESCE(MAX(id), 0) FROM shared_messages").fetchone()[0]
+                self._listener = threading.Thread(
+                    target=self._listen, args=(last_id,), name="shared-state-sqlite", daemon=True
+                )
+                self._listener.start()
+
+    def _listen(self, last_id):
+        swept_at = 0.0
+        while not self._closed.wait(SHARED_STATE_POLL_SECONDS):
+            try:
+                db = self._db()
+                rows = db.execute(
+                    "SELECT id, channel, payload FROM shared_messages WHERE id > ? ORDER BY id",
+                    (last_id,)
+                ).fetchall()
+                for last_id, channel, payload in rows:
+                    _dispatch(self._subscribers.get(channel, ()), payload)
+
+                now = time.time()
+                if now - swept_at >= SWEEP_INTERVAL:
+                    db.execute("DELETE FROM shared_kv WHERE expires_at <= ?", (now,))
+                    db.execute("DELETE FROM shared_messages WHERE created_at < ?",
+                               (now - MESSAGE_RETENTION_SECONDS,))
+                    swept_at = now
+            except sqlite3.Error:
+                logger.exception("Error al leer los mensajes compartidos")
+
+    def close(self):
+        self._closed.set()
+
+
+class _RespConnection:
+    """Conexión RESP2 bloqueante: un comando (o varios en tubería) a la vez"""
+
+    def __init__(self, host, port, password=None, db=0, timeout=SHARED_STATE_TIMEOUT):
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.reader = self.sock.makefile("rb")
+        if password:
+            self.call("AUTH", password)
+        if db:
+            self.call("SELECT", db)
+
+    @staticmethod
+    def encode(args):
+        parts = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            if not isinstance(arg, bytes):
+                arg = str(arg).encode()
+            parts.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+        return b"".join(parts)
+
+    def send(self, *commands):
+        self.sock.sendall(b"".join(self.encode(args) for args in commands))
+
+    def read(self):
+        line = self.reader.readline()
+        if not line:
+            raise ConnectionError("Conexión cerrada por el servidor")
+        kind, payload = line[:1], line[1:-2]
+        if kind == b"+":
+            return payload.decode()
+        if kind == b"-":
+            raise SharedStateError(payload.decode())
+        if kind == b":":
+            return int(payload)
+        if kind == b"$":
+            length = int(payload)
+            if length < 0:
+                return None
+            return self.reader.read(length + 2)[:-2].decode()
+        if kind == b"*":
+            length = int(payload)
+            return None if length < 0 else [self.read() for _ in range(length)]
+        raise SharedStateError(f"Respuesta RESP inválida: {line!r}")
+
+    def call(self, *args):
+        self.send(args)
+        return self.read()
+
+    def pipeline(self, *commands):
+        self.send(*commands)
+        return [self.read() for _ in commands]
+
+    def close(self):
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class RespBackend:
+    """Estado en un servidor que habla el protocolo de Redis"""
+
+    shared = True
+
+    def __init__(self, url):
+        parsed = urlparse(url)
+        self.address = (parsed.hostname or "127.0.0.1", parsed.port or 6379)
+        self.password = unquote(parsed.password) if parsed.password else None
+        self.db = int(parsed.path.strip("/") or 0)
+        self._local = threading.local()
+        self._subscribers = {}
+        self._lock = threading.Lock()
+        self._listener = None
+        self._subscription = None
+        self._closed = threading.Event()
+
+    def _connect(self, timeout=SHARED_STATE_TIMEOUT):
+        return _RespConnection(*self.address, password=self.password, db=self.db, timeout=timeout)
+
+    def _run(self, *commands):
+        # Una conexión por hilo; si se cortó, se reintenta una vez con otra
+        for attempt in (0, 1):
+            connection = getattr(self._local, "connection", None)
+            if connection is None:
+                connection = self._local.connection = self._connect()
+            try:
+                return connection.pipeline(*commands)
+            except (OSError, ConnectionError):
+                connection.close()
+                self._local.connection = None
+                if attempt:
+                    raise
+
+    def get(self, key):
+        return self._run(("GET", key))[0]
+
+    def get_many(self, keys):
+        return self._run(("MGET", *keys))[0] if keys else []
+
+    def set(self, key, value, ttl=None, nx=False):
+        args = ["SET", key, value]
+        if ttl:
+            args += ["PX", int(ttl * 1000)]
+        if nx:
+            args.append("NX")
+        return self._run(args)[0] is not None
+
+    def delete(self, key):
+        self._run(("DEL", key))
+
+    def incr(self, key, amount=1, ttl=None):
+        if not ttl:
+            return self._run(("INCRBY", key, amount))[0]
+        # El SET NX crea la clave con su TTL; el INCRBY nunca lo cambia
+        return self._run(("SET", key, 0, "PX", int(ttl * 1000), "NX"), ("INCRBY", key, amount))[1]
+
+    def publish(self, channel, message):
+        self._run(("PUBLISH", channel, message))
+
+    def subscribe(self, channel, callback):
+        with self._lock:
+            first = channel not in self._subscribers
+            self._subscribers.setdefault(channel, []).append(callback)
+            if self._listener is None:
+                self._listener = threading.Thread(target=self._listen, name="shared-state-resp", daemon=True)
+                self._listener.start()
+            elif first and self._subscription is not None:
+                try:
+                    self._subscription.send(("SUBSCRIBE", channel))
+                except OSError:
+                    pass  # el hilo reconecta y vuelve a suscribir todos los canales
+
+    def _listen(self):
+        while not self._closed.is_set():
+            try:
+                connection = self._connect(timeout=None)
+                with self._lock:
+                    self._subscription = connection
+                    connection.send(("SUBSCRIBE", *self._subscribers))
+                while True:
+                    message = connection.read()
+                    if message and message[0] == "message":
+                        _dispatch(self._subscribers.get(message[1], ()), message[2])
+            except (OSError, ConnectionError, SharedStateError):
+                if not self._closed.is_set():
+                    logger.warning("Suscripción de estado compartido cortada, reconectando")
+            with self._lock:
+                self._subscription = None
+            self._closed.wait(1)
+
+    def close(self):
+        self._closed.set()
+        if self._subscription is not None:
+            self._subscription.close()
+
+
+def _dispatch(callbacks, message):
+    for callback in list(callbacks):
+        try:
+            callback(message)
+        except Exception:
+            logger.exception("Error en un suscriptor de estado compartido")
+
+
+def from_url(url):
+    """Backend para SHARED_STATE_URL"""
+    scheme = url.partition("://")[0]
+    if scheme in ("", "memory"):
+        return MemoryBackend()
+    if scheme == "sqlite":
+        return SQLiteBackend(url[len("sqlite:///"):])
+    if scheme == "redis":
+        return RespBackend(url)
+    raise ValueError(f"SHARED_STATE_URL no soportada: {url}")
+
+
+backend = from_url(SHARED_STATE_URL)
+
+
+# --- Servidor RESP mínimo para probar sin Redis ---
+
+class _StandInServer:
+    """GET, MGET, SET (PX, NX), DEL, INCRBY, PUBLISH y SUBSCRIBE en memoria"""
+
+    def __init__(self):
+        self.store = MemoryBackend()
+        self.channels = {}
+
+    @staticmethod
+    async def _read_command(reader):
+        line = await reader.readline()
+        if not line:
+            return None
+        count = int(line[1:-2])
+        args = []
+        for _ in range(count):
+            length = int((await reader.readline())[1:-2])
+            args.append((await reader.readexactly(length + 2))[:-2].decode())
+        return args
+
+    @staticmethod
+    def _encode(value):
+        if value is None:
+            return b"$-1\r\n"
+        if isinstance(value, int):
+            return b":%d\r\n" % value
+        if isinstance(value, list):
+            return b"*%d\r\n" % len(value) + b"".join(_StandInServer._encode(item) for item in value)
+        data = value.encode()
+        return b"$%d\r\n%s\r\n" % (len(data), data)
+
+    def _execute(self, args):
+        command, args = args[0].upper(), args[1:]
+        if command in ("PING", "AUTH", "SELECT"):
+            return b"+OK\r\n" if command != "PING" else b"+PONG\r\n"
+        if command == "GET":
+            return self._encode(self.store.get(args[0]))
+        if command == "MGET":
+            return self._encode(self.store.get_many(args))
+        if command == "SET":
+            options = [arg.upper() for arg in args[2:]]
+            ttl = int(options[options.index("PX") + 1]) / 1000 if "PX" in options else None
+            stored = self.store.set(args[0], args[1], ttl, nx="NX" in options)
+            return b"+OK\r\n" if stored else b"$-1\r\n"
+        if command == "DEL":
+            for key in args:
+                self.store.delete(key)
+            return b":%d\r\n" % len(args)
+        if command == "INCRBY":
+            return self._encode(self.store.incr(args[0], int(args[1])))
+        if command == "PUBLISH":
+            receivers = self.channels.get(args[0], set())
+            for writer in receivers:
+                writer.write(self._encode(["message", args[0], args[1]]))
+            return self._encode(len(receivers))
+        return f"-ERR comando no soportado '{command}'\r\n".encode()
+
+    async def handle(self, reader, writer):
+        subscribed = set()
+        try:
+            while True:
+                args = await self._read_command(reader)
+                if args is None:
+                    break
+                if args[0].upper() == "SUBSCRIBE":
+                    for channel in args[1:]:
+                        subscribed.add(channel)
+                        self.channels.setdefault(channel, set()).add(writer)
+                        writer.write(self._encode(["subscribe", channel, len(subscribed)]))
+                else:
+                    writer.write(self._execute(args))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            for channel in subscribed:
+                self.channels.get(channel, set()).discard(writer)
+            writer.close()
+
+
+async def serve(host, port):
+    server = await asyncio.start_server(_StandInServer().handle, host, port)
+    print(f"✅ Servidor RESP de prueba en {host}:{port}")
+    async with server:
+        await server.serve_forever()
+
+
+def check(url):
+    """Ejercitar todas las operaciones contra un backend"""
+    state = from_url(url)
+    prefix = f"check:{PROCESS_ID}:"
+    received = []
+    state.subscribe(prefix + "canal", received.append)
+    time.sleep(SHARED_STATE_POLL_SECONDS + 0.3)
+
+    assert state.set(prefix + "a", "1") and state.get(prefix + "a") == "1"
+    assert state.set(prefix + "a", "2", nx=True) is False and state.get(prefix + "a") == "1"
+    assert state.get_many([prefix + "a", prefix + "nada"]) == ["1", None]
+    state.delete(prefix + "a")
+    assert state.get(prefix + "a") is None
+    assert state.set(prefix + "ttl", "x", ttl=0.2) and state.get(prefix + "ttl") == "x"
+    assert [state.incr(prefix + "n", 2, ttl=0.2) for _ in range(3)] == [2, 4, 6]
+    time.sleep(0.3)
+    assert state.get(prefix + "ttl") is None and state.incr(prefix + "n", ttl=0.2) == 1
+
+    state.publish(prefix + "canal", "hola")
+    deadline = time.time() + 3
+    while not received and time.time() < deadline:
+        time.sleep(0.05)
+    assert received == ["hola"], received
+    state.close()
+    print(f"✅ {url}: clave/valor, TTL, contadores y pub/sub correctos")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backend de estado compartido")
+    parser.add_argument("--serve", metavar="HOST:PUERTO", help="Levantar el servidor RESP de prueba")
+    parser.add_argument("--check", metavar="URL", help="Probar un backend (memory://, sqlite:///..., redis://...)")
+    args = parser.parse_args()
+
+    if args.serve:
+        host, _, port = args.serve.rpartition(":")
+        asyncio.run(serve(host or "127.0.0.1", int(port)))
+    elif args.check:
+        check(args.check)
+    else:
+        parser.print_help()
@@ -0,0 +1,117 @@
+"""
+Archivo frío del historial (archive.py) combinado con la tabla.
+
+Después de archivar las ubicaciones viejas, el historial de un
+dispositivo, el de toda la flota y las estadísticas siguen devolviendo
+lo mismo que antes, más reciente primero y sin pasarse del límite. Corre
+en proceso con TestClient sobre una base SQLite temporal.
+
+python -m pytest -q test_archive.py
+"""
+
+import os
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+import pytest
+
+# Configuración antes de importar la app: base temporal y sin límites ni tareas de fondo
+_workdir = tempfile.mkdtemp(prefix="archive_")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_workdir, 'test.db')}"
+os.environ["RATE_LIMIT_ENABLED"] = "false"
+os.environ["ARCHIVE_DIR"] = os.path.join(_workdir, "archive")
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+import archive  # noqa: E402
+import migrations  # noqa: E402
+from auth_utils import create_access_token, get_password_hash  # noqa: E402
+from database import SessionLocal, engine  # noqa: E402
+from main import app  # noqa: E402
+from models import Device, Location, User  # noqa: E402
+
+DEVICES = 3
+OLD_PER_DEVICE = 6     # más viejas que el umbral: pasan al archivo
+RECENT_PER_DEVICE = 4  # quedan en la tabla
+ARCHIVED = DEVICES * OLD_PER_DEVICE
+
+
+@pytest.fixture(scope="module")
+def fleet():
+    """Timestamps esperados de cada dispositivo, más reciente primero"""
+    migrations.upgrade(engine)
+    db = SessionLocal()
+    user = User(email="archive@test.local", username="archive", hashed_password=get_password_hash("archive"))
+    db.add(user)
+    db.commit()
+    devices = [Device(device_id=f"ARCH{i:03d}", name=f"Vehículo {i}", owner_id=user.id) for i in range(DEVICES)]
+    db.add_all(devices)
+    db.commit()
+
+    now = datetime.utcnow().replace(microsecond=0)
+    expected = {}
+    for i, device in enumerate(devices):
+        # Desfasados por dispositivo para que la mezcla de la flota tenga un orden único
+        recent = [now - timedelta(minutes=10 * n + i) for n in range(RECENT_PER_DEVICE)]
+        old = [now - timedelta(days=200 + n, minutes=i) for n in range(OLD_PER_DEVICE)]
+        db.add_all([
+            Location(device_id=device.id, latitude=-25.2637 + n * 1e-3, longitude=-57.5759, timestamp=ts)
+            for n, ts in enumerate(recent + old)
+        ])
+        expected[device.device_id] = (device.id, recent + old)
+    db.commit()
+
+    # Antes de archivar: la caché de meses ve el directorio vacío
+    assert all(archive.list_months(pk) == () for pk, _ in expected.values())
+    assert archive.archive_locations(db, older_than_days=90) >= ARCHIVED
+    db.close()
+    return expected
+
+
+@pytest.fixture(scope="module")
+def client(fleet):
+    client = TestClient(app)
+    client.headers["Authorization"] = f"Bearer {create_access_token({'sub': 'archive@test.local'})}"
+    return client
+
+
+def timestamps(response):
+    assert response.status_code == 200, response.text
+    return [datetime.fromisoformat(row["timestamp"]) for row in response.json()]
+
+
+def test_archived(fleet):
+    db = SessionLocal()
+    try:
+        for device_pk, _ in fleet.values():
+            assert db.query(Location).filter(Location.device_id == device_pk).count() == RECENT_PER_DEVICE
+            # Escribir el archivo invalida la caché de meses de este proceso
+            assert archive.list_months(device_pk)
+            assert archive.count_rows(device_pk) == OLD_PER_DEVICE
+    finally:
+        db.close()
+
+
+def test_device_history(client, fleet):
+    _, expected = fleet["ARCH000"]
+    assert timestamps(client.get("/api/ubicaciones/device/ARCH000?limit=50")) == expected
+    assert timestamps(client.get("/api/ubicaciones/device/ARCH000?limit=7")) == expected[:7]
+
+
+def test_user_locations(client, fleet):
+    every = sorted((ts for _, rows in fleet.values() for ts in rows), reverse=True)
+    assert timestamps(client.get("/api/ubicaciones/user?limit=100")) == every
+    # Con la página de la tabla llena no entra nada del archivo
+    assert timestamps(client.get("/api/ubicaciones/user?limit=5")) == every[:5]
+    # Y si no alcanza, se completa con lo archivado de cada dispositivo
+    limit = DEVICES * RECENT_PER_DEVICE + 4
+    assert timestamps(client.get(f"/api/ubicaciones/user?limit={limit}")) == every[:limit]
+
+
+def test_stats(client, fleet):
+    response = client.get("/api/ubicaciones/device/ARCH001/stats")
+    assert response.status_code == 200, response.text
+    assert response.json()["count"] == OLD_PER_DEVICE + RECENT_PER_DEVICE
+    assert response.json()["archived_count"] == OLD_PER_DEVICE
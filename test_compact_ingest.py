@@ -0,0 +1,155 @@
+"""
+Formato compacto de los rastreadores (compact_codec.py) y su ingesta por lotes.
+
+Ida y vuelta de los registros binarios, los acks y el CSV; un cuerpo
+binario o CSV por los POST de la API con un ack por registro, y el lote
+que se anula por un reintento fuera de la ventana de seq y se guarda de a
+uno. Corre en proceso con TestClient sobre una base SQLite temporal.
+
+python -m pytest -q test_compact_ingest.py
+"""
+
+import os
+import sys
+import tempfile
+from datetime import datetime
+
+import pytest
+
+# Configuración antes de importar la app: base temporal y sin límites ni tareas de fondo
+_workdir = tempfile.mkdtemp(prefix="compact_ingest_")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_workdir, 'test.db')}"
+os.environ["RATE_LIMIT_ENABLED"] = "false"
+os.environ["ARCHIVE_DIR"] = os.path.join(_workdir, "archive")
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+import compact_codec as codec  # noqa: E402
+import ingest  # noqa: E402
+import migrations  # noqa: E402
+from auth_utils import get_password_hash  # noqa: E402
+from database import SessionLocal, engine  # noqa: E402
+from main import app  # noqa: E402
+from models import Alert, Device, Location, User  # noqa: E402
+
+BINARY = {"Content-Type": codec.BINARY_MEDIA_TYPE}
+CSV = {"Content-Type": codec.CSV_MEDIA_TYPE}
+
+
+@pytest.fixture(scope="module")
+def client():
+    migrations.upgrade(engine)
+    db = SessionLocal()
+    user = User(email="compact@test.local", username="compact", hashed_password=get_password_hash("compact"))
+    db.add(user)
+    db.commit()
+    db.add_all([
+        Device(device_id="CMP001", name="Vehículo 1", owner_id=user.id, security_mode=True),
+        Device(device_id="CMP002", name="Vehículo 2", owner_id=user.id),
+    ])
+    db.commit()
+    db.close()
+    return TestClient(app)
+
+
+def count(model, device_id):
+    db = SessionLocal()
+    try:
+        return db.query(model).join(Device, Device.id == model.device_id).filter(Device.device_id == device_id).count()
+    finally:
+        db.close()
+
+
+def acks(content):
+    return [codec.decode_ack(content, offset) for offset in range(0, len(content), codec.ACK.size)]
+
+
+def test_record_round_trip():
+    ts = datetime(2024, 5, 1, 12, 30, 15)
+    data = (
+        codec.encode_record("CMP001", -25.2637123, -57.5759456, seq=7, ts=ts)
+        + codec.encode_record("CMP002", seq=8, event="tamper")
+        + codec.encode_record("CMP001")
+    )
+    records, consumed = codec.decode_records(data)
+    assert consumed == len(data)
+    assert records[0] == codec.Record("CMP001", 7, ts, -25.2637123, -57.5759456, None)
+    assert records[1] == codec.Record("CMP002", 8, None, None, None, "tamper")
+    assert records[2] == codec.Record("CMP001", None, None, None, None, None)
+
+
+def test_incomplete_record_not_consumed():
+    whole = codec.encode_record("CMP001", -25.0, -57.0, seq=1)
+    records, consumed = codec.decode_records(whole + whole[:10])
+    assert len(records) == 1
+    assert consumed == len(whole)
+
+
+def test_invalid_records():
+    record = bytearray(codec.encode_record("CMP001", -25.0, -57.0))
+    record[0] = 9
+    with pytest.raises(codec.CodecError):
+        codec.decode_records(bytes(record))
+
+
+def test_ack_round_trip():
+    assert codec.decode_ack(codec.encode_ack(codec.STATUS_DUPLICATE, True, 42)) == (codec.STATUS_DUPLICATE, True, 42)
+    assert codec.encode_csv_ack(codec.STATUS_OK, False, None) == b"0,0,0\n"
+
+
+def test_csv_decode():
+    records = codec.decode_csv(b"CMP001,3,1714566615,-25.1,-57.2\n\nCMP001,,,,\nCMP002,4,,-25.1,-57.2\n")
+    assert records[0] == codec.Record("CMP001", 3, datetime(2024, 5, 1, 12, 30, 15), -25.1, -57.2, None)
+    assert records[1] is None
+    assert records[2].seq == 4 and records[2].ts is None
+    alerts = codec.decode_csv(b"CMP002,5,,tamper,,\nCMP002,6,,,,\n", alerts=True)
+    assert alerts[0] == codec.Record("CMP002", 5, None, None, None, "tamper")
+    assert alerts[1] is None
+
+
+def test_binary_locations(client):
+    body = (
+        codec.encode_record("CMP001", -25.2637, -57.5759, seq=1)
+        + codec.encode_record("NOEXISTE", -25.2637, -57.5759, seq=1)
+        + codec.encode_record("CMP002", seq=1, event="tamper")
+        + codec.encode_record("CMP001", -25.2638, -57.5759, seq=1)
+    )
+    response = client.post("/api/ubicaciones/", content=body, headers=BINARY)
+    assert response.status_code == 200, response.text
+    assert response.headers["content-type"] == codec.BINARY_MEDIA_TYPE
+    assert acks(response.content) == [
+        (codec.STATUS_OK, True, 1),
+        (codec.STATUS_NOT_FOUND, False, 1),
+        # Una alerta no entra por el endpoint de ubicaciones
+        (codec.STATUS_INVALID, False, 1),
+        (codec.STATUS_DUPLICATE, True, 1),
+    ]
+    assert count(Location, "CMP001") == 1
+
+
+def test_csv_alerts(client):
+    response = client.post("/api/alertas/", content=b"CMP002,10,,tamper,,\nCMP002,10,,tamper,,\n", headers=CSV)
+    assert response.status_code == 200, response.text
+    assert response.content == b"0,0,10\n1,0,10\n"
+    assert count(Alert, "CMP002") == 1
+
+
+def test_empty_and_broken_bodies(client):
+    assert client.post("/api/ubicaciones/", content=b"\n", headers=CSV).status_code == 422
+    broken = codec.encode_record("CMP001", -25.0, -57.0)[:-3]
+    assert client.post("/api/ubicaciones/", content=broken, headers=BINARY).status_code == 422
+
+
+def test_batch_fallback_on_retry_outside_window(client, monkeypatch):
+    first = client.post("/api/ubicaciones/", content=b"CMP002,20,,-25.2637,-57.5759\n", headers=CSV)
+    assert first.content == b"0,0,20\n"
+
+    # La ventana ya no recuerda el 20: el índice único anula el commit del lote
+    # y los registros se guardan de a uno
+    monkeypatch.setattr(ingest, "location_seqs", ingest.RecentSeqWindow())
+    body = b"CMP002,21,,-25.2638,-57.5759\nCMP002,20,,-25.2637,-57.5759\nCMP002,22,,-25.2639,-57.5759\n"
+    response = client.post("/api/ubicaciones/", content=body, headers=CSV)
+    assert response.status_code == 200, response.text
+    assert response.content == b"0,0,21\n1,0,20\n0,0,22\n"
+    assert count(Location, "CMP002") == 3
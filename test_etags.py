@@ -0,0 +1,104 @@
+"""
+ETag e If-None-Match en los GET que la app consulta periódicamente.
+
+Sin cambios responde 304 sin cuerpo; una escritura (ubicación, alerta,
+dispositivo nuevo) cambia el ETag; una cuenta desactivada deja de recibir
+304. Corre en proceso con TestClient sobre una base SQLite temporal.
+
+python -m pytest -q test_etags.py
+"""
+
+import os
+import sys
+import tempfile
+
+import pytest
+
+# Configuración antes de importar la app: base temporal y sin límites ni tareas de fondo
+_workdir = tempfile.mkdtemp(prefix="etags_")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_workdir, 'test.db')}"
+os.environ["RATE_LIMIT_ENABLED"] = "false"
+os.environ["ARCHIVE_DIR"] = os.path.join(_workdir, "archive")
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+import migrations  # noqa: E402
+import versioning  # noqa: E402
+from auth_utils import create_access_token, get_password_hash  # noqa: E402
+from database import SessionLocal, engine  # noqa: E402
+from main import app  # noqa: E402
+from models import Device, User  # noqa: E402
+
+pytestmark = pytest.mark.skipif(not versioning.ETAG_ENABLED, reason="ETAG_ENABLED=false")
+
+
+def make_client(email):
+    db = SessionLocal()
+    user = User(email=email, username=email.split("@")[0], hashed_password=get_password_hash("etag"))
+    db.add(user)
+    db.commit()
+    db.add(Device(device_id=email.split("@")[0].upper(), name="Vehículo", owner_id=user.id))
+    db.commit()
+    db.close()
+
+    client = TestClient(app)
+    client.headers["Authorization"] = f"Bearer {create_access_token({'sub': email})}"
+    return client
+
+
+@pytest.fixture(scope="module")
+def client():
+    migrations.upgrade(engine)
+    return make_client("etag@test.local")
+
+
+def revalidate(client, url):
+    """Primera lectura con 200 y ETag, y la revalidación sin cambios con 304"""
+    first = client.get(url)
+    assert first.status_code == 200, first.text
+    etag = first.headers["ETag"]
+    again = client.get(url, headers={"If-None-Match": etag})
+    assert again.status_code == 304
+    assert again.content == b""
+    assert again.headers["ETag"] == etag
+    return etag
+
+
+def test_latest_location(client):
+    url = "/api/ubicaciones/device/ETAG/latest"
+    assert client.post("/api/ubicaciones/", json={"id": "ETAG", "lat": -25.2637, "lng": -57.5759}).status_code == 201
+    etag = revalidate(client, url)
+
+    assert client.post("/api/ubicaciones/", json={"id": "ETAG", "lat": -25.2638, "lng": -57.5759}).status_code == 201
+    changed = client.get(url, headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["ETag"] != etag
+
+
+def test_alerts(client):
+    urls = ["/api/alertas/user", "/api/alertas/device/ETAG"]
+    etags = [revalidate(client, url) for url in urls]
+
+    assert client.post("/api/alertas/", json={"id": "ETAG", "evento": "tamper"}).status_code == 201
+    for url, etag in zip(urls, etags):
+        changed = client.get(url, headers={"If-None-Match": etag})
+        assert changed.status_code == 200
+        assert len(changed.json()) == 1
+
+
+def test_devices(client):
+    etag = revalidate(client, "/api/dispositivos/")
+    created = client.post("/api/dispositivos/", json={"device_id": "ETAG2", "name": "Otro"})
+    assert created.status_code == 200, created.text
+    changed = client.get("/api/dispositivos/", headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert len(changed.json()) == 2
+
+
+def test_deactivated_account_gets_no_304():
+    client = make_client("baja@test.local")
+    etag = revalidate(client, "/api/dispositivos/")
+    assert client.delete("/api/users/profile").status_code == 200
+    response = client.get("/api/dispositivos/", headers={"If-None-Match": etag})
+    assert response.status_code != 304
@@ -0,0 +1,143 @@
+"""
+Paridad de la ruta rápida del firmware (fast_ingest.py) con los routers.
+
+Para los mismos cuerpos inválidos (vacío, JSON roto, tipos que pydantic no
+convierte, campos faltantes, content-type que no es JSON) la ruta rápida
+responde el mismo status y el mismo JSON que /api; los cuerpos que
+pydantic convierte se aceptan en las dos. Corre en proceso con TestClient
+sobre una base SQLite temporal.
+
+python -m pytest -q test_fast_ingest.py
+"""
+
+import json
+import os
+import sys
+import tempfile
+
+import pytest
+
+# Configuración antes de importar la app: base temporal y sin límites ni tareas de fondo
+_workdir = tempfile.mkdtemp(prefix="fast_ingest_")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_workdir, 'test.db')}"
+os.environ["RATE_LIMIT_ENABLED"] = "false"
+os.environ["ARCHIVE_DIR"] = os.path.join(_workdir, "archive")
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+import fast_ingest  # noqa: E402
+import migrations  # noqa: E402
+from auth_utils import get_password_hash  # noqa: E402
+from database import SessionLocal, engine  # noqa: E402
+from main import app  # noqa: E402
+from models import Device, User  # noqa: E402
+
+pytestmark = pytest.mark.skipif(not fast_ingest.FAST_INGEST_ENABLED, reason="FAST_INGEST_ENABLED=false")
+
+JSON = {"Content-Type": "application/json"}
+
+INVALID_LOCATIONS = [
+    (b"", JSON),
+    (b"{", JSON),
+    (b'{"id": "FAST001", "lat": 1,}', JSON),
+    (b"[]", JSON),
+    (b"null", JSON),
+    (b'"texto"', JSON),
+    (b"5", JSON),
+    (b'[["id", "FAST001"]]', JSON),
+    (json.dumps({"id": "FAST001"}).encode(), JSON),
+    (json.dumps({"id": "FAST001", "lat": "abc", "lng": -57.0}).encode(), JSON),
+    (json.dumps({"id": "FAST001", "lat": -25.0, "lng": None}).encode(), JSON),
+    (json.dumps({"id": "FAST001", "lat": -25.0, "lng": -57.0, "seq": "x"}).encode(), JSON),
+    (json.dumps({"id": "FAST001", "lat": -25.0, "lng": -57.0, "ts": "ayer"}).encode(), JSON),
+    (json.dumps({"id": ["FAST001"], "lat": -25.0, "lng": -57.0}).encode(), JSON),
+    (json.dumps({"id": "FAST001", "lat": -25.0, "lng": -57.0}).encode(), {"Content-Type": "text/plain"}),
+]
+
+INVALID_ALERTS = [
+    (b"", JSON),
+    (b"{", JSON),
+    (json.dumps({"id": "FAST001"}).encode(), JSON),
+    (json.dumps({"id": "FAST001", "evento": None}).encode(), JSON),
+    (json.dumps({"id": "FAST001", "evento": "tamper", "lat": "norte"}).encode(), JSON),
+    (json.dumps({"id": "FAST001", "evento": "tamper", "ts": {}}).encode(), JSON),
+]
+
+# Tipos que pydantic convierte: la ruta rápida los pasa al modelo
+COERCED_LOCATIONS = [
+    {"id": "FAST001", "lat": "-25.2637", "lng": "-57.5759"},
+    {"id": "FAST001", "lat": -25.2637, "lng": -57.5759, "ts": 1714566615},
+    {"id": 1234, "lat": -25.2637, "lng": -57.5759},
+    [["id", "FAST001"], ["lat", -25.2637], ["lng", -57.5759]],
+]
+
+
+@pytest.fixture(scope="module")
+def client():
+    migrations.upgrade(engine)
+    db = SessionLocal()
+    user = User(email="fast@test.local", username="fast", hashed_password=get_password_hash("fast"))
+    db.add(user)
+    db.commit()
+    db.add_all([
+        Device(device_id="FAST001", name="Vehículo", owner_id=user.id, security_mode=True),
+        Device(device_id="1234", name="Numérico", owner_id=user.id),
+    ])
+    db.commit()
+    db.close()
+    return TestClient(app)
+
+
+def both(client, path, body, headers):
+    routed = client.post(f"/api{path}/", content=body, headers=headers)
+    fast = client.post(f"{fast_ingest.FAST_INGEST_PREFIX}{path}", content=body, headers=headers)
+    return routed, fast
+
+
+@pytest.mark.parametrize("body, headers", INVALID_LOCATIONS)
+def test_location_errors(client, body, headers):
+    routed, fast = both(client, "/ubicaciones", body, headers)
+    assert routed.status_code == 422
+    assert (fast.status_code, fast.json()) == (routed.status_code, routed.json())
+
+
+@pytest.mark.parametrize("body, headers", INVALID_ALERTS)
+def test_alert_errors(client, body, headers):
+    routed, fast = both(client, "/alertas", body, headers)
+    assert routed.status_code == 422
+    assert (fast.status_code, fast.json()) == (routed.status_code, routed.json())
+
+
+@pytest.mark.parametrize("payload", COERCED_LOCATIONS)
+def test_coerced_locations(client, payload):
+    routed, fast = both(client, "/ubicaciones", json.dumps(payload).encode(), JSON)
+    assert routed.status_code in (200, 201), routed.text
+    assert fast.status_code in (200, 201), fast.text
+    assert set(fast.json()) == set(routed.json())
+
+
+def test_coerced_seq(client):
+    # "8" se guarda como el seq 8: el router lo reconoce como el mismo envío
+    fast = client.post(f"{fast_ingest.FAST_INGEST_PREFIX}/ubicaciones",
+                       json={"id": "FAST001", "lat": -25.2637, "lng": -57.5759, "seq": "8"})
+    assert fast.status_code == 201, fast.text
+    routed = client.post("/api/ubicaciones/", json={"id": "FAST001", "lat": -25.2637, "lng": -57.5759, "seq": 8})
+    assert routed.status_code == 200
+    assert routed.json()["duplicado"] is True
+    assert routed.json()["id"] == fast.json()["id"]
+
+
+def test_unknown_device(client):
+    body = json.dumps({"id": "NOEXISTE", "lat": -25.0, "lng": -57.0}).encode()
+    routed, fast = both(client, "/ubicaciones", body, JSON)
+    assert routed.status_code == 404
+    assert (fast.status_code, fast.json()) == (routed.status_code, routed.json())
+
+
+def test_mode(client):
+    routed = client.get("/api/dispositivos/FAST001/modo")
+    fast = client.get(f"{fast_ingest.FAST_INGEST_PREFIX}/dispositivos/FAST001/modo")
+    assert routed.status_code == fast.status_code == 200
+    assert fast.json() == routed.json()
+    assert fast.json()["modo_seguridad"] is True
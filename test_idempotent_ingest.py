@@ -0,0 +1,112 @@
+"""
+Ingesta idempotente con `seq`.
+
+Un reintento del mismo envío responde 200 con "duplicado" y el id de la
+fila original, sin crear otra; pasa igual cuando la ventana de secuencias
+en memoria ya lo olvidó (lo detiene el índice único) y, en ese caso, el
+filtro GPS vuelve al estado que tenía antes del reintento. Corre en proceso
+con TestClient sobre una base SQLite temporal.
+
+python -m pytest -q test_idempotent_ingest.py
+"""
+
+import os
+import sys
+import tempfile
+
+import pytest
+
+# Configuración antes de importar la app: base temporal y sin límites ni tareas de fondo
+_workdir = tempfile.mkdtemp(prefix="idempotent_ingest_")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_workdir, 'test.db')}"
+os.environ["RATE_LIMIT_ENABLED"] = "false"
+os.environ["ARCHIVE_DIR"] = os.path.join(_workdir, "archive")
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+import gps_filter  # noqa: E402
+import ingest  # noqa: E402
+import migrations  # noqa: E402
+from auth_utils import get_password_hash  # noqa: E402
+from database import SessionLocal, engine  # noqa: E402
+from main import app  # noqa: E402
+from models import Alert, Device, Location, User  # noqa: E402
+
+
+@pytest.fixture(scope="module")
+def device_pk():
+    migrations.upgrade(engine)
+    db = SessionLocal()
+    user = User(email="seq@test.local", username="seq", hashed_password=get_password_hash("seq"))
+    db.add(user)
+    db.commit()
+    device = Device(device_id="SEQ001", name="Vehículo", owner_id=user.id)
+    db.add(device)
+    db.commit()
+    pk = device.id
+    db.close()
+    return pk
+
+
+@pytest.fixture(scope="module")
+def client(device_pk):
+    return TestClient(app)
+
+
+def count(model, device_pk):
+    db = SessionLocal()
+    try:
+        return db.query(model).filter(model.device_id == device_pk).count()
+    finally:
+        db.close()
+
+
+def test_location_retry(client, device_pk):
+    payload = {"id": "SEQ001", "lat": -25.2637, "lng": -57.5759, "seq": 1}
+    first = client.post("/api/ubicaciones/", json=payload)
+    assert first.status_code == 201, first.text
+
+    retry = client.post("/api/ubicaciones/", json=payload)
+    assert retry.status_code == 200
+    assert retry.json()["duplicado"] is True
+    assert retry.json()["id"] == first.json()["id"]
+    assert count(Location, device_pk) == 1
+
+
+def test_location_retry_outside_window(client, device_pk, monkeypatch):
+    payload = {"id": "SEQ001", "lat": -25.2638, "lng": -57.5759, "seq": 2}
+    first = client.post("/api/ubicaciones/", json=payload)
+    assert first.status_code == 201, first.text
+
+    # La ventana en memoria ya no lo recuerda: lo detiene el índice único
+    monkeypatch.setattr(ingest, "location_seqs", ingest.RecentSeqWindow())
+    state = gps_filter.snapshot([device_pk])
+    retry = client.post("/api/ubicaciones/", json={**payload, "lat": -25.2639})
+    assert retry.status_code == 200
+    assert retry.json()["duplicado"] is True
+    assert retry.json()["id"] == first.json()["id"]
+    assert gps_filter.snapshot([device_pk]) == state
+    assert count(Location, device_pk) == 2
+
+
+def test_without_seq_not_deduplicated(client, device_pk):
+    payload = {"id": "SEQ001", "lat": -25.2638, "lng": -57.5759}
+    assert client.post("/api/ubicaciones/", json=payload).status_code == 201
+    assert client.post("/api/ubicaciones/", json=payload).status_code == 201
+    assert count(Location, device_pk) == 4
+
+
+def test_alert_retry(client, device_pk, monkeypatch):
+    payload = {"id": "SEQ001", "evento": "tamper", "seq": 1}
+    first = client.post("/api/alertas/", json=payload)
+    assert first.status_code == 201, first.text
+
+    retry = client.post("/api/alertas/", json=payload)
+    assert retry.status_code == 200
+    assert retry.json()["duplicado"] is True
+
+    monkeypatch.setattr(ingest, "alert_seqs", ingest.RecentSeqWindow())
+    retry = client.post("/api/alertas/", json=payload)
+    assert retry.status_code == 200
+    assert count(Alert, device_pk) == 1
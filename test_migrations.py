@@ -0,0 +1,122 @@
+"""
+Migraciones versionadas del esquema (migrations.py) y /ready.
+
+Una base vacía, una creada con el esquema original (sin las columnas
+nuevas) y una creada con create_all llegan a la última versión sin
+errores ni pérdida de datos, y una segunda pasada no hace nada. El worker
+responde 503 en /ready hasta calentarse con el esquema al día. Cada base
+es un archivo SQLite temporal propio.
+
+python -m pytest -q test_migrations.py
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+
+import pytest
+
+# Configuración antes de importar la app: base temporal y sin límites ni tareas de fondo
+_workdir = tempfile.mkdtemp(prefix="migrations_")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_workdir, 'test.db')}"
+os.environ["RATE_LIMIT_ENABLED"] = "false"
+os.environ["ARCHIVE_DIR"] = os.path.join(_workdir, "archive")
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fastapi.testclient import TestClient  # noqa: E402
+from sqlalchemy import create_engine, inspect, text  # noqa: E402
+from sqlalchemy.exc import IntegrityError  # noqa: E402
+
+import migrations  # noqa: E402
+import readiness  # noqa: E402
+from database import Base, SessionLocal, engine  # noqa: E402
+from main import app  # noqa: E402
+
+# Tablas como las creaba create_all antes de las migraciones
+ORIGINAL_SCHEMA = [
+    """CREATE TABLE users (
+        id INTEGER PRIMARY KEY, email VARCHAR(100) NOT NULL UNIQUE, username VARCHAR(50) NOT NULL UNIQUE,
+        hashed_password VARCHAR(255) NOT NULL, full_name VARCHAR(100), phone VARCHAR(20),
+        is_active BOOLEAN, created_at DATETIME, updated_at DATETIME)""",
+    """CREATE TABLE devices (
+        id INTEGER PRIMARY KEY, device_id VARCHAR(50) NOT NULL UNIQUE, name VARCHAR(100) NOT NULL,
+        description TEXT, vehicle_type VARCHAR(50), owner_id INTEGER NOT NULL REFERENCES users (id),
+        security_mode BOOLEAN, is_active BOOLEAN, last_ping DATETIME, created_at DATETIME, updated_at DATETIME)""",
+    """CREATE TABLE locations (
+        id INTEGER PRIMARY KEY, device_id INTEGER NOT NULL REFERENCES devices (id),
+        latitude FLOAT NOT NULL, longitude FLOAT NOT NULL, accuracy FLOAT, speed FLOAT, altitude FLOAT,
+        timestamp DATETIME)""",
+    """CREATE TABLE alerts (
+        id INTEGER PRIMARY KEY, device_id INTEGER NOT NULL REFERENCES devices (id),
+        alert_type VARCHAR(50) NOT NULL, message TEXT, latitude FLOAT, longitude FLOAT,
+        is_read BOOLEAN, severity VARCHAR(20), timestamp DATETIME)""",
+]
+
+
+def temp_engine(name):
+    return create_engine(f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='migrations_'), name)}")
+
+
+def assert_latest(bind):
+    assert migrations.current_version(bind) == migrations.LATEST_VERSION
+    assert migrations.pending(bind) == []
+    inspector = inspect(bind)
+    for table in Base.metadata.sorted_tables:
+        present = {column["name"] for column in inspector.get_columns(table.name)}
+        assert set(table.c.keys()) <= present, table.name
+    # El único de seq es restricción con create_all e índice en una base migrada
+    indexes = {index["name"] for index in inspector.get_indexes("locations")}
+    indexes.update(constraint["name"] for constraint in inspector.get_unique_constraints("locations"))
+    assert {"uq_locations_device_seq", "ix_locations_device_timestamp"} <= indexes
+
+
+def test_empty_database():
+    bind = temp_engine("vacia.db")
+    assert migrations.current_version(bind) == 0
+    applied = migrations.upgrade(bind)
+    assert [version for version, _, _ in applied] == list(range(1, migrations.LATEST_VERSION + 1))
+    assert_latest(bind)
+    assert migrations.upgrade(bind) == []
+
+
+def test_original_schema_keeps_data():
+    bind = temp_engine("original.db")
+    with bind.begin() as conn:
+        for statement in ORIGINAL_SCHEMA:
+            conn.execute(text(statement))
+        conn.execute(text("INSERT INTO users (id, email, username, hashed_password) VALUES (1, 'a@b.c', 'a', 'x')"))
+        conn.execute(text("INSERT INTO devices (id, device_id, name, owner_id) VALUES (1, 'VIEJO', 'Auto', 1)"))
+        conn.execute(text("INSERT INTO locations (device_id, latitude, longitude, timestamp) "
+                          "VALUES (1, -25.0, -57.0, '2024-01-01 00:00:00')"))
+
+    migrations.upgrade(bind)
+    assert_latest(bind)
+    with bind.connect() as conn:
+        assert conn.execute(text("SELECT latitude, seq, is_outlier FROM locations")).all() == [(-25.0, None, None)]
+        # El índice único de seq ya protege los reintentos
+        conn.execute(text("INSERT INTO locations (device_id, latitude, longitude, seq) VALUES (1, 0, 0, 7)"))
+        with pytest.raises(IntegrityError):
+            conn.execute(text("INSERT INTO locations (device_id, latitude, longitude, seq) VALUES (1, 0, 0, 7)"))
+
+
+def test_create_all_database():
+    bind = temp_engine("create_all.db")
+    Base.metadata.create_all(bind)
+    migrations.upgrade(bind)
+    assert_latest(bind)
+
+
+def test_ready_waits_for_warm_up(monkeypatch):
+    migrations.upgrade(engine)
+    monkeypatch.setattr(readiness, "state", readiness.Readiness())
+    client = TestClient(app)
+
+    response = client.get("/ready")
+    assert response.status_code == 503
+    assert response.json()["status"] == "not_ready"
+
+    asyncio.run(readiness.warm_up(SessionLocal))
+    response = client.get("/ready")
+    assert response.status_code == 200
+    assert response.json() == {"status": "ready", "schema_version": migrations.LATEST_VERSION}
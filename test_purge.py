@@ -0,0 +1,127 @@
+"""
+Borrado del historial en segundo plano (purge.py).
+
+DELETE responde 202 con el trabajo; procesado por bloques, borra lo que
+existía al crearlo en la tabla y en el archivo frío, conserva lo que llegó
+después y reconstruye el mapa de calor. Corre en proceso con TestClient
+sobre una base SQLite temporal; los bloques se procesan a mano, sin el
+worker de fondo.
+
+python -m pytest -q test_purge.py
+"""
+
+import os
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+import pytest
+
+# Configuración antes de importar la app: base temporal y sin límites ni tareas de fondo
+_workdir = tempfile.mkdtemp(prefix="purge_")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_workdir, 'test.db')}"
+os.environ["RATE_LIMIT_ENABLED"] = "false"
+os.environ["ARCHIVE_DIR"] = os.path.join(_workdir, "archive")
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+import archive  # noqa: E402
+import heatmap  # noqa: E402
+import migrations  # noqa: E402
+import purge  # noqa: E402
+from auth_utils import create_access_token, get_password_hash  # noqa: E402
+from database import SessionLocal, engine  # noqa: E402
+from main import app  # noqa: E402
+from models import Device, Location, User  # noqa: E402
+
+ARCHIVED = 5
+IN_TABLE = 12
+
+
+@pytest.fixture(scope="module")
+def device_pk():
+    migrations.upgrade(engine)
+    db = SessionLocal()
+    user = User(email="purge@test.local", username="purge", hashed_password=get_password_hash("purge"))
+    db.add(user)
+    db.commit()
+    device = Device(device_id="PURGE001", name="Vehículo", owner_id=user.id)
+    db.add(device)
+    db.commit()
+    pk = device.id
+
+    now = datetime.utcnow()
+    db.add_all([
+        Location(device_id=pk, latitude=-25.2637, longitude=-57.5759, timestamp=now - timedelta(days=200 + n))
+        for n in range(ARCHIVED)
+    ] + [
+        Location(device_id=pk, latitude=-25.2637 + n * 1e-3, longitude=-57.5759, timestamp=now - timedelta(minutes=n))
+        for n in range(IN_TABLE)
+    ])
+    db.commit()
+    archive.archive_locations(db, older_than_days=90)
+    heatmap.rebuild(db, pk)
+    db.close()
+    return pk
+
+
+@pytest.fixture(scope="module")
+def client(device_pk):
+    client = TestClient(app)
+    client.headers["Authorization"] = f"Bearer {create_access_token({'sub': 'purge@test.local'})}"
+    return client
+
+
+def run_jobs():
+    db = SessionLocal()
+    try:
+        while (job_id := purge.claim_next_job(db)) is not None:
+            while purge.run_chunk(db, job_id):
+                pass
+    finally:
+        db.close()
+
+
+def test_purge(client, device_pk, monkeypatch):
+    monkeypatch.setattr(purge, "PURGE_CHUNK_ROWS", 5)
+    assert archive.count_rows(device_pk) == ARCHIVED
+
+    response = client.delete("/api/ubicaciones/device/PURGE001")
+    assert response.status_code == 202, response.text
+    status_url = response.json()["status_url"]
+    # Un segundo DELETE devuelve el mismo trabajo activo
+    assert client.delete("/api/ubicaciones/device/PURGE001").json()["job_id"] == response.json()["job_id"]
+    assert client.get(status_url).json()["status"] == "pending"
+
+    # Lo que llega después de crear el trabajo se conserva
+    assert client.post("/api/ubicaciones/", json={"id": "PURGE001", "lat": -25.3, "lng": -57.6}).status_code == 201
+    run_jobs()
+
+    job = client.get(status_url).json()
+    assert job["status"] == "done"
+    assert job["deleted_count"] == ARCHIVED + IN_TABLE
+    assert job["finished_at"] is not None
+
+    db = SessionLocal()
+    try:
+        assert db.query(Location).filter(Location.device_id == device_pk).count() == 1
+        assert archive.count_rows(device_pk) == 0
+        cells = heatmap.get_heatmap_cells(db, device_pk, heatmap.snap_zoom(16))
+        assert sum(cell["count"] for cell in cells) == 1
+    finally:
+        db.close()
+
+    history = client.get("/api/ubicaciones/device/PURGE001").json()
+    assert [(row["latitude"], row["longitude"]) for row in history] == [(-25.3, -57.6)]
+
+
+def test_other_users_job_not_found(client):
+    db = SessionLocal()
+    db.add(User(email="otro@test.local", username="otro", hashed_password=get_password_hash("otro")))
+    db.commit()
+    db.close()
+    job_id = client.delete("/api/ubicaciones/device/PURGE001").json()["job_id"]
+    other = TestClient(app)
+    other.headers["Authorization"] = f"Bearer {create_access_token({'sub': 'otro@test.local'})}"
+    assert other.get(f"/api/ubicaciones/purgas/{job_id}").status_code == 404
@@ -0,0 +1,112 @@
+"""
+Presupuesto de queries de los endpoints de lectura más usados.
+
+Fija con assert_max_queries cuántas queries ejecuta cada endpoint sobre
+una flota de varios dispositivos con historial y alertas: si un cambio
+introduce un N+1 (una query por dispositivo o por fila) la prueba falla
+con el SQL ejecutado. Corre en proceso con TestClient sobre una base
+SQLite temporal, sin servidor.
+
+python -m pytest -q test_query_budgets.py
+"""
+
+import os
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+import pytest
+
+# Configuración antes de importar la app: base temporal y sin límites ni tareas de fondo
+_workdir = tempfile.mkdtemp(prefix="query_budgets_")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_workdir, 'test.db')}"
+os.environ["RATE_LIMIT_ENABLED"] = "false"
+os.environ["ARCHIVE_DIR"] = os.path.join(_workdir, "archive")
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+import migrations  # noqa: E402
+from auth_utils import create_access_token, get_password_hash  # noqa: E402
+from database import SessionLocal, engine  # noqa: E402
+from main import app  # noqa: E402
+from models import Alert, Device, Location, User  # noqa: E402
+from query_profiler import assert_max_queries  # noqa: E402
+
+# Suficientes dispositivos y filas para que un N+1 se note en el conteo
+DEVICES = 20
+LOCATIONS_PER_DEVICE = 30
+ALERTS_PER_DEVICE = 5
+
+
+@pytest.fixture(scope="module")
+def client():
+    migrations.upgrade(engine)
+    db = SessionLocal()
+    user = User(email="budget@test.local", username="budget", hashed_password=get_password_hash("budget"))
+    db.add(user)
+    db.commit()
+    devices = [Device(device_id=f"BUDGET{i:03d}", name=f"Vehículo {i}", owner_id=user.id) for i in range(DEVICES)]
+    db.add_all(devices)
+    db.commit()
+
+    now = datetime.utcnow()
+    for device in devices:
+        db.add_all([
+            Location(device_id=device.id, latitude=-25.2637 + n * 1e-4, longitude=-57.5759,
+                     speed=30.0, timestamp=now - timedelta(minutes=n))
+            for n in range(LOCATIONS_PER_DEVICE)
+        ])
+        db.add_all([
+            Alert(device_id=device.id, alert_type="movimiento", message="Movimiento detectado",
+                  severity="medium", timestamp=now - timedelta(minutes=n))
+            for n in range(ALERTS_PER_DEVICE)
+        ])
+    db.commit()
+    db.close()
+
+    token = create_access_token({"sub": "budget@test.local"})
+    test_client = TestClient(app)
+    test_client.headers["Authorization"] = f"Bearer {token}"
+    return test_client
+
+
+def get(client, url, max_queries):
+    with assert_max_queries(max_queries):
+        response = client.get(url)
+    assert response.status_code == 200, response.text
+    return response
+
+
+def test_history(client):
+    # Usuario, pertenencia del dispositivo y la página del historial
+    response = get(client, "/api/ubicaciones/device/BUDGET000?limit=50", 3)
+    assert len(response.json()) == LOCATIONS_PER_DEVICE
+
+
+def test_history_cached_ownership(client):
+    get(client, "/api/ubicaciones/device/BUDGET001?limit=50", 3)
+    get(client, "/api/ubicaciones/device/BUDGET001?limit=50", 2)
+
+
+def test_stats(client):
+    response = get(client, "/api/ubicaciones/device/BUDGET000/stats", 3)
+    assert response.json()["count"] == LOCATIONS_PER_DEVICE
+
+
+def test_devices(client):
+    response = get(client, "/api/dispositivos/", 2)
+    assert len(response.json()) == DEVICES
+
+
+def test_device(client):
+    get(client, "/api/dispositivos/BUDGET000", 2)
+
+
+def test_user_locations(client):
+    get(client, "/api/ubicaciones/user", 2)
+
+
+def test_user_alerts(client):
+    response = get(client, "/api/alertas/user", 2)
+    assert len(response.json()) > 0
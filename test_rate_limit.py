@@ -0,0 +1,112 @@
+"""
+Control de admisión: 429 con Retry-After.
+
+Cubre el token bucket por dispositivo (también en la ruta rápida del
+firmware), el cupo global de ingesta y el presupuesto por usuario de la
+app, y que los ids y tokens inventados no ocupen lugar en las tablas.
+Corre en proceso con TestClient sobre una base SQLite temporal; los
+límites se activan en cada prueba con tablas chicas.
+
+python -m pytest -q test_rate_limit.py
+"""
+
+import os
+import sys
+import tempfile
+
+import pytest
+
+# Configuración antes de importar la app: base temporal y sin límites ni tareas de fondo
+_workdir = tempfile.mkdtemp(prefix="rate_limit_")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_workdir, 'test.db')}"
+os.environ["RATE_LIMIT_ENABLED"] = "false"
+os.environ["ARCHIVE_DIR"] = os.path.join(_workdir, "archive")
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+import fast_ingest  # noqa: E402
+import migrations  # noqa: E402
+import rate_limit  # noqa: E402
+from auth_utils import create_access_token, get_password_hash  # noqa: E402
+from database import SessionLocal, engine  # noqa: E402
+from main import app  # noqa: E402
+from models import Device, User  # noqa: E402
+
+BURST = 3
+
+
+@pytest.fixture(scope="module")
+def client():
+    migrations.upgrade(engine)
+    db = SessionLocal()
+    user = User(email="limits@test.local", username="limits", hashed_password=get_password_hash("limits"))
+    db.add(user)
+    db.commit()
+    db.add_all([Device(device_id=f"LIMIT{i:03d}", name=f"Vehículo {i}", owner_id=user.id) for i in range(3)])
+    db.commit()
+    db.close()
+    return TestClient(app)
+
+
+@pytest.fixture
+def limits(monkeypatch):
+    monkeypatch.setattr(rate_limit, "RATE_LIMIT_ENABLED", True)
+    monkeypatch.setattr(rate_limit, "device_buckets", rate_limit.TokenBucketTable(60, BURST))
+    monkeypatch.setattr(rate_limit, "app_buckets", rate_limit.TokenBucketTable(60, BURST))
+    monkeypatch.setattr(rate_limit, "ingest_gate", rate_limit.ConcurrencyGate(32))
+
+
+def location(device_id):
+    return {"id": device_id, "lat": -25.2637, "lng": -57.5759}
+
+
+def assert_too_many(response):
+    assert response.status_code == 429, response.text
+    assert int(response.headers["Retry-After"]) >= 1
+
+
+def test_device_burst(client, limits):
+    for _ in range(BURST):
+        assert client.post("/api/ubicaciones/", json=location("LIMIT000")).status_code == 201
+    assert_too_many(client.post("/api/ubicaciones/", json=location("LIMIT000")))
+    # La consulta de modo comparte el bucket del dispositivo
+    assert_too_many(client.get("/api/dispositivos/LIMIT000/modo"))
+    # Los demás dispositivos no se ven afectados
+    assert client.post("/api/ubicaciones/", json=location("LIMIT001")).status_code == 201
+
+
+def test_fast_path_device_burst(client, limits):
+    url = f"{fast_ingest.FAST_INGEST_PREFIX}/ubicaciones"
+    for _ in range(BURST):
+        assert client.post(url, json=location("LIMIT002")).status_code == 201
+    assert_too_many(client.post(url, json=location("LIMIT002")))
+
+
+def test_unknown_devices_get_no_bucket(client, limits):
+    for i in range(20):
+        assert client.post("/api/ubicaciones/", json=location(f"NOEXISTE{i}")).status_code == 404
+    assert len(rate_limit.device_buckets) == 0
+
+
+def test_ingest_gate_full(client, limits, monkeypatch):
+    monkeypatch.setattr(rate_limit, "ingest_gate", rate_limit.ConcurrencyGate(0))
+    assert_too_many(client.post("/api/ubicaciones/", json=location("LIMIT001")))
+    assert_too_many(client.post(f"{fast_ingest.FAST_INGEST_PREFIX}/ubicaciones", json=location("LIMIT001")))
+
+
+def test_app_budget_per_user(client, limits):
+    # El middleware envuelve la app solo si los límites estaban activos al importarla
+    limited = TestClient(rate_limit.AppRateLimitMiddleware(app))
+    headers = {"Authorization": f"Bearer {create_access_token({'sub': 'limits@test.local'})}"}
+    for _ in range(BURST):
+        assert limited.get("/api/dispositivos/", headers=headers).status_code == 200
+    assert_too_many(limited.get("/api/dispositivos/", headers=headers))
+
+
+def test_invalid_tokens_get_no_bucket(client, limits):
+    limited = TestClient(rate_limit.AppRateLimitMiddleware(app))
+    for i in range(BURST * 3):
+        response = limited.get("/api/dispositivos/", headers={"Authorization": f"Bearer inventado{i}"})
+        assert response.status_code == 401
+    assert len(rate_limit.app_buckets) == 0
@@ -0,0 +1,115 @@
+"""
+Backends del estado compartido (shared_state.py): memory, sqlite y redis.
+
+Los tres pasan por shared_state.check (clave/valor, TTL, nx, contadores y
+pub/sub) y, los que comparten estado, se prueban con dos instancias como
+si fueran dos workers. El de Redis corre contra el servidor RESP mínimo
+del propio módulo, en un hilo, sin Redis instalado.
+
+python -m pytest -q test_shared_state.py
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import shared_state  # noqa: E402
+
+
+@pytest.fixture(scope="module")
+def redis_url():
+    loop = asyncio.new_event_loop()
+    server = loop.run_until_complete(
+        asyncio.start_server(shared_state._StandInServer().handle, "127.0.0.1", 0)
+    )
+    port = server.sockets[0].getsockname()[1]
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    yield f"redis://127.0.0.1:{port}/0"
+
+    async def shutdown():
+        server.close()
+        # Las conexiones abiertas (suscripciones) quedan esperando el próximo comando
+        handlers = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in handlers:
+            task.cancel()
+        await asyncio.gather(*handlers, return_exceptions=True)
+
+    asyncio.run_coroutine_threadsafe(shutdown(), loop).result(timeout=5)
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join(timeout=5)
+    loop.close()
+
+
+@pytest.fixture(scope="module")
+def sqlite_url():
+    return f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='shared_state_'), 'estado.db')}"
+
+
+@pytest.fixture(params=["memory", "sqlite", "redis"])
+def url(request):
+    if request.param == "memory":
+        return "memory://"
+    return request.getfixturevalue(f"{request.param}_url")
+
+
+@pytest.fixture(params=["sqlite", "redis"])
+def workers(request):
+    """Dos instancias del mismo backend compartido, como dos workers"""
+    url = request.getfixturevalue(f"{request.param}_url")
+    first, second = shared_state.from_url(url), shared_state.from_url(url)
+    yield first, second
+    first.close()
+    second.close()
+
+
+def wait_for(condition, timeout=3):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.05)
+    return condition()
+
+
+def test_backend_operations(url):
+    shared_state.check(url)
+
+
+def test_from_url():
+    assert isinstance(shared_state.from_url("memory://"), shared_state.MemoryBackend)
+    assert shared_state.MemoryBackend.shared is False
+    with pytest.raises(ValueError):
+        shared_state.from_url("memcached://localhost")
+
+
+def test_values_across_workers(workers):
+    first, second = workers
+    key = f"test:{shared_state.PROCESS_ID}:valor"
+    assert first.set(key, "1", ttl=5)
+    assert second.get(key) == "1"
+    assert second.set(key, "2", nx=True) is False
+    second.delete(key)
+    assert first.get(key) is None
+
+
+def test_counters_across_workers(workers):
+    first, second = workers
+    key = f"test:{shared_state.PROCESS_ID}:contador"
+    counts = [backend.incr(key, ttl=5) for backend in (first, second, first, second)]
+    assert counts == [1, 2, 3, 4]
+
+
+def test_publish_across_workers(workers):
+    first, second = workers
+    channel = f"test:{shared_state.PROCESS_ID}:canal"
+    received = []
+    second.subscribe(channel, received.append)
+    time.sleep(shared_state.SHARED_STATE_POLL_SECONDS + 0.3)
+    first.publish(channel, "invalidar:1")
+    assert wait_for(lambda: received == ["invalidar:1"]), received
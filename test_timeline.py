@@ -0,0 +1,134 @@
+"""
+Posición en un instante dado (timeline.py) y sus endpoints.
+
+Interpolación lineal entre las ubicaciones que rodean al instante, sin
+interpolar a través de un hueco mayor que AT_MAX_GAP_SECONDS ni usar los
+fixes atípicos, y con las ubicaciones ya archivadas. Corre en proceso con
+TestClient sobre una base SQLite temporal.
+
+python -m pytest -q test_timeline.py
+"""
+
+import os
+import sys
+import tempfile
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+# Configuración antes de importar la app: base temporal y sin límites ni tareas de fondo
+_workdir = tempfile.mkdtemp(prefix="timeline_")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_workdir, 'test.db')}"
+os.environ["RATE_LIMIT_ENABLED"] = "false"
+os.environ["ARCHIVE_DIR"] = os.path.join(_workdir, "archive")
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+import archive  # noqa: E402
+import migrations  # noqa: E402
+import timeline  # noqa: E402
+from auth_utils import create_access_token, get_password_hash  # noqa: E402
+from database import SessionLocal, engine  # noqa: E402
+from main import app  # noqa: E402
+from models import Device, Location, User  # noqa: E402
+
+NOW = datetime.utcnow().replace(microsecond=0)
+# Dos fixes a 10 minutos, un atípico entre ellos y otro después de un hueco de una hora
+T0 = NOW - timedelta(hours=2)
+T1 = T0 + timedelta(minutes=10)
+T2 = T1 + timedelta(hours=1)
+# Historial viejo, que pasa al archivo frío
+OLD = NOW - timedelta(days=200)
+
+
+@pytest.fixture(scope="module")
+def client():
+    migrations.upgrade(engine)
+    db = SessionLocal()
+    user = User(email="timeline@test.local", username="timeline", hashed_password=get_password_hash("timeline"))
+    db.add(user)
+    db.commit()
+    live = Device(device_id="TL001", name="En la tabla", owner_id=user.id)
+    cold = Device(device_id="TL002", name="Archivado", owner_id=user.id)
+    db.add_all([live, cold])
+    db.commit()
+    db.add_all([
+        Location(device_id=live.id, latitude=-25.0, longitude=-57.0, timestamp=T0),
+        Location(device_id=live.id, latitude=-20.0, longitude=-50.0, timestamp=T0 + timedelta(minutes=5),
+                 is_outlier=True),
+        Location(device_id=live.id, latitude=-25.1, longitude=-57.2, timestamp=T1),
+        Location(device_id=live.id, latitude=-25.3, longitude=-57.3, timestamp=T2),
+        Location(device_id=cold.id, latitude=-24.0, longitude=-56.0, timestamp=OLD),
+        Location(device_id=cold.id, latitude=-24.2, longitude=-56.4, timestamp=OLD + timedelta(minutes=4)),
+    ])
+    db.commit()
+    archive.archive_locations(db, older_than_days=90)
+    db.close()
+
+    client = TestClient(app)
+    client.headers["Authorization"] = f"Bearer {create_access_token({'sub': 'timeline@test.local'})}"
+    return client
+
+
+def position(client, device_id, t):
+    return client.get(f"/api/ubicaciones/device/{device_id}/at", params={"t": t.isoformat()})
+
+
+def test_interpolate():
+    before, after = (T0, -25.0, -57.0), (T1, -25.1, -57.2)
+    middle = timeline.interpolate(before, after, T0 + timedelta(minutes=5))
+    assert middle.interpolated
+    assert middle.latitude == pytest.approx(-25.05)
+    assert middle.longitude == pytest.approx(-57.1)
+    assert timeline.interpolate(before, after, T0) == (-25.0, -57.0, False, T0, T1)
+    assert timeline.interpolate(before, None, T1) == (-25.0, -57.0, False, T0, None)
+    assert timeline.interpolate(None, after, T0) is None
+    # Separadas más que el máximo: la anterior, sin interpolar
+    assert not timeline.interpolate(before, after, T0 + timedelta(minutes=5), max_gap=60).interpolated
+
+
+def test_as_utc():
+    local = datetime(2024, 5, 1, 9, 0, tzinfo=timezone(timedelta(hours=-3)))
+    assert timeline.as_utc(local) == datetime(2024, 5, 1, 12, 0)
+    assert timeline.as_utc(datetime(2024, 5, 1, 12, 0)) == datetime(2024, 5, 1, 12, 0)
+
+
+def test_device_interpolated(client):
+    # A mitad de camino entre T0 y T1; el atípico de T0+5 min no cuenta
+    response = position(client, "TL001", T0 + timedelta(minutes=5))
+    assert response.status_code == 200, response.text
+    body = response.json()
+    assert body["interpolated"] is True
+    assert body["latitude"] == pytest.approx(-25.05)
+    assert body["longitude"] == pytest.approx(-57.1)
+    assert datetime.fromisoformat(body["before_at"]) == T0
+    assert datetime.fromisoformat(body["after_at"]) == T1
+
+
+def test_device_gap_not_interpolated(client):
+    body = position(client, "TL001", T1 + timedelta(minutes=30)).json()
+    assert body["interpolated"] is False
+    assert (body["latitude"], body["longitude"]) == (-25.1, -57.2)
+
+
+def test_device_before_history(client):
+    assert position(client, "TL001", T0 - timedelta(minutes=1)).status_code == 404
+
+
+def test_archived_device(client):
+    body = position(client, "TL002", OLD + timedelta(minutes=1)).json()
+    assert body["interpolated"] is True
+    assert body["latitude"] == pytest.approx(-24.05)
+    assert body["longitude"] == pytest.approx(-56.1)
+
+
+def test_fleet(client):
+    response = client.get("/api/ubicaciones/at", params={"t": (T0 + timedelta(minutes=5)).isoformat()})
+    assert response.status_code == 200, response.text
+    positions = {row["device_id"]: row for row in response.json()}
+    assert set(positions) == {"TL001", "TL002"}
+    assert positions["TL001"]["interpolated"] is True
+    # Del archivado solo se conoce la última ubicación, de hace 200 días
+    assert positions["TL002"]["interpolated"] is False
+    assert positions["TL002"]["latitude"] == -24.2
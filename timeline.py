@@ -0,0 +1,116 @@
+"""
+Posición de los dispositivos en un instante dado.
+
+Para cada dispositivo se buscan las dos ubicaciones que rodean al instante
+(la última hasta `at` y la primera posterior) y se interpola linealmente
+entre ellas. En la tabla son dos subconsultas correlacionadas por
+dispositivo, cada una un seek en el índice (device_id, timestamp), todas
+dentro de una sola query para la flota entera. Si la tabla no tiene una
+ubicación anterior, se busca en el archivo frío por búsqueda binaria sobre
+los timestamps de cada mes (los meses de cada dispositivo están en la caché
+de archive.py: sin listar directorios por petición).
+
+Si las dos ubicaciones están separadas más de AT_MAX_GAP_SECONDS (el
+dispositivo estuvo apagado) no se interpola: se devuelve la anterior.
+"""
+
+import os
+from collections import namedtuple
+from datetime import timezone
+
+from sqlalchemy import select, union_all
+
+import archive
+from models import Device, Location
+
+AT_MAX_GAP_SECONDS = float(os.getenv("AT_MAX_GAP_SECONDS", "900"))
+
+Position = namedtuple("Position", ("latitude", "longitude", "interpolated", "before_at", "after_at"))
+
+
+def as_utc(at):
+    """Instante en UTC naive, como se guardan los timestamps"""
+    if at.tzinfo is not None:
+        at = at.astimezone(timezone.utc).replace(tzinfo=None)
+    return at
+
+
+def _neighbor_id(at, before):
+    """Subconsulta escalar: id de la ubicación anterior (o posterior) a `at` del dispositivo"""
+    table = Location.__table__
+    if before:
+        condition = table.c.timestamp <= at
+        order = (table.c.timestamp.desc(), table.c.id.desc())
+    else:
+        condition = table.c.timestamp > at
+        order = (table.c.timestamp, table.c.id)
+    return select(table.c.id).where(
+        table.c.device_id == Device.__table__.c.id,
+        condition,
+        table.c.is_outlier.isnot(True)
+    ).order_by(*order).limit(1).scalar_subquery()
+
+
+def brackets(db, device_pks, device_filter, at):
+    """
+    {device pk: (device_id, nombre, anterior, posterior)} con (ts, lat, lng)
+    o None. `device_filter` es la condición sobre Device.id equivalente a
+    `device_pks` (lista o subconsulta, ver ownership_cache).
+    """
+    neighbor_ids = union_all(
+        select(_neighbor_id(at, True)).where(device_filter),
+        select(_neighbor_id(at, False)).where(device_filter),
+    )
+    rows = db.query(
+        Location.device_id, Device.device_id, Device.name,
+        Location.timestamp, Location.latitude, Location.longitude
+    ).join(Device, Device.id == Location.device_id).filter(
+        Location.id.in_(neighbor_ids)
+    ).all()
+
+    found = {}
+    for device_pk, device_id, name, ts, lat, lng in rows:
+        entry = found.setdefault(device_pk, [device_id, name, None, None])
+        entry[2 if ts <= at else 3] = (ts, lat, lng)
+
+    # Sin ubicación anterior en la tabla: puede estar en el archivo frío
+    unnamed = []
+    for device_pk in device_pks:
+        entry = found.get(device_pk)
+        if entry is not None and entry[2] is not None:
+            continue
+        archived_before, archived_after = archive.bracket(device_pk, at)
+        if archived_before is None:
+            continue
+        if entry is None:
+            entry = found[device_pk] = [None, None, None, None]
+            unnamed.append(device_pk)
+        entry[2] = archived_before
+        if entry[3] is None or (archived_after is not None and archived_after[0] < entry[3][0]):
+            entry[3] = archived_after
+
+    if unnamed:
+        for device_pk, device_id, name in db.query(Device.id, Device.device_id, Device.name).filter(
+            Device.id.in_(unnamed)
+        ):
+            found[device_pk][:2] = device_id, name
+    return {device_pk: tuple(entry) for device_pk, entry in found.items()}
+
+
+def interpolate(before, after, at, max_gap=AT_MAX_GAP_SECONDS):
+    """Posición en `at` entre dos (ts, lat, lng); None si no hay ubicación anterior"""
+    if before is None:
+        return None
+    before_at, before_lat, before_lng = before
+    if after is None:
+        return Position(before_lat, before_lng, False, before_at, None)
+    after_at, after_lat, after_lng = after
+    span = (after_at - before_at).total_seconds()
+    if before_at == at or span <= 0 or span > max_gap:
+        return Position(before_lat, before_lng, False, before_at, after_at)
+    fraction = (at - before_at).total_seconds() / span
+    return Position(
+        before_lat + (after_lat - before_lat) * fraction,
+        before_lng + (after_lng - before_lng) * fraction,
+        True, before_at, after_at
+    )
@@ -0,0 +1,152 @@
+"""
+Cliente de prueba de la ingesta UDP/TCP (udp_ingest.py).
+
+Envía registros en el formato de compact_codec.py como lo haría un
+rastreador y cuenta los acks por estado.
+
+Uso:
+    # 1000 ubicaciones por UDP del dispositivo ESP32SIM800001
+    python udp_client.py --device ESP32SIM800001 --count 1000
+
+    # Por TCP persistente, una alerta
+    python udp_client.py --tcp --port 5006 --event movimiento --count 1
+
+    # Solo consultar el modo seguridad
+    python udp_client.py --poll
+"""
+
+import argparse
+import asyncio
+import time
+from collections import Counter
+
+import compact_codec as codec
+
+STATUS_NAMES = {
+    codec.STATUS_OK: "ok",
+    codec.STATUS_DUPLICATE: "duplicado",
+    codec.STATUS_DISCARDED: "descartado",
+    codec.STATUS_NOT_FOUND: "no encontrado",
+    codec.STATUS_INVALID: "inválido",
+    codec.STATUS_RATE_LIMITED: "límite",
+    codec.STATUS_BUSY: "ocupado",
+    codec.STATUS_ERROR: "error",
+}
+
+
+def build_records(args):
+    seq_start = args.seq_start if args.seq_start is not None else int(time.time())
+    records = []
+    for i in range(args.count):
+        if args.poll:
+            records.append(codec.encode_record(args.device))
+            continue
+        records.append(codec.encode_record(
+            args.device,
+            lat=args.lat + i * 1e-5,
+            lng=args.lng,
+            seq=seq_start + i,
+            ts=time.time(),
+            event=args.event,
+        ))
+    return records
+
+
+class _AckCollector:
+    def __init__(self, expected, window):
+        self.expected = expected
+        self.statuses = Counter()
+        self.security_mode = None
+        self.done = asyncio.get_running_loop().create_future()
+        # Registros enviados sin ack todavía (control de flujo del cliente)
+        self.in_flight = asyncio.Semaphore(window)
+
+    def ack(self, data):
+        status, mode, _ = codec.decode_ack(data)
+        self.statuses[status] += 1
+        self.security_mode = mode
+        self.in_flight.release()
+        if sum(self.statuses.values()) >= self.expected and not self.done.done():
+            self.done.set_result(None)
+
+
+class _UdpClient(asyncio.DatagramProtocol):
+    def __init__(self, collector):
+        self.collector = collector
+
+    def datagram_received(self, data, addr):
+        self.collector.ack(data)
+
+
+class _TcpClient(asyncio.Protocol):
+    def __init__(self, collector):
+        self.collector = collector
+        self.pending = bytearray()
+
+    def data_received(self, data):
+        self.pending += data
+        while len(self.pending) >= codec.ACK.size:
+            self.collector.ack(bytes(self.pending[:codec.ACK.size]))
+            del self.pending[:codec.ACK.size]
+
+
+async def main(args):
+    loop = asyncio.get_running_loop()
+    records = build_records(args)
+    collector = _AckCollector(len(records), args.window)
+
+    if args.tcp:
+        transport, _ = await loop.create_connection(lambda: _TcpClient(collector), args.host, args.port)
+        send = transport.write
+    else:
+        transport, _ = await loop.create_datagram_endpoint(
+            lambda: _UdpClient(collector), remote_addr=(args.host, args.port)
+        )
+        send = transport.sendto
+
+    print(f"🚀 Enviando {len(records)} registros por {'TCP' if args.tcp else 'UDP'} a {args.host}:{args.port}")
+    start = time.perf_counter()
+    for record in records:
+        try:
+            await asyncio.wait_for(collector.in_flight.acquire(), args.timeout)
+        except asyncio.TimeoutError:
+            break
+        send(record)
+    try:
+        await asyncio.wait_for(collector.done, args.timeout)
+    except asyncio.TimeoutError:
+        pass
+    elapsed = time.perf_counter() - start
+    transport.close()
+
+    received = sum(collector.statuses.values())
+    summary = ", ".join(f"{STATUS_NAMES.get(status, status)}: {count}"
+                        for status, count in sorted(collector.statuses.items()))
+    print(f"Acks: {received}/{len(records)} en {elapsed:.2f} s ({received / elapsed:.0f}/s) - {summary}")
+    if collector.security_mode is not None:
+        print(f"Modo seguridad: {'ACTIVADO' if collector.security_mode else 'DESACTIVADO'}")
+    if received == len(records) and set(collector.statuses) <= {codec.STATUS_OK, codec.STATUS_DUPLICATE}:
+        print("✅ Todos los registros fueron aceptados")
+    else:
+        print("❌ Hubo registros sin ack o rechazados")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Cliente de prueba de la ingesta UDP/TCP")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5005)
+    parser.add_argument("--tcp", action="store_true", help="Usar una conexión TCP persistente")
+    parser.add_argument("--device", default="ESP32SIM800001", help="device_id del rastreador")
+    parser.add_argument("--count", type=int, default=100, help="Registros a enviar")
+    parser.add_argument("--event", choices=sorted(codec.EVENT_NUMBERS), help="Enviar alertas de este evento")
+    parser.add_argument("--poll", action="store_true", help="Solo consultar el modo seguridad")
+    parser.add_argument("--seq-start", type=int, help="Primer seq (por defecto la hora actual)")
+    parser.add_argument("--lat", type=float, default=-25.2637)
+    parser.add_argument("--lng", type=float, default=-57.5759)
+    parser.add_argument("--window", type=int, default=256, help="Máximo de registros sin ack")
+    parser.add_argument("--timeout", type=float, default=10, help="Segundos a esperar los acks")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
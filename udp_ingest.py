@@ -0,0 +1,167 @@
+"""
+Ingesta por UDP (y TCP persistente) con el formato de compact_codec.py.
+
+Con el SIM800 cada POST HTTP cuesta segundos de AT+HTTPINIT/AT+HTTPACTION
+y cientos de bytes. Por UDP el rastreador manda un datagrama de ~30 bytes
+por fix y recibe un ack de 7 bytes con el modo seguridad actual, así que ya
+no necesita consultar /modo aparte.
+
+Los datagramas se decodifican en el loop y los registros pasan por una cola
+acotada a un worker que los guarda por lotes (en un thread, con un solo
+commit por lote) con compact_ingest.store_records, que usa las mismas
+funciones de ingest.py que los routers: rate limit por dispositivo,
+idempotencia por seq, filtro GPS, heartbeat. Los acks salen después del
+commit. Si la cola está llena se responde STATUS_BUSY sin guardar y el
+dispositivo reintenta.
+
+Se activa con UDP_INGEST_ENABLED=true y corre dentro de la app (main.py).
+Para probarlo localmente: python udp_client.py --count 1000
+"""
+
+import asyncio
+import logging
+import os
+import socket
+from functools import partial
+
+import compact_codec as codec
+import compact_ingest
+
+UDP_INGEST_ENABLED = os.getenv("UDP_INGEST_ENABLED", "false").lower() == "true"
+UDP_INGEST_HOST = os.getenv("UDP_INGEST_HOST", "0.0.0.0")
+UDP_INGEST_PORT = int(os.getenv("UDP_INGEST_PORT", "5005"))
+TCP_INGEST_PORT = int(os.getenv("TCP_INGEST_PORT", "0"))  # 0 = sin TCP
+UDP_INGEST_BATCH = int(os.getenv("UDP_INGEST_BATCH", "256"))
+UDP_INGEST_QUEUE = int(os.getenv("UDP_INGEST_QUEUE", "50000"))
+
+# Buffer de recepción del socket para absorber ráfagas
+RECV_BUFFER_BYTES = 4 * 1024 * 1024
+
+# Un cliente TCP que manda basura sin completar registros se desconecta
+MAX_TCP_PENDING_BYTES = 64 * 1024
+
+logger = logging.getLogger("udp_ingest")
+
+
+class IngestServer:
+    """Cola de registros decodificados y el worker que los guarda por lotes"""
+
+    def __init__(self, session_factory, batch_size=UDP_INGEST_BATCH, queue_size=UDP_INGEST_QUEUE):
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.queue = asyncio.Queue(queue_size)
+
+    def submit(self, records, reply):
+        """Encolar registros; `reply(ack)` se llama con la respuesta de cada uno"""
+        for record in records:
+            try:
+                self.queue.put_nowait((record, reply))
+            except asyncio.QueueFull:
+                reply(codec.encode_ack(codec.STATUS_BUSY, seq=record.seq))
+
+    def store_batch(self, batch):
+        """Guardar un lote con un solo commit; devuelve los acks en orden"""
+        results = compact_ingest.store_records(self.session_factory, [record for record, _ in batch])
+        return [
+            codec.encode_ack(status, security_mode, record.seq)
+            for (record, _), (status, security_mode) in zip(batch, results)
+        ]
+
+    async def run(self):
+        """Worker: vacía la cola en lotes de hasta batch_size registros"""
+        from starlette.concurrency import run_in_threadpool
+
+        while True:
+            batch = [await self.queue.get()]
+            while len(batch) < self.batch_size and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            try:
+                acks = await run_in_threadpool(self.store_batch, batch)
+            except Exception:
+                logger.exception("Error al guardar un lote de %s registros", len(batch))
+                acks = [codec.encode_ack(codec.STATUS_ERROR, seq=record.seq) for record, _ in batch]
+            for (_, reply), ack in zip(batch, acks):
+                reply(ack)
+
+
+class _UdpProtocol(asyncio.DatagramProtocol):
+    def __init__(self, server):
+        self.server = server
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+        sock = transport.get_extra_info("socket")
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RECV_BUFFER_BYTES)
+        except OSError:
+            pass
+
+    def datagram_received(self, data, addr):
+        reply = partial(self.transport.sendto, addr=addr)
+        try:
+            records, consumed = codec.decode_records(data)
+        except codec.CodecError:
+            reply(codec.encode_ack(codec.STATUS_INVALID))
+            return
+        if consumed != len(data) or not records:
+            # Un datagrama trae registros completos
+            reply(codec.encode_ack(codec.STATUS_INVALID))
+            return
+        self.server.submit(records, reply)
+
+    def error_received(self, exc):
+        logger.warning("Error en el socket UDP: %s", exc)
+
+
+class _TcpProtocol(asyncio.Protocol):
+    """Conexión persistente: registros seguidos en el stream, un ack por registro"""
+
+    def __init__(self, server):
+        self.server = server
+        self.transport = None
+        self.pending = bytearray()
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def reply(self, ack):
+        if not self.transport.is_closing():
+            self.transport.write(ack)
+
+    def data_received(self, data):
+        self.pending += data
+        try:
+            records, consumed = codec.decode_records(self.pending)
+        except codec.CodecError:
+            # Se perdió el encuadre del stream: no hay forma de resincronizar
+            self.reply(codec.encode_ack(codec.STATUS_INVALID))
+            self.transport.close()
+            return
+        del self.pending[:consumed]
+        if len(self.pending) > MAX_TCP_PENDING_BYTES:
+            self.transport.close()
+            return
+        if records:
+            self.server.submit(records, self.reply)
+
+
+async def serve(session_factory, host=UDP_INGEST_HOST, udp_port=UDP_INGEST_PORT, tcp_port=TCP_INGEST_PORT):
+    """Tarea de fondo: abrir los sockets y procesar registros hasta ser cancelada"""
+    loop = asyncio.get_running_loop()
+    server = IngestServer(session_factory)
+
+    transport, _ = await loop.create_datagram_endpoint(
+        lambda: _UdpProtocol(server), local_addr=(host, udp_port)
+    )
+    tcp_server = None
+    if tcp_port:
+        tcp_server = await loop.create_server(lambda: _TcpProtocol(server), host, tcp_port)
+    logger.info("Ingesta UDP en %s:%s%s", host, udp_port, f" y TCP en {tcp_port}" if tcp_port else "")
+
+    try:
+        await server.run()
+    finally:
+        transport.close()
+        if tcp_server is not None:
+            tcp_server.close()
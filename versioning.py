@@ -0,0 +1,167 @@
+"""
+Sellos de versión para los GET que la app consulta periódicamente.
+
+Cada escritura incrementa un contador (por usuario o por dispositivo,
+según lo que cambió) después de su commit. Los endpoints devuelven ese
+contador como ETag y, si el cliente lo envía en If-None-Match y no
+cambió, responden 304 sin tocar la BD ni serializar:
+el usuario sale del token y de un mapa email -> id que llena
+get_current_user, y el dispositivo de la caché de pertenencia.
+
+El mapa solo guarda cuentas activas, con LRU y TTL (USER_CACHE_TTL):
+desactivar una cuenta la quita en este worker y, por el canal USERS_CHANNEL
+del estado compartido, en los demás, así el 304 no sobrevive a la cuenta.
+
+Los contadores viven en el estado compartido (shared_state), así que con
+varios workers una escritura atendida por otro worker también cambia el
+ETag. El ETag incluye una época guardada junto a los contadores: si el
+estado se pierde (reinicio con memory://, Redis vaciado) la época es otra
+y no coincide con ninguno anterior. Con memory:// y varios workers los
+contadores serían de cada proceso: usar otro backend o ETAG_ENABLED=false.
+Con réplica de lectura viene desactivado: la réplica podría devolver datos
+anteriores a la versión ya incrementada y la app los guardaría con ese
+ETag.
+"""
+
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from fastapi import Response, status
+
+import ownership_cache
+import shared_state
+from database import REPLICA_DATABASE_URL
+
+ETAG_ENABLED = os.getenv("ETAG_ENABLED", "false" if REPLICA_DATABASE_URL else "true").lower() == "true"
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "300"))
+USER_CACHE_MAX_USERS = int(os.getenv("USER_CACHE_MAX_USERS", "100000"))
+
+# Qué cambió (cada endpoint depende de uno)
+USER_DEVICES = "ud"        # lista de dispositivos del usuario (incluye last_ping)
+USER_ALERTS = "ua"         # alertas de todos los dispositivos del usuario
+DEVICE_LOCATIONS = "dl"    # ubicaciones de un dispositivo
+DEVICE_ALERTS = "da"       # alertas de un dispositivo
+
+EPOCH_KEY = "v:epoch"
+
+USERS_CHANNEL = "users"
+
+
+class UserIds:
+    """email -> id de las cuentas activas, con LRU y TTL; cada proceso lo aprende en get_current_user"""
+
+    def __init__(self, ttl=USER_CACHE_TTL, max_users=USER_CACHE_MAX_USERS):
+        self.ttl = ttl
+        self.max_users = max_users
+        self._ids = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, email):
+        with self._lock:
+            entry = self._ids.get(email)
+            if entry is None:
+                return None
+            user_id, stored_at = entry
+            if time.monotonic() - stored_at >= self.ttl:
+                del self._ids[email]
+                return None
+            self._ids.move_to_end(email)
+            return user_id
+
+    def remember(self, email, user_id):
+        with self._lock:
+            self._ids[email] = (user_id, time.monotonic())
+            self._ids.move_to_end(email)
+            while len(self._ids) > self.max_users:
+                self._ids.popitem(last=False)
+
+    def forget(self, email):
+        with self._lock:
+            self._ids.pop(email, None)
+
+
+users = UserIds()
+
+
+def _new_epoch():
+    """Época del estado compartido; la primera vez la crea un solo worker"""
+    shared_state.backend.set(EPOCH_KEY, uuid.uuid4().hex[:8], nx=True)
+    return shared_state.backend.get(EPOCH_KEY)
+
+
+def bump(kind, key):
+    """Registrar un cambio ya confirmado (llamar después del commit)"""
+    shared_state.backend.incr(f"v:{kind}:{key}")
+
+
+def bump_user(user_id):
+    """Cambió algo de la flota del usuario (dispositivos, activación, modo)"""
+    bump(USER_DEVICES, user_id)
+    bump(USER_ALERTS, user_id)
+
+
+def bump_alerts(user_id, device_pk):
+    bump(DEVICE_ALERTS, device_pk)
+    bump(USER_ALERTS, user_id)
+
+
+def etag(kind, key):
+    """ETag débil de la versión actual (None si ETAG_ENABLED=false)"""
+    if not ETAG_ENABLED or key is None:
+        return None
+    epoch, version = shared_state.backend.get_many((EPOCH_KEY, f"v:{kind}:{key}"))
+    if epoch is None:
+        # Estado nuevo o perdido: época nueva, las versiones anteriores no valen
+        epoch = _new_epoch()
+    return f'W/"{epoch}.{kind}{key}.{version or 0}"'
+
+
+def remember_user(email, user_id):
+    users.remember(email, user_id)
+
+
+def forget_user(email):
+    """La cuenta se desactivó: sin 304 en este worker ni en los demás"""
+    users.forget(email)
+    shared_state.backend.publish(USERS_CHANNEL, f"{shared_state.PROCESS_ID}:{email}")
+
+
+def _on_forget(message):
+    process_id, _, email = message.partition(":")
+    if process_id != shared_state.PROCESS_ID:
+        users.forget(email)
+
+
+def listen():
+    """Recibir las cuentas desactivadas en los demás workers (al arrancar la app)"""
+    shared_state.backend.subscribe(USERS_CHANNEL, _on_forget)
+
+
+def user_etag(email, kind):
+    """ETag del usuario sin consultar la BD; None si aún no se lo conoce"""
+    user_id = users.get(email)
+    return etag(kind, user_id) if user_id is not None else None
+
+
+def device_etag(db, email, device_id, kind):
+    """ETag de un dispositivo del usuario (pertenencia desde la caché); None si no se sabe"""
+    user_id = users.get(email)
+    if user_id is None or not ETAG_ENABLED:
+        return None
+    return etag(kind, ownership_cache.device_pk(db, user_id, device_id))
+
+
+def matches(if_none_match, current):
+    """Comparación débil de If-None-Match contra el ETag actual"""
+    if not if_none_match or current is None:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip() in (current, current[2:]) for tag in if_none_match.split(","))
+
+
+def not_modified(current):
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": current})